@@ -0,0 +1,134 @@
+import heapq
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from outbound import priority, PRIORITY_ANIMATION
+from utils import logger, safe_edit_message_text
+
+class Animation:
+    """Анимация одного сообщения: кадры (текст, задержка) и финальный текст"""
+
+    def __init__(self, chat_id, message_id, frames, final_text, reply_markup=None, pause=0):
+        # Без message_id результат отправляется новым сообщением и ничего не вытесняет
+        self.key = (chat_id, message_id if message_id is not None else id(self))
+        self.chat_id = chat_id
+        self.message_id = message_id
+        self.frames = frames
+        self.final_text = final_text
+        self.reply_markup = reply_markup
+        self.started = time.monotonic()
+        # Время показа каждого кадра и финала относительно старта
+        self.due = []
+        offset = 0
+        for _, delay in frames:
+            self.due.append(offset)
+            offset += delay
+        self.final_due = offset + pause
+        self.next_frame = 0
+
+
+class AnimationScheduler:
+    """Планировщик анимаций сообщений.
+
+    Хендлер ставит анимацию в очередь и сразу возвращается. Поток
+    планировщика держит кучу (время, анимация) и отдает шаги пулу отправки;
+    следующий кадр сообщения планируется только после отправки предыдущего,
+    так что правки одного сообщения идут по порядку. Если отправка отстает,
+    из кадров, чье время уже прошло, показывается только последний, а
+    финальный кадр с результатом доставляется всегда.
+    """
+
+    def __init__(self, bot, workers=4):
+        self.bot = bot
+        self._cond = threading.Condition()
+        self._queue = []
+        self._active = {}
+        self._seq = 0
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="animation")
+        self._thread = None
+        self.frames_sent = 0
+        self.frames_skipped = 0
+
+    def play(self, chat_id, message_id, frames, final_text, reply_markup=None, pause=0):
+        """Проиграть кадры и показать final_text; новая анимация того же сообщения вытесняет старую.
+
+        message_id=None - кадров нет, final_text через pause секунд уходит
+        новым сообщением (результат нативного send_dice).
+        """
+        animation = Animation(chat_id, message_id, frames, final_text, reply_markup, pause)
+        with self._cond:
+            self._active[animation.key] = animation
+            # Без кадров первым шагом сразу идет финал - через pause
+            self._push(animation, animation.started + (0 if frames else animation.final_due))
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="animation-scheduler", daemon=True)
+                self._thread.start()
+        return animation
+
+    def _push(self, animation, due):
+        self._seq += 1
+        heapq.heappush(self._queue, (due, self._seq, animation))
+        self._cond.notify()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while not self._queue or self._queue[0][0] > time.monotonic():
+                    timeout = self._queue[0][0] - time.monotonic() if self._queue else None
+                    self._cond.wait(timeout)
+                _, _, animation = heapq.heappop(self._queue)
+                if self._active.get(animation.key) is not animation:
+                    continue
+            self._pool.submit(self._step, animation)
+
+    def _step(self, animation):
+        elapsed = time.monotonic() - animation.started
+        index = animation.next_frame
+        if index < len(animation.frames) and elapsed < animation.final_due:
+            while index + 1 < len(animation.frames) and animation.due[index + 1] <= elapsed:
+                index += 1
+            skipped = index - animation.next_frame
+            self._edit(animation, animation.frames[index][0])
+            animation.next_frame = index + 1
+            if animation.next_frame < len(animation.frames):
+                next_due = animation.due[animation.next_frame]
+            else:
+                next_due = animation.final_due
+            with self._cond:
+                # Счетчики меняют шаги из разных потоков пула
+                self.frames_skipped += skipped
+                self.frames_sent += 1
+                if self._active.get(animation.key) is animation:
+                    self._push(animation, animation.started + next_due)
+            return
+
+        with self._cond:
+            self.frames_skipped += len(animation.frames) - index
+            if self._active.get(animation.key) is not animation:
+                return
+            del self._active[animation.key]
+        if animation.message_id is None:
+            try:
+                self.bot.send_message(animation.chat_id, animation.final_text,
+                                      reply_markup=animation.reply_markup, parse_mode="HTML")
+            except Exception as e:
+                logger.error(f"Failed to send animation result to {animation.chat_id}: {e}")
+            return
+        safe_edit_message_text(self.bot, animation.final_text, animation.chat_id, animation.message_id,
+                               reply_markup=animation.reply_markup)
+
+    def stats(self):
+        with self._cond:
+            return {
+                "active": len(self._active),
+                "frames_sent": self.frames_sent,
+                "frames_skipped": self.frames_skipped,
+            }
+
+    def _edit(self, animation, text):
+        try:
+            # Промежуточные кадры пропускают вперед платежи и ответы на нажатия
+            with priority(PRIORITY_ANIMATION):
+                self.bot.edit_message_text(text=text, chat_id=animation.chat_id, message_id=animation.message_id)
+        except Exception as e:
+            logger.debug(f"Animation frame skipped for {animation.key}: {e}")
@@ -0,0 +1,122 @@
+"""Розыгрыш на синтетической базе с миллионами билетов.
+
+Замеряет пути, которыми идет lottery_draw_job: поиск наступивших розыгрышей,
+поиск владельца номера по индексу и проведение розыгрыша одной транзакцией.
+С --full-scan для сравнения загружает все билеты через get_all_tickets, как
+выбирался бы победитель без поиска по номеру.
+
+    python benchmarks/lottery_draws.py --tickets 5000000
+"""
+import argparse
+import bisect
+import os
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+
+# database.py открывает DB_PATH при импорте: база бенчмарка - во временном каталоге
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="darkcase-bench-"), "casino.db")
+
+import database
+
+DRAW_DATE = "2001-01-07"
+USER_ID_BASE = 8_000_000_000
+INSERT_CHUNK = 100_000
+
+
+def seed(tickets, players, max_range, rng):
+    """Билеты номерами 1..tickets диапазонами до max_range; возвращает число строк"""
+    connection = database.get_connection()
+    with database.transaction():
+        connection.executemany(
+            "INSERT INTO users (user_id, username, created_at) VALUES (?, ?, 0)",
+            ((USER_ID_BASE + i, f"bench{i}") for i in range(players))
+        )
+    rows, number, chunk = 0, 1, []
+    while number <= tickets:
+        count = min(rng.randint(1, max_range), tickets - number + 1)
+        chunk.append((USER_ID_BASE + rng.randrange(players), number, count, DRAW_DATE))
+        number += count
+        if len(chunk) == INSERT_CHUNK or number > tickets:
+            with database.transaction():
+                connection.executemany(
+                    "INSERT INTO lottery_tickets (user_id, ticket_number, ticket_count, draw_date, created_at) "
+                    "VALUES (?, ?, ?, ?, 0)", chunk
+                )
+            rows += len(chunk)
+            chunk = []
+    with database.transaction():
+        connection.execute(
+            "INSERT INTO lottery_draws (lottery_id, draw_date, tickets, players) VALUES (0, ?, ?, ?)",
+            (DRAW_DATE, tickets, players)
+        )
+    connection.execute("ANALYZE")
+    return rows
+
+
+def timed(func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - started
+
+
+def bench_lookups(tickets, lookups, rng):
+    """Среднее время поиска владельца случайного номера, мкс"""
+    numbers = [rng.randint(1, tickets) for _ in range(lookups)]
+    started = time.perf_counter()
+    for number in numbers:
+        assert database._find_ticket_owner("lottery_tickets", "draw_date", DRAW_DATE, number)
+    return (time.perf_counter() - started) / lookups * 1e6
+
+
+def bench_full_scan(tickets, rng):
+    """Выбор победителя по списку всех билетов: (секунд, пик памяти в МБ)"""
+    tracemalloc.start()
+    started = time.perf_counter()
+    ranges = database.get_all_tickets(DRAW_DATE)
+    starts = [first for _, first, _ in ranges]
+    number = rng.randint(1, tickets)
+    assert ranges[bisect.bisect_right(starts, number) - 1]
+    elapsed = time.perf_counter() - started
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return elapsed, peak / 2**20
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Бенчмарк розыгрыша на синтетических билетах")
+    parser.add_argument("--tickets", type=int, default=5_000_000)
+    parser.add_argument("--players", type=int, default=100_000)
+    parser.add_argument("--max-range", type=int, default=1, help="билетов в одной покупке (1 - строка на билет)")
+    parser.add_argument("--lookups", type=int, default=10_000)
+    parser.add_argument("--full-scan", action="store_true", help="сравнить с загрузкой всех билетов")
+    parser.add_argument("--seed", type=int, default=None)
+    args = parser.parse_args()
+    rng = random.Random(args.seed)
+
+    rows, elapsed = timed(seed, args.tickets, args.players, args.max_range, rng)
+    print(f"Заполнение: {args.tickets:,} билетов ({rows:,} строк), {elapsed:.1f} с")
+
+    due, elapsed = timed(database.get_due_lottery_draws, DRAW_DATE)
+    assert due == [DRAW_DATE]
+    print(f"get_due_lottery_draws: {elapsed * 1e3:.2f} мс")
+
+    print(f"_find_ticket_owner: {bench_lookups(args.tickets, args.lookups, rng):.1f} мкс на номер")
+
+    ticket_count = database.get_lottery_ticket_count(DRAW_DATE)
+    result, elapsed = timed(database.settle_lottery_draw, DRAW_DATE, rng.randint(1, ticket_count), 1000)
+    assert result
+    print(f"settle_lottery_draw: {elapsed * 1e3:.2f} мс (победитель {result[0]}, билет #{result[2]})")
+    assert database.settle_lottery_draw(DRAW_DATE, 1, 1000) is None
+    assert database.get_due_lottery_draws(DRAW_DATE) == []
+
+    if args.full_scan:
+        elapsed, peak = bench_full_scan(args.tickets, rng)
+        print(f"get_all_tickets + bisect: {elapsed:.2f} с, пик памяти {peak:.0f} МБ")
+
+
+if __name__ == "__main__":
+    main()
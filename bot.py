@@ -7,6 +7,8 @@ import sys
 import string
 import threading
 import uuid
+import atexit
+from concurrent.futures import ThreadPoolExecutor
 from telebot import types
 from telebot.apihelper import ApiException
 from datetime import datetime, timedelta
@@ -18,55 +20,157 @@ from games import Roulette, Dice, StonePaperScissors, SlotMachine, BlackJack, Ac
 from keyboards import *
 from utils import *
 from admin import is_admin
-
-bot = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+from router import CallbackRouter
+from animations import AnimationScheduler
+from outbound import OutboundQueue, QueuedBot, priority, PRIORITY_PAYMENT
+from broadcast import BroadcastEngine
+from media import MediaCache
+from webhook import WebhookServer, WebhookEndpoint, telegram_secret_verifier, cryptobot_signature_verifier
+from lanes import UserMailboxPool
+from payments import credit_webhook_updates, poll_pending_payments, sweep_expired_payments
+
+# Все отправки и правки сообщений идут через общую очередь с лимитами Bot API
+outbound = OutboundQueue(
+    global_rate=OUTBOUND_GLOBAL_RATE,
+    private_rate=OUTBOUND_PRIVATE_RATE,
+    group_rate=OUTBOUND_GROUP_RATE_PER_MIN,
+    burst=OUTBOUND_CHAT_BURST,
+    workers=OUTBOUND_WORKERS,
+)
+telegram = telebot.TeleBot(BOT_TOKEN, parse_mode="HTML")
+
+# Апдейты одного пользователя обрабатываются строго по очереди (нет двойных
+# ставок с одного баланса), разных пользователей - параллельно
+handler_pool = UserMailboxPool(workers=HANDLER_WORKERS)
+telegram.worker_pool.close()
+telegram.worker_pool = handler_pool
+
+bot = QueuedBot(telegram, outbound)
 logger.info("Бот запускается...")
 
 # Устанавливаем инстанс бота для utils
 set_bot_instance(bot)
 
+# Username и id бота для реферальных ссылок запрашиваем один раз
+bot_info.start(bot, BOT_INFO_REFRESH_INTERVAL)
+
+# Анимации сундуков и слотов проигрываются в фоне, не занимая воркеры telebot
+animations = AnimationScheduler(bot, workers=ANIMATION_WORKERS)
+
+# Картинки меню держим в памяти и отправляем по file_id после первой загрузки
+media = MediaCache("images")
+media.preload()
+
+# Рассылки идут в фоне и продолжаются после перезапуска
+broadcasts = BroadcastEngine(bot, chunk_size=BROADCAST_CHUNK_SIZE, progress_interval=BROADCAST_PROGRESS_INTERVAL)
+
 # Глобальные переменные
 sponsor_channels_cache = None
 sponsor_channels_time = 0
+sponsor_channels_version = -1
 CACHE_DURATION = 300  # 5 минут
 
+# Результаты проверки подписки: user_id -> (результат, версия спонсоров), LRU со сроком жизни
+subscription_cache = TTLCache(SUBSCRIPTION_CACHE_SIZE)
+subscription_pool = ThreadPoolExecutor(max_workers=SUBSCRIPTION_CHECK_WORKERS, thread_name_prefix="subscription")
+
 # Функция для автоматического перезапуска бота при ошибках
 def restart_bot():
     """Перезапуск бота при критической ошибке"""
     logger.info("Перезапуск бота...")
+    flush_counters()
     time.sleep(5)
     os.execv(sys.executable, [sys.executable] + sys.argv)
 
+def process_webhook_updates(raw_updates):
+    """Передать обновления из вебхука обработчикам telebot"""
+    bot.process_new_updates([types.Update.de_json(update) for update in raw_updates])
+
+def process_cryptobot_updates(raw_updates):
+    """Зачесть счета из вебхуков CryptoBot invoice_paid"""
+    credit_webhook_updates(raw_updates, on_credited=notify_payment_credited)
+
+def start_webhook_server():
+    """HTTP-сервер для вебхуков Telegram и CryptoBot, если они включены"""
+    server = WebhookServer(host=WEBHOOK_HOST, port=WEBHOOK_PORT)
+    if UPDATE_MODE == "webhook":
+        # Без секрета любой, кто достучится до порта, сможет прислать поддельный апдейт (в т.ч. оплату)
+        if not WEBHOOK_SECRET:
+            raise RuntimeError("UPDATE_MODE=webhook requires WEBHOOK_SECRET")
+        server.add_endpoint(WebhookEndpoint(
+            WEBHOOK_PATH, process_webhook_updates, verify=telegram_secret_verifier(WEBHOOK_SECRET)
+        ))
+    if CRYPTOBOT_WEBHOOK_ENABLED:
+        server.add_endpoint(WebhookEndpoint(
+            CRYPTOBOT_WEBHOOK_PATH, process_cryptobot_updates, verify=cryptobot_signature_verifier(CRYPTOBOT_TOKEN)
+        ))
+    if server.endpoints:
+        server.start()
+    return server
+
+def run_webhook():
+    """Прием обновлений через вебхук вместо long polling (сервер уже запущен)"""
+    if WEBHOOK_URL:
+        bot.set_webhook(
+            url=WEBHOOK_URL,
+            secret_token=WEBHOOK_SECRET,
+            max_connections=WEBHOOK_MAX_CONNECTIONS,
+        )
+        logger.info(f"Webhook set to {WEBHOOK_URL}")
+    else:
+        logger.warning("WEBHOOK_URL is not set, webhook must be registered manually")
+    threading.Event().wait()
+
 def get_sponsor_channels_cached():
     """Кэшированный список спонсорских каналов"""
-    global sponsor_channels_cache, sponsor_channels_time
+    global sponsor_channels_cache, sponsor_channels_time, sponsor_channels_version
     
     current_time = time.time()
-    if sponsor_channels_cache is None or (current_time - sponsor_channels_time) > CACHE_DURATION:
+    version = get_sponsors_version()
+    if (sponsor_channels_cache is None or (current_time - sponsor_channels_time) > CACHE_DURATION
+            or version != sponsor_channels_version):
         sponsor_channels_cache = get_sponsor_channels()
         sponsor_channels_time = current_time
+        sponsor_channels_version = version
     
     return sponsor_channels_cache
 
-def check_subscription(user_id):
-    """Проверка подписки на все спонсорские каналы"""
+def is_channel_member(channel_username, user_id):
+    """Подписан ли пользователь на канал"""
+    try:
+        member = bot.get_chat_member(chat_id=channel_username, user_id=user_id)
+        return member.status in ['member', 'administrator', 'creator']
+    except Exception as e:
+        logger.error(f"Error checking subscription to {channel_username}: {e}")
+        # Если ошибка, считаем что не подписан для безопасности
+        return False
+
+def check_subscription(user_id, force=False):
+    """Проверка подписки на все спонсорские каналы (с кэшем; force - проверить заново)"""
     sponsors = get_sponsor_channels_cached()
     
     if not sponsors:
         return True, None, None  # Нет спонсоров - пропускаем проверку
     
-    for channel_username, channel_name in sponsors:
-        try:
-            # Проверяем подписку пользователя на канал
-            member = bot.get_chat_member(chat_id=channel_username, user_id=user_id)
-            if member.status not in ['member', 'administrator', 'creator']:
-                return False, channel_username, channel_name
-        except Exception as e:
-            logger.error(f"Error checking subscription to {channel_username}: {e}")
-            # Если ошибка, считаем что не подписан для безопасности
-            return False, channel_username, channel_name
-    
-    return True, None, None
+    version = get_sponsors_version()
+    cached = subscription_cache.get(user_id)
+    if not force and cached and cached[1] == version:
+        return cached[0]
+    
+    # Все каналы проверяем параллельно
+    checks = [
+        (channel_username, channel_name, subscription_pool.submit(is_channel_member, channel_username, user_id))
+        for channel_username, channel_name in sponsors
+    ]
+    result = (True, None, None)
+    for channel_username, channel_name, future in checks:
+        if not future.result():
+            result = (False, channel_username, channel_name)
+            break
+    
+    ttl = SUBSCRIPTION_CACHE_TTL if result[0] else SUBSCRIPTION_NEGATIVE_TTL
+    subscription_cache.set(user_id, (result, version), ttl)
+    return result
 
 def check_whitelist_and_subscription(user_id):
     """Проверка белого списка и подписки"""
@@ -87,12 +191,9 @@ def check_whitelist_and_subscription(user_id):
 def send_with_image(chat_id, text, image_name, reply_markup=None):
     """Отправить сообщение с изображением"""
     try:
-        image_path = f"images/{image_name}"
-        
-        if os.path.exists(image_path):
+        if media.has(image_name):
             try:
-                with open(image_path, 'rb') as photo:
-                    bot.send_photo(chat_id, photo, caption=text, reply_markup=reply_markup, parse_mode="HTML")
+                media.send_photo(bot, chat_id, image_name, caption=text, reply_markup=reply_markup, parse_mode="HTML")
                 return True
             except Exception as e:
                 logger.error(f"Error sending image {image_name}: {e}")
@@ -102,7 +203,7 @@ def send_with_image(chat_id, text, image_name, reply_markup=None):
         else:
             # Если изображение не найдено
             bot.send_message(chat_id, text, reply_markup=reply_markup, parse_mode="HTML")
-            logger.warning(f"Image not found: {image_path}")
+            logger.warning(f"Image not found: images/{image_name}")
             return False
     except Exception as e:
         logger.error(f"Error in send_with_image: {e}")
@@ -141,6 +242,8 @@ def start_command(message):
             return
     
     try:
+        # Пользователь снова запустил бота - возвращаем его в рассылки
+        clear_bot_blocked(uid)
         user_data = get_user(uid)
         referrer_id = 0
         
@@ -190,14 +293,12 @@ def start_command(message):
         else:
             # Пользователь уже существует, обновляем username если изменился
             if user_data[1] != username:
-                cursor.execute("UPDATE users SET username=? WHERE user_id=?", (username, uid))
-                conn.commit()
+                update_username(uid, username)
             
             # Если пользователь пришел по реферальной ссылке, но у него нет реферера
             if referrer_id > 0 and referrer_id != uid and user_data[14] == 0:  # referrer_id в users таблице
                 # Обновляем реферера в базе данных
-                cursor.execute("UPDATE users SET referrer_id=? WHERE user_id=?", (referrer_id, uid))
-                conn.commit()
+                set_referrer(uid, referrer_id)
                 
                 # Начисляем бонусы рефереру
                 add_referral(referrer_id)
@@ -250,7 +351,7 @@ def start_command(message):
 https://telegra.ph/Polzovatelskoe-soglashenie-01-02-14
 
 🔗 <b>Ваша реф.ссылка:</b>
-<code>https://t.me/{bot.get_me().username}?start={uid}</code>
+<code>{bot_info.referral_link(uid)}</code>
 {bonus_text}
 """
         
@@ -434,8 +535,7 @@ def lottery_menu(message):
     lottery_stats = get_lottery_stats(draw_date)
     ticket_count = lottery_stats[1] if lottery_stats else 0
     
-    user_tickets = get_user_tickets(uid, draw_date)
-    user_tickets_count = len(user_tickets)
+    user_tickets_count = get_user_ticket_count(uid, draw_date)
     
     jackpot = Lottery.get_current_jackpot(ticket_count)
     
@@ -622,15 +722,16 @@ def process_successful_payment(message):
         user_data = get_user(user_id)
         current_balance = user_data[2] if user_data else 0
         
-        send_with_image(
-            user_id,
-            f"✅ <b>ОПЛАТА УСПЕШНО ПРИНЯТА!</b>\n\n"
-            f"💎 <b>На ваш баланс зачислено:</b> +{diamonds_received} алмазов\n"
-            f"⭐ <b>Оплачено:</b> {stars_amount} Telegram Stars\n"
-            f"💰 <b>Новый баланс:</b> {current_balance}💎\n\n"
-            f"Спасибо за покупку! Приятной игры! 🎰",
-            "profile.jpg"
-        )
+        with priority(PRIORITY_PAYMENT):
+            send_with_image(
+                user_id,
+                f"✅ <b>ОПЛАТА УСПЕШНО ПРИНЯТА!</b>\n\n"
+                f"💎 <b>На ваш баланс зачислено:</b> +{diamonds_received} алмазов\n"
+                f"⭐ <b>Оплачено:</b> {stars_amount} Telegram Stars\n"
+                f"💰 <b>Новый баланс:</b> {current_balance}💎\n\n"
+                f"Спасибо за покупку! Приятной игры! 🎰",
+                "profile.jpg"
+            )
         
         logger.info(f"Stars payment processed for user {user_id}: {stars_amount} stars = {diamonds_received} diamonds")
         
@@ -643,65 +744,106 @@ def process_successful_payment(message):
 
 # ========== КОЛБЭКИ ==========
 
-@bot.callback_query_handler(func=lambda call: True)
-@callback_rate_limit(seconds=RATE_LIMIT_SECONDS)
-def callback_handler(call):
+router = CallbackRouter(rate_limit=RATE_LIMIT_SECONDS, check_access=True, needs_user=True)
+
+@router.guard("rate_limit")
+def rate_limit_guard(call, seconds, context):
+    """Не чаще одного колбэка в seconds секунд от пользователя"""
     uid = call.from_user.id
-    
-    try:
-        # ПРОВЕРКА ПОДПИСКИ
-        if call.data == "check_subscription":
-            subscribed, channel_username, channel_name = check_subscription(uid)
-            if subscribed:
-                bot.answer_callback_query(call.id, "✅ Отлично! Вы подписаны на все каналы")
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-                # Показываем главное меню
-                send_with_image(
-                    uid,
-                    "🎉 <b>Добро пожаловать в DARKCASE!</b>\n\n"
-                    "Теперь вы можете пользоваться всеми функциями бота.",
-                    "welcome.jpg",
-                    main_keyboard(is_admin(uid))
-                )
-            else:
-                bot.answer_callback_query(
-                    call.id,
-                    f"❌ Вы не подписан на канал {channel_name}",
-                    show_alert=True
-                )
-            return
-        
-        # Проверка подписки для всех остальных действий
-        check_result = check_whitelist_and_subscription(uid)
-        if not check_result[0]:
-            if check_result[1] == "subscription":
-                channel_username, channel_name = check_result[2], check_result[3]
-                sponsors = get_sponsor_channels_cached()
-                
-                text = f"📺 <b>Для использования бота необходимо подписаться на наш канал:</b>\n\n"
-                for sp_username, sp_name in sponsors:
-                    text += f"• {sp_name} - @{sp_username[1:] if sp_username.startswith('@') else sp_username}\n"
-                
-                text += f"\nПосле подписки нажмите кнопку '✅ Я подписался'"
-                
-                safe_edit_message_text(
-                    bot,
-                    text,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=sponsors_keyboard(sponsors)
-                )
-            return
+    now = time.time()
+    if now - last_callback_time.get(uid, 0) < seconds:
+        logger.warning(f"Callback rate limit exceeded for user {uid}")
+        bot.answer_callback_query(call.id, "⏳ Слишком быстро! Подождите секунду...")
+        return False
+    last_callback_time[uid] = now
+
+@router.guard("check_access")
+def access_guard(call, enabled, context):
+    """Белый список и подписка на спонсоров"""
+    check_result = check_whitelist_and_subscription(call.from_user.id)
+    if check_result[0]:
+        return True
+    if check_result[1] == "subscription":
+        sponsors = get_sponsor_channels_cached()
         
-        user_data = get_user(uid)
+        text = f"📺 <b>Для использования бота необходимо подписаться на наш канал:</b>\n\n"
+        for sp_username, sp_name in sponsors:
+            text += f"• {sp_name} - @{sp_username[1:] if sp_username.startswith('@') else sp_username}\n"
         
-        if not user_data:
-            bot.answer_callback_query(call.id, "❌ Сначала напишите /start")
-            return
+        text += f"\nПосле подписки нажмите кнопку '✅ Я подписался'"
         
-        # ПОПОЛНЕНИЕ: ВЫБОР СПОСОБА
-        if call.data == "payment_stars":
-            text = """
+        safe_edit_message_text(
+            bot,
+            text,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=sponsors_keyboard(sponsors)
+        )
+    return False
+
+@router.guard("needs_user")
+def user_guard(call, enabled, context):
+    """Пользователь должен быть зарегистрирован через /start"""
+    user_data = get_user(call.from_user.id)
+    if not user_data:
+        bot.answer_callback_query(call.id, "❌ Сначала напишите /start")
+        return False
+    context["user_data"] = user_data
+
+@router.guard("admin_only")
+def admin_guard(call, enabled, context):
+    if not is_admin(call.from_user.id):
+        bot.answer_callback_query(call.id, "❌ Доступ запрещен")
+        return False
+
+def unknown_callback(call):
+    bot.answer_callback_query(call.id, "⏳ Обработка...")
+
+def bad_callback_params(call, error):
+    logger.error(f"Bad callback data {call.data}: {error}")
+    bot.answer_callback_query(call.id, "❌ Ошибка обработки запроса")
+
+def callback_error(call, error):
+    logger.error(f"Error in callback {call.data}: {error}")
+    try:
+        bot.answer_callback_query(call.id, "❌ Произошла ошибка")
+    except:
+        pass
+
+router.fallback = unknown_callback
+router.on_bad_params = bad_callback_params
+router.on_error = callback_error
+
+@bot.callback_query_handler(func=lambda call: True)
+def callback_handler(call):
+    router.dispatch(call)
+
+# ПРОВЕРКА ПОДПИСКИ
+@router.route("check_subscription", check_access=False, needs_user=False)
+def cb_check_subscription(call, uid, user_data):
+    subscribed, channel_username, channel_name = check_subscription(uid, force=True)
+    if subscribed:
+        bot.answer_callback_query(call.id, "✅ Отлично! Вы подписаны на все каналы")
+        bot.delete_message(call.message.chat.id, call.message.message_id)
+        # Показываем главное меню
+        send_with_image(
+            uid,
+            "🎉 <b>Добро пожаловать в DARKCASE!</b>\n\n"
+            "Теперь вы можете пользоваться всеми функциями бота.",
+            "welcome.jpg",
+            main_keyboard(is_admin(uid))
+        )
+    else:
+        bot.answer_callback_query(
+            call.id,
+            f"❌ Вы не подписан на канал {channel_name}",
+            show_alert=True
+        )
+
+# ПОПОЛНЕНИЕ: ВЫБОР СПОСОБА
+@router.route("payment_stars")
+def cb_payment_stars(call, uid, user_data):
+    text = """
 <b>⭐ ПОПОЛНЕНИЕ TELEGRAM STARS</b>
 
 💎 <b>Курс:</b> 1 Telegram Star = 9 алмазов
@@ -719,16 +861,17 @@ def callback_handler(call):
 
 💡 После оплаты алмазы начисляются автоматически!
 """
-            safe_edit_message_text(
-                bot,
-                text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=buy_stars_keyboard()
-            )
-        
-        elif call.data == "payment_cryptobot":
-            text = """
+    safe_edit_message_text(
+        bot,
+        text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=buy_stars_keyboard()
+    )
+
+@router.route("payment_cryptobot")
+def cb_payment_cryptobot(call, uid, user_data):
+    text = """
 <b>🤖 ПОПОЛНЕНИЕ CRYPTOBOT</b>
 
 💎 <b>Курс:</b> 100💎 = 0.32$
@@ -744,72 +887,73 @@ def callback_handler(call):
 • BTC
 • ETH
 """
-            safe_edit_message_text(
-                bot,
-                text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=buy_cryptobot_keyboard()
+    safe_edit_message_text(
+        bot,
+        text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=buy_cryptobot_keyboard()
+    )
+
+# ПОПОЛНЕНИЕ ЗВЕЗДАМИ: ГОТОВЫЕ ПАКЕТЫ
+@router.route(prefix="stars_", params=(str,))
+def cb_stars(call, uid, user_data, package):
+    stars_packages = {
+        "stars_1": 1,
+        "stars_10": 10,
+        "stars_50": 50,
+        "stars_100": 100,
+        "stars_200": 200,
+        "stars_500": 500,
+        "stars_1000": 1000
+    }
+    
+    if package == "custom":
+        # Запрос пользовательской суммы
+        msg = bot.send_message(
+            uid,
+            "📝 <b>ВВЕДИТЕ КОЛИЧЕСТВО ЗВЕЗД</b>\n\n"
+            "Отправьте число от 1 до 1000:\n\n"
+            "💎 <b>Курс:</b> 1 Telegram Star = 9 алмазов"
+        )
+        bot.register_next_step_handler(msg, process_custom_stars_amount)
+        bot.answer_callback_query(call.id)
+        return
+    
+    if call.data in stars_packages:
+        stars_amount = stars_packages[call.data]
+        diamonds_amount = stars_amount * 9  # Курс: 1 звезда = 9 алмазов
+        
+        # Создаем счет на оплату
+        success = create_stars_invoice(uid, stars_amount, diamonds_amount)
+        if success:
+            bot.answer_callback_query(call.id, "✅ Счет на оплату создан")
+        else:
+            bot.answer_callback_query(call.id, "❌ Ошибка создания счета")
+
+# ОБМЕН АЛМАЗОВ НА TELEGRAM STARS ПОДАРКИ
+@router.route(prefix="exchange_", params=(str,))
+def cb_exchange(call, uid, user_data, exchange_type):
+    
+    from config import EXCHANGE_RATES
+    if exchange_type in EXCHANGE_RATES:
+        gift_info = EXCHANGE_RATES[exchange_type]
+        stars_amount = gift_info["stars"]
+        diamonds_cost = gift_info["diamonds"]
+        gift_name = gift_info["name"]
+        gift_emoji = gift_info["emoji"]
+        
+        # Проверяем баланс
+        if user_data[2] < diamonds_cost:
+            bot.answer_callback_query(
+                call.id,
+                f"❌ Недостаточно алмазов!\nНужно: {diamonds_cost}💎\nУ вас: {user_data[2]}💎",
+                show_alert=True
             )
+            return
         
-        # ПОПОЛНЕНИЕ ЗВЕЗДАМИ: ГОТОВЫЕ ПАКЕТЫ
-        elif call.data.startswith("stars_"):
-            stars_packages = {
-                "stars_1": 1,
-                "stars_10": 10,
-                "stars_50": 50,
-                "stars_100": 100,
-                "stars_200": 200,
-                "stars_500": 500,
-                "stars_1000": 1000
-            }
-            
-            if call.data == "stars_custom":
-                # Запрос пользовательской суммы
-                msg = bot.send_message(
-                    uid,
-                    "📝 <b>ВВЕДИТЕ КОЛИЧЕСТВО ЗВЕЗД</b>\n\n"
-                    "Отправьте число от 1 до 1000:\n\n"
-                    "💎 <b>Курс:</b> 1 Telegram Star = 9 алмазов"
-                )
-                bot.register_next_step_handler(msg, process_custom_stars_amount)
-                bot.answer_callback_query(call.id)
-                return
-            
-            if call.data in stars_packages:
-                stars_amount = stars_packages[call.data]
-                diamonds_amount = stars_amount * 9  # Курс: 1 звезда = 9 алмазов
-                
-                # Создаем счет на оплату
-                success = create_stars_invoice(uid, stars_amount, diamonds_amount)
-                if success:
-                    bot.answer_callback_query(call.id, "✅ Счет на оплату создан")
-                else:
-                    bot.answer_callback_query(call.id, "❌ Ошибка создания счета")
-        
-        # ОБМЕН АЛМАЗОВ НА TELEGRAM STARS ПОДАРКИ
-        elif call.data.startswith("exchange_"):
-            exchange_type = call.data.replace("exchange_", "")
-            
-            from config import EXCHANGE_RATES
-            if exchange_type in EXCHANGE_RATES:
-                gift_info = EXCHANGE_RATES[exchange_type]
-                stars_amount = gift_info["stars"]
-                diamonds_cost = gift_info["diamonds"]
-                gift_name = gift_info["name"]
-                gift_emoji = gift_info["emoji"]
-                
-                # Проверяем баланс
-                if user_data[2] < diamonds_cost:
-                    bot.answer_callback_query(
-                        call.id,
-                        f"❌ Недостаточно алмазов!\nНужно: {diamonds_cost}💎\nУ вас: {user_data[2]}💎",
-                        show_alert=True
-                    )
-                    return
-                
-                # Показываем подтверждение
-                confirm_text = f"""
+        # Показываем подтверждение
+        confirm_text = f"""
 <b>🔄 ПОДТВЕРЖДЕНИЕ ОБМЕНА</b>
 
 📋 <b>Детали обмена:</b>
@@ -825,87 +969,88 @@ def callback_handler(call):
 
 Подтверждаете обмен?
 """
-                safe_edit_message_text(
-                    bot,
-                    confirm_text,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=confirm_exchange_keyboard(exchange_type)
-                )
+        safe_edit_message_text(
+            bot,
+            confirm_text,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=confirm_exchange_keyboard(exchange_type)
+        )
+
+# ПОДТВЕРЖДЕНИЕ ОБМЕНА
+@router.route(prefix="confirm_exchange_", params=(str,))
+def cb_confirm_exchange(call, uid, user_data, exchange_type):
+    
+    from config import EXCHANGE_RATES
+    if exchange_type in EXCHANGE_RATES:
+        gift_info = EXCHANGE_RATES[exchange_type]
+        stars_amount = gift_info["stars"]
+        diamonds_cost = gift_info["diamonds"]
+        gift_name = gift_info["name"]
+        gift_emoji = gift_info["emoji"]
+        
+        # Проверяем баланс еще раз
+        if user_data[2] < diamonds_cost:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+            return
         
-        # ПОДТВЕРЖДЕНИЕ ОБМЕНА
-        elif call.data.startswith("confirm_exchange_"):
-            exchange_type = call.data.replace("confirm_exchange_", "")
-            
-            from config import EXCHANGE_RATES
-            if exchange_type in EXCHANGE_RATES:
-                gift_info = EXCHANGE_RATES[exchange_type]
-                stars_amount = gift_info["stars"]
-                diamonds_cost = gift_info["diamonds"]
-                gift_name = gift_info["name"]
-                gift_emoji = gift_info["emoji"]
-                
-                # Проверяем баланс еще раз
-                if user_data[2] < diamonds_cost:
-                    bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
-                    return
-                
-                # Списываем алмазы
-                update_balance(uid, -diamonds_cost, f"exchange_{exchange_type}")
-                
-                # Создаем заявку на обмен
-                username = user_data[1] or f"ID {uid}"
-                request_id = create_exchange_request(
-                    uid, username, stars_amount, gift_name, gift_emoji, diamonds_cost
-                )
-                
-                # Уведомляем пользователя
-                bot.answer_callback_query(call.id, "✅ Заявка создана!")
-                
-                safe_edit_message_text(
-                    bot,
-                    f"✅ <b>ЗАЯВКА НА ОБМЕН СОЗДАНА!</b>\n\n"
-                    f"📋 <b>Детали заявки:</b>\n"
-                    f"• ID заявки: #{request_id}\n"
-                    f"• Вы получаете: {gift_emoji} {gift_name}\n"
-                    f"• Стоимость: {diamonds_cost}💎\n"
-                    f"• Эквивалент: ⭐ {stars_amount} Telegram Stars\n"
-                    f"• Новый баланс: {user_data[2] - diamonds_cost}💎\n\n"
-                    f"⏱ <b>Статус:</b> Ожидание обработки администратором\n"
-                    f"💡 Обычно обработка занимает 5-30 минут.\n"
-                    f"Вы получите уведомление когда заявка будет выполнена.",
-                    call.message.chat.id,
-                    call.message.message_id
-                )
-                
-                # Уведомляем администраторов с кнопками
-                notify_admins_about_exchange_immediate(request_id, uid, username, stars_amount, gift_name, gift_emoji, diamonds_cost)
-                
-                logger.info(f"User {uid} created exchange request #{request_id}: {exchange_type}")
+        # Списываем алмазы
+        update_balance(uid, -diamonds_cost, f"exchange_{exchange_type}")
         
-        # ОТМЕНА ОБМЕНА
-        elif call.data == "cancel_exchange":
-            safe_edit_message_text(
-                bot,
-                "❌ <b>ОБМЕН ОТМЕНЕН</b>\n\n"
-                "Вы можете выбрать другой подарок или вернуться в главное меню.",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=exchange_menu_keyboard()
-            )
+        # Создаем заявку на обмен
+        username = user_data[1] or f"ID {uid}"
+        request_id = create_exchange_request(
+            uid, username, stars_amount, gift_name, gift_emoji, diamonds_cost
+        )
         
-        # СУНДУКИ: ВЫБОР КАТЕГОРИИ
-        elif call.data == "game_cases":
-            free_cases = user_data[3]
-            events = check_event()
-            event_text = ""
-            if events:
-                event_text = "\n\n<b>🎪 Активные ивенты:</b>\n"
-                for event in events:
-                    event_text += f"• {event.get('name')}\n"
-            
-            bot_username = bot.get_me().username
-            cases_text = f"""
+        # Уведомляем пользователя
+        bot.answer_callback_query(call.id, "✅ Заявка создана!")
+        
+        safe_edit_message_text(
+            bot,
+            f"✅ <b>ЗАЯВКА НА ОБМЕН СОЗДАНА!</b>\n\n"
+            f"📋 <b>Детали заявки:</b>\n"
+            f"• ID заявки: #{request_id}\n"
+            f"• Вы получаете: {gift_emoji} {gift_name}\n"
+            f"• Стоимость: {diamonds_cost}💎\n"
+            f"• Эквивалент: ⭐ {stars_amount} Telegram Stars\n"
+            f"• Новый баланс: {user_data[2] - diamonds_cost}💎\n\n"
+            f"⏱ <b>Статус:</b> Ожидание обработки администратором\n"
+            f"💡 Обычно обработка занимает 5-30 минут.\n"
+            f"Вы получите уведомление когда заявка будет выполнена.",
+            call.message.chat.id,
+            call.message.message_id
+        )
+        
+        # Уведомляем администраторов с кнопками
+        notify_admins_about_exchange_immediate(request_id, uid, username, stars_amount, gift_name, gift_emoji, diamonds_cost)
+        
+        logger.info(f"User {uid} created exchange request #{request_id}: {exchange_type}")
+
+# ОТМЕНА ОБМЕНА
+@router.route("cancel_exchange")
+def cb_cancel_exchange(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "❌ <b>ОБМЕН ОТМЕНЕН</b>\n\n"
+        "Вы можете выбрать другой подарок или вернуться в главное меню.",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=exchange_menu_keyboard()
+    )
+
+# СУНДУКИ: ВЫБОР КАТЕГОРИИ
+@router.route("game_cases")
+def cb_game_cases(call, uid, user_data):
+    free_cases = user_data[3]
+    events = check_event()
+    event_text = ""
+    if events:
+        event_text = "\n\n<b>🎪 Активные ивенты:</b>\n"
+        for event in events:
+            event_text += f"• {event.get('name')}\n"
+    
+    cases_text = f"""
 <b>🎁 Выберите сундук</b>
 
 У вас: <b>{free_cases}</b> деревянных сундуков{event_text}
@@ -918,173 +1063,186 @@ def callback_handler(call):
 • 🪨 Незеритовый - 500💎
 
 💡 Пригласи друга и получи +1 деревянный сундук!
-🔗 Ссылка: https://t.me/{bot_username}?start={uid}
+🔗 Ссылка: {bot_info.referral_link(uid)}
 """
-            safe_edit_message_text(
-                bot,
-                cases_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=cases_keyboard(free_cases)
-            )
-        
-        elif call.data == "game_minigames":
-            safe_edit_message_text(
-                bot,
-                "<b>🎮 Выберите игру</b>\n\n"
-                "Минимальная ставка: <b>10💎</b>\n"
-                "Баланс: <b>{}💎</b>".format(user_data[2]),
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=games_keyboard()
-            )
-        
-        elif call.data == "back_games_menu":
-            safe_edit_message_text(
-                bot,
-                "<b>🎮 Выберите категорию</b>\n\n"
-                "Выберите что вас интересует:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=games_menu_keyboard()
-            )
-        
-        # ПРОФИЛЬ: СТАТИСТИКА
-        elif call.data == "profile_stats":
-            stats_text = format_stats(user_data)
-            safe_edit_message_text(
-                bot,
-                stats_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=profile_keyboard()
-            )
-        
-        # ПРОФИЛЬ: УРОВНИ
-        elif call.data == "levels_info":
-            level_info = get_user_level(uid)
-            level_text = format_level_info(level_info, user_data)
-            safe_edit_message_text(
-                bot,
-                level_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=profile_keyboard()
-            )
-        
-        # ПРОФИЛЬ: АКТИВНОСТЬ
-        elif call.data == "activity_info":
-            daily_info = get_daily_info(uid)
-            streak_days = daily_info[0] if daily_info else 0
-            activity_data = get_user_activity(uid)
-            
-            if activity_data:
-                activity_text, can_claim_streak, can_claim_first_game, streak_bonus, first_game_bonus = format_activity_info(activity_data, streak_days)
-                safe_edit_message_text(
-                    bot,
-                    activity_text,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=profile_keyboard()
-                )
-        
-        # ПРОФИЛЬ: ИСТОРИЯ ПОКУПОК
-        elif call.data == "payment_history":
-            # Показываем историю покупок
-            text = "<b>💳 ИСТОРИЯ ПОКУПОК</b>\n\n"
-            
-            # Telegram Stars платежи
-            stars_payments = get_user_stars_payments(uid, 5)
-            if stars_payments:
-                text += "<b>⭐ Telegram Stars:</b>\n"
-                for payment in stars_payments:
-                    stars_amount, diamonds_received, status, created_at = payment
-                    time_str = time.strftime('%d.%m.%Y %H:%M', time.localtime(created_at))
-                    text += f"• {time_str}: {stars_amount}⭐ → {diamonds_received}💎 ({status})\n"
-                text += "\n"
-            
-            # CryptoBot платежи
-            crypto_payments = get_user_payments(uid, 5)
-            if crypto_payments:
-                text += "<b>🤖 CryptoBot:</b>\n"
-                for payment in crypto_payments:
-                    amount, status, created_at = payment
-                    time_str = time.strftime('%d.%m.%Y %H:%M', time.localtime(created_at))
-                    text += f"• {time_str}: {amount}💎 ({status})\n"
-            
-            if not stars_payments and not crypto_payments:
-                text += "У вас еще нет покупок."
-            
-            safe_edit_message_text(
-                bot,
-                text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=profile_keyboard()
-            )
-        
-        # ПРОФИЛЬ: ВВОД ПРОМОКОДА
-        elif call.data == "enter_promo":
-            msg = bot.send_message(
-                uid,
-                "🎫 <b>ВВЕДИТЕ ПРОМОКОД</b>\n\n"
-                "Отправьте промокод для получения награды:"
-            )
-            bot.register_next_step_handler(msg, process_promo_code)
-            bot.answer_callback_query(call.id)
-        
-        # ТОПЫ
-        elif call.data == "top_balance":
-            from database import get_top_balance
-            top_users = get_top_balance(10)
-            
-            text = "🏆 <b>ТОП ПО БАЛАНСУ</b>\n\n"
-            for i, (username, balance) in enumerate(top_users, 1):
-                text += f"{i}. @{username or 'Неизвестно'} - {balance}💎\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
-        
-        elif call.data == "top_refs":
-            from database import get_top_refs
-            top_users = get_top_refs(10)
-            
-            text = "👥 <b>ТОП ПО РЕФЕРАЛАМ</b>\n\n"
-            for i, (username, refs) in enumerate(top_users, 1):
-                text += f"{i}. @{username or 'Неизвестно'} - {refs} реф.\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
-        
-        elif call.data == "top_wins":
-            from database import get_top_players
-            top_users = get_top_players(10)
-            
-            text = "🏆 <b>ТОП ПО ПОБЕДАМ</b>\n\n"
-            for i, (username, wins) in enumerate(top_users, 1):
-                text += f"{i}. @{username or 'Неизвестно'} - {wins} побед\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
-        
-        elif call.data == "top_levels":
-            from database import get_top_levels
-            top_users = get_top_levels(10)
-            
-            text = "⭐ <b>ТОП ПО УРОВНЯМ</b>\n\n"
-            for i, (username, level, total_exp) in enumerate(top_users, 1):
-                text += f"{i}. @{username or 'Неизвестно'} - Уровень {level} ({total_exp} опыта)\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
-        
-        # ЗАДАНИЯ
-        elif call.data == "my_quests":
-            from database import get_weekly_quests
-            from utils import format_weekly_quests
-            
-            quests = get_weekly_quests(uid)
-            text = format_weekly_quests(quests)
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
-        
-        elif call.data == "quest_rewards":
-            text = """
+    safe_edit_message_text(
+        bot,
+        cases_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=cases_keyboard(free_cases)
+    )
+
+@router.route("game_minigames")
+def cb_game_minigames(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "<b>🎮 Выберите игру</b>\n\n"
+        "Минимальная ставка: <b>10💎</b>\n"
+        "Баланс: <b>{}💎</b>".format(user_data[2]),
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=games_keyboard()
+    )
+
+@router.route("back_games_menu")
+def cb_back_games_menu(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "<b>🎮 Выберите категорию</b>\n\n"
+        "Выберите что вас интересует:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=games_menu_keyboard()
+    )
+
+# ПРОФИЛЬ: СТАТИСТИКА
+@router.route("profile_stats")
+def cb_profile_stats(call, uid, user_data):
+    stats_text = format_stats(user_data)
+    safe_edit_message_text(
+        bot,
+        stats_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=profile_keyboard()
+    )
+
+# ПРОФИЛЬ: УРОВНИ
+@router.route("levels_info")
+def cb_levels_info(call, uid, user_data):
+    level_info = get_user_level(uid)
+    level_text = format_level_info(level_info, user_data)
+    safe_edit_message_text(
+        bot,
+        level_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=profile_keyboard()
+    )
+
+# ПРОФИЛЬ: АКТИВНОСТЬ
+@router.route("activity_info")
+def cb_activity_info(call, uid, user_data):
+    daily_info = get_daily_info(uid)
+    streak_days = daily_info[0] if daily_info else 0
+    activity_data = get_user_activity(uid)
+    
+    if activity_data:
+        activity_text, can_claim_streak, can_claim_first_game, streak_bonus, first_game_bonus = format_activity_info(activity_data, streak_days)
+        safe_edit_message_text(
+            bot,
+            activity_text,
+            call.message.chat.id,
+            call.message.message_id,
+            reply_markup=profile_keyboard()
+        )
+
+# ПРОФИЛЬ: ИСТОРИЯ ПОКУПОК
+@router.route("payment_history")
+def cb_payment_history(call, uid, user_data):
+    # Показываем историю покупок
+    text = "<b>💳 ИСТОРИЯ ПОКУПОК</b>\n\n"
+    
+    # Telegram Stars платежи
+    stars_payments = get_user_stars_payments(uid, 5)
+    if stars_payments:
+        text += "<b>⭐ Telegram Stars:</b>\n"
+        for payment in stars_payments:
+            stars_amount, diamonds_received, status, created_at = payment
+            time_str = time.strftime('%d.%m.%Y %H:%M', time.localtime(created_at))
+            text += f"• {time_str}: {stars_amount}⭐ → {diamonds_received}💎 ({status})\n"
+        text += "\n"
+    
+    # CryptoBot платежи
+    crypto_payments = get_user_payments(uid, 5)
+    if crypto_payments:
+        text += "<b>🤖 CryptoBot:</b>\n"
+        for payment in crypto_payments:
+            amount, status, created_at = payment
+            time_str = time.strftime('%d.%m.%Y %H:%M', time.localtime(created_at))
+            text += f"• {time_str}: {amount}💎 ({status})\n"
+    
+    if not stars_payments and not crypto_payments:
+        text += "У вас еще нет покупок."
+    
+    safe_edit_message_text(
+        bot,
+        text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=profile_keyboard()
+    )
+
+# ПРОФИЛЬ: ВВОД ПРОМОКОДА
+@router.route("enter_promo")
+def cb_enter_promo(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "🎫 <b>ВВЕДИТЕ ПРОМОКОД</b>\n\n"
+        "Отправьте промокод для получения награды:"
+    )
+    bot.register_next_step_handler(msg, process_promo_code)
+    bot.answer_callback_query(call.id)
+
+# ТОПЫ
+@router.route("top_balance")
+def cb_top_balance(call, uid, user_data):
+    top_users = leaderboards.top("balance", 10)
+    
+    text = "🏆 <b>ТОП ПО БАЛАНСУ</b>\n\n"
+    for i, (username, balance) in enumerate(top_users, 1):
+        text += f"{i}. @{username or 'Неизвестно'} - {balance}💎\n"
+    text += format_top_position(leaderboards.around("balance", uid), lambda balance: f"{balance}💎")
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
+
+@router.route("top_refs")
+def cb_top_refs(call, uid, user_data):
+    top_users = leaderboards.top("refs", 10)
+    
+    text = "👥 <b>ТОП ПО РЕФЕРАЛАМ</b>\n\n"
+    for i, (username, refs) in enumerate(top_users, 1):
+        text += f"{i}. @{username or 'Неизвестно'} - {refs} реф.\n"
+    text += format_top_position(leaderboards.around("refs", uid), lambda refs: f"{refs} реф.")
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
+
+@router.route("top_wins")
+def cb_top_wins(call, uid, user_data):
+    top_users = leaderboards.top("wins", 10)
+    
+    text = "🏆 <b>ТОП ПО ПОБЕДАМ</b>\n\n"
+    for i, (username, wins) in enumerate(top_users, 1):
+        text += f"{i}. @{username or 'Неизвестно'} - {wins} побед\n"
+    text += format_top_position(leaderboards.around("wins", uid), lambda wins: f"{wins} побед")
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
+
+@router.route("top_levels")
+def cb_top_levels(call, uid, user_data):
+    top_users = leaderboards.top("levels", 10)
+    
+    text = "⭐ <b>ТОП ПО УРОВНЯМ</b>\n\n"
+    for i, (username, level, total_exp) in enumerate(top_users, 1):
+        text += f"{i}. @{username or 'Неизвестно'} - Уровень {level} ({total_exp} опыта)\n"
+    text += format_top_position(leaderboards.around("levels", uid), lambda level, total_exp: f"Уровень {level} ({total_exp} опыта)")
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=tops_keyboard())
+
+# ЗАДАНИЯ
+@router.route("my_quests")
+def cb_my_quests(call, uid, user_data):
+    from database import get_weekly_quests
+    from utils import format_weekly_quests
+    
+    quests = get_weekly_quests(uid)
+    text = format_weekly_quests(quests)
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
+
+@router.route("quest_rewards")
+def cb_quest_rewards(call, uid, user_data):
+    text = """
 <b>🏆 НАГРАДЫ ЗА ЗАДАНИЯ</b>
 
 🎁 <b>Награды за выполнение заданий:</b>
@@ -1104,20 +1262,21 @@ def callback_handler(call):
 
 🎯 <b>Задания обновляются каждую неделю!</b>
 """
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
-        
-        elif call.data == "quest_progress":
-            from database import get_weekly_quests
-            quests = get_weekly_quests(uid)
-            
-            completed = 0
-            total_reward = 0
-            for quest_data in quests:
-                quest_id, progress, completed_flag, claimed, goal = quest_data
-                if completed_flag or progress >= goal:
-                    completed += 1
-            
-            text = f"""
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
+
+@router.route("quest_progress")
+def cb_quest_progress(call, uid, user_data):
+    from database import get_weekly_quests
+    quests = get_weekly_quests(uid)
+    
+    completed = 0
+    total_reward = 0
+    for quest_data in quests:
+        quest_id, progress, completed_flag, claimed, goal = quest_data
+        if completed_flag or progress >= goal:
+            completed += 1
+    
+    text = f"""
 <b>📊 ПРОГРЕСС ЗАДАНИЙ</b>
 
 📈 <b>Статистика:</b>
@@ -1133,227 +1292,236 @@ def callback_handler(call):
 
 🎯 <b>Цель:</b> Выполнить все задания за неделю!
 """
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=weekly_quests_keyboard())
+
+# РОЗЫГРЫШ
+@router.route("buy_lottery_ticket")
+@router.route(prefix="buy_lottery_tickets_", params=(int,))
+def cb_buy_lottery_ticket(call, uid, user_data, count=1):
+    if count != 1 and count not in LOTTERY_BULK_SIZES:
+        bot.answer_callback_query(call.id, "❌ Неверное количество билетов")
+        return
+    
+    # Списание и выдача номеров - одна транзакция, сколько бы билетов ни покупали
+    draw_date = Lottery.get_next_draw_date()
+    tickets = buy_lottery_tickets(uid, draw_date, count, LOTTERY_TICKET_PRICE)
+    if tickets is None:
+        bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+        return
+    
+    first, last = tickets
+    if count == 1:
+        bot.answer_callback_query(call.id, f"✅ Билет #{first} куплен!")
+    else:
+        bot.answer_callback_query(call.id, f"✅ Билеты #{first}-#{last} куплены!")
+    
+    # Обновляем информацию о розыгрыше
+    lottery_stats = get_lottery_stats(draw_date)
+    ticket_count = lottery_stats[1]
+    jackpot = Lottery.get_current_jackpot(ticket_count)
+    user_tickets_count = get_user_ticket_count(uid, draw_date)
+    
+    lottery_text = format_lottery_info(draw_date, ticket_count, user_tickets_count, jackpot)
+    safe_edit_message_text(
+        bot,
+        lottery_text,
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=lottery_keyboard(draw_date, user_tickets_count)
+    )
+
+@router.route("my_lottery_tickets")
+def cb_my_lottery_tickets(call, uid, user_data):
+    draw_date = Lottery.get_next_draw_date()
+    user_tickets = get_user_tickets(uid, draw_date)
+    user_tickets_count = sum(last - first + 1 for first, last in user_tickets)
+    
+    if user_tickets_count == 0:
+        text = "🎟 <b>ВАШИ БИЛЕТЫ</b>\n\n"
+        text += "У вас нет билетов на текущий розыгрыш.\n\n"
+        text += "🎫 Купите билет, чтобы участвовать в розыгрыше!"
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, 0))
+    else:
+        text = f"🎟 <b>ВАШИ БИЛЕТЫ ({user_tickets_count})</b>\n\n"
+        text += f"🎰 Розыгрыш: {draw_date}\n\n"
+        text += f"🎫 Ваши билеты: "
+        text += ", ".join([f"#{first}" if first == last else f"#{first}-#{last}" for first, last in user_tickets[:20]])
+        if len(user_tickets) > 20:
+            text += f" и еще {len(user_tickets) - 20} диапазонов..."
         
-        # РОЗЫГРЫШ
-        elif call.data == "buy_lottery_ticket":
-            from config import LOTTERY_TICKET_PRICE
-            from database import buy_lottery_ticket
-            
-            if user_data[2] < LOTTERY_TICKET_PRICE:
-                bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
-                return
-            
-            draw_date = Lottery.get_next_draw_date()
-            ticket_number = buy_lottery_ticket(uid, draw_date)
-            update_balance(uid, -LOTTERY_TICKET_PRICE, "lottery_ticket")
-            
-            bot.answer_callback_query(call.id, f"✅ Билет #{ticket_number} куплен!")
-            
-            # Обновляем информацию о розыгрыше
-            lottery_stats = get_lottery_stats(draw_date)
-            ticket_count = lottery_stats[1] if lottery_stats else 0
-            jackpot = Lottery.get_current_jackpot(ticket_count)
-            user_tickets = get_user_tickets(uid, draw_date)
-            user_tickets_count = len(user_tickets)
-            
-            lottery_text = format_lottery_info(draw_date, ticket_count, user_tickets_count, jackpot)
-            safe_edit_message_text(
-                bot,
-                lottery_text,
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=lottery_keyboard(draw_date, user_tickets_count)
-            )
-        
-        elif call.data == "my_lottery_tickets":
-            draw_date = Lottery.get_next_draw_date()
-            user_tickets = get_user_tickets(uid, draw_date)
-            user_tickets_count = len(user_tickets)
-            
-            if user_tickets_count == 0:
-                text = "🎟 <b>ВАШИ БИЛЕТЫ</b>\n\n"
-                text += "У вас нет билетов на текущий розыгрыш.\n\n"
-                text += "🎫 Купите билет, чтобы участвовать в розыгрыше!"
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, 0))
-            else:
-                text = f"🎟 <b>ВАШИ БИЛЕТЫ ({user_tickets_count})</b>\n\n"
-                text += f"🎰 Розыгрыш: {draw_date}\n\n"
-                text += f"🎫 Ваши билеты: "
-                text += ", ".join([f"#{ticket}" for ticket in user_tickets[:20]])
-                if user_tickets_count > 20:
-                    text += f" и еще {user_tickets_count - 20}..."
-                
-                text += f"\n\n🎯 <b>Шанс на победу:</b> 1 к {get_lottery_stats(draw_date)[1] if get_lottery_stats(draw_date) else 1}"
-                
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, user_tickets_count))
+        text += f"\n\n🎯 <b>Шанс на победу:</b> {user_tickets_count} к {get_lottery_stats(draw_date)[1] or 1}"
         
-        elif call.data == "lottery_history":
-            from database import get_lottery_history
-            from utils import format_lottery_history
-            
-            history = get_lottery_history(10)
-            text = format_lottery_history(history)
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(Lottery.get_next_draw_date(), 0))
-        
-        elif call.data == "lottery_jackpot":
-            draw_date = Lottery.get_next_draw_date()
-            lottery_stats = get_lottery_stats(draw_date)
-            ticket_count = lottery_stats[1] if lottery_stats else 0
-            jackpot = Lottery.get_current_jackpot(ticket_count)
-            
-            text = f"""
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, user_tickets_count))
+
+@router.route("lottery_history")
+def cb_lottery_history(call, uid, user_data):
+    from database import get_lottery_history
+    from utils import format_lottery_history
+    
+    history = get_lottery_history(10)
+    text = format_lottery_history(history)
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(Lottery.get_next_draw_date(), 0))
+
+@router.route("lottery_jackpot")
+def cb_lottery_jackpot(call, uid, user_data):
+    draw_date = Lottery.get_next_draw_date()
+    lottery_stats = get_lottery_stats(draw_date)
+    ticket_count = lottery_stats[1]
+    jackpot = Lottery.get_current_jackpot(ticket_count)
+    user_tickets_count = get_user_ticket_count(uid, draw_date)
+    
+    text = f"""
 🏆 <b>ТЕКУЩИЙ ПРИЗОВОЙ ФОНД</b>
 
 💎 <b>Сумма приза:</b> {jackpot}💎
 
 📊 <b>Статистика:</b>
 ├ Билетов куплено: {ticket_count}
-├ Участников: {lottery_stats[0] if lottery_stats else 0}
-└ Ваши билеты: {len(get_user_tickets(uid, draw_date))}
+├ Участников: {lottery_stats[0]}
+└ Ваши билеты: {user_tickets_count}
 
 🎯 <b>Ваш шанс на победу:</b> 1 к {ticket_count if ticket_count > 0 else 1}
 
 💡 <b>Чем больше билетов куплено - тем больше приз!</b>
 """
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, len(get_user_tickets(uid, draw_date))))
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=lottery_keyboard(draw_date, user_tickets_count))
+
+# СУНДУКИ (ПЛАТНЫЕ)
+@router.route("c10", "c25", "c50", "c150", "c500")
+def cb_open_case(call, uid, user_data):
+    from models import CASES
+    
+    if call.data in CASES:
+        case = CASES[call.data]
         
-        # СУНДУКИ (ПЛАТНЫЕ)
-        elif call.data in ["c10", "c25", "c50", "c150", "c500"]:
-            from models import CASES
-            
-            if call.data in CASES:
-                case = CASES[call.data]
-                
-                if user_data[2] < case.price:
-                    bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
-                    return
-                
-                # Списываем стоимость
-                update_balance(uid, -case.price, f"case_{call.data}")
-                
-                # Анимация открытия
-                animate_case_opening(bot, call.message.chat.id, call.message.message_id, case.emoji)
-                time.sleep(1)
-                
-                # Открываем сундук
-                reward = case.open()
-                
-                # Начисляем выигрыш
-                update_balance(uid, reward, f"case_reward_{call.data}")
-                
-                # Обновляем статистику
-                update_case_stats(uid, reward > 0, reward)
-                
-                # Добавляем опыт за открытие сундука
-                add_exp(uid, 10)
-                
-                # Определяем, победил ли пользователь (выигрыш >= стоимости)
-                is_win = reward >= case.price
-                
-                # Показываем результат с правильным сообщением
-                result_text = f"""
+        if user_data[2] < case.price:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+            return
+        
+        # Списываем стоимость
+        update_balance(uid, -case.price, f"case_{call.data}")
+        
+        # Открываем сундук
+        reward = case.open()
+        
+        # Начисляем выигрыш
+        update_balance(uid, reward, f"case_reward_{call.data}")
+        
+        # Обновляем статистику
+        update_case_stats(uid, reward > 0, reward)
+        
+        # Добавляем опыт за открытие сундука
+        add_exp(uid, 10)
+        
+        # Определяем, победил ли пользователь (выигрыш >= стоимости)
+        is_win = reward >= case.price
+        
+        # Показываем результат с правильным сообщением
+        result_text = f"""
 <b>{case.emoji} {case.name} сундук</b>
 
 💰 <b>Стоимость:</b> {case.price}💎
 🎁 <b>Выпало:</b> {reward}💎
 {"✅" if is_win else "❌"} <b>Результат:</b> {"ПОБЕДА!" if is_win else "Вы выиграли меньше стоимости сундука"}
 """
-                
-                # Добавляем сообщение о более дорогом кейсе для дешевых кейсов
-                if call.data in ["c10", "c25", "c50"]:
-                    next_case_msg = ""
-                    if call.data == "c10":
-                        next_case_msg = "\n💡 В железном сундуке (25💎) вы можете выиграть до 50💎!"
-                    elif call.data == "c25":
-                        next_case_msg = "\n💡 В золотом сундуке (50💎) вы можете выиграть до 100💎!"
-                    elif call.data == "c50":
-                        next_case_msg = "\n💡 В алмазном сундуке (150💎) вы можете выиграть до 250💎!"
-                    
-                    result_text += next_case_msg
-                
-                result_text += f"\n\n💎 <b>Баланс:</b> {user_data[2] - case.price + reward}💎"
-                
-                safe_edit_message_text(
-                    bot,
-                    result_text,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=cases_keyboard(user_data[3])
-                )
         
-        # СУНДУКИ (БЕСПЛАТНЫЙ)
-        elif call.data == "free_case":
-            if user_data[3] > 0:
-                # Анимация открытия
-                animate_case_opening(bot, call.message.chat.id, call.message.message_id, "🪵")
-                time.sleep(1)
-                
-                # Открываем бесплатный сундук
-                reward = open_free_case()
-                update_balance(uid, reward, "free_case")
-                use_free_case(uid)
-                update_case_stats(uid, reward > 0, reward)
-                
-                # Добавляем опыт
-                add_exp(uid, 5)
-                
-                # Для бесплатного сундука всегда показываем "ПОБЕДА!"
-                result_text = f"""
+        # Добавляем сообщение о более дорогом кейсе для дешевых кейсов
+        if call.data in ["c10", "c25", "c50"]:
+            next_case_msg = ""
+            if call.data == "c10":
+                next_case_msg = "\n💡 В железном сундуке (25💎) вы можете выиграть до 50💎!"
+            elif call.data == "c25":
+                next_case_msg = "\n💡 В золотом сундуке (50💎) вы можете выиграть до 100💎!"
+            elif call.data == "c50":
+                next_case_msg = "\n💡 В алмазном сундуке (150💎) вы можете выиграть до 250💎!"
+            
+            result_text += next_case_msg
+        
+        result_text += f"\n\n💎 <b>Баланс:</b> {user_data[2] - case.price + reward}💎"
+        
+        # Анимация открытия, затем результат
+        animations.play(
+            call.message.chat.id,
+            call.message.message_id,
+            case_opening_frames(case.emoji),
+            result_text,
+            reply_markup=cases_keyboard(user_data[3]),
+            pause=1
+        )
+
+# СУНДУКИ (БЕСПЛАТНЫЙ)
+@router.route("free_case")
+def cb_free_case(call, uid, user_data):
+    if user_data[3] > 0:
+        # Открываем бесплатный сундук
+        reward = open_free_case()
+        update_balance(uid, reward, "free_case")
+        use_free_case(uid)
+        update_case_stats(uid, reward > 0, reward)
+        
+        # Добавляем опыт
+        add_exp(uid, 5)
+        
+        # Для бесплатного сундука всегда показываем "ПОБЕДА!"
+        result_text = f"""
 <b>🪵 Бесплатный сундук</b>
 
 🎁 <b>Выпало:</b> {reward}💎
 ✅ <b>Результат:</b> ПОБЕДА!
 """
-                
-                # Добавляем сообщение о более дорогом кейсе
-                result_text += "\n💡 В железном сундуке (25💎) вы можете выиграть до 50💎!"
-                
-                result_text += f"\n\n💎 <b>Баланс:</b> {user_data[2] + reward}💎"
-                
-                safe_edit_message_text(
-                    bot,
-                    result_text,
-                    call.message.chat.id,
-                    call.message.message_id,
-                    reply_markup=cases_keyboard(user_data[3] - 1)
-                )
-            else:
-                bot.answer_callback_query(call.id, "❌ Нет бесплатных сундуков")
         
-        # ИГРЫ: КАМЕНЬ-НОЖНИЦЫ-БУМАГА
-        elif call.data == "game_sps":
-            safe_edit_message_text(
-                bot,
-                f"✂️ <b>КАМЕНЬ-НОЖНИЦЫ-БУМАГА</b>\n\n"
-                f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
-                f"🎯 <b>Правила:</b>\n"
-                f"• Камень бьет ножницы\n"
-                f"• Ножницы бьют бумагу\n"
-                f"• Бумага бьет камень\n"
-                f"💰 <b>Выигрыш:</b> x2 от ставки\n\n"
-                f"Выберите ваш ход:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=sps_keyboard()
-            )
+        # Добавляем сообщение о более дорогом кейсе
+        result_text += "\n💡 В железном сундуке (25💎) вы можете выиграть до 50💎!"
         
-        # ИГРЫ: ВЫБОР ХОДА КНБ
-        elif call.data in ["sps_stone", "sps_paper", "sps_scissors"]:
-            choice_map = {
-                "sps_stone": "stone",
-                "sps_paper": "paper",
-                "sps_scissors": "scissors"
-            }
-            choice = choice_map[call.data]
-            
-            choice_emoji = {
-                "stone": "🪨",
-                "paper": "📄",
-                "scissors": "✂️"
-            }
-            
-            text = f"""
+        result_text += f"\n\n💎 <b>Баланс:</b> {user_data[2] + reward}💎"
+        
+        # Анимация открытия, затем результат
+        animations.play(
+            call.message.chat.id,
+            call.message.message_id,
+            case_opening_frames("🪵"),
+            result_text,
+            reply_markup=cases_keyboard(user_data[3] - 1),
+            pause=1
+        )
+    else:
+        bot.answer_callback_query(call.id, "❌ Нет бесплатных сундуков")
+
+# ИГРЫ: КАМЕНЬ-НОЖНИЦЫ-БУМАГА
+@router.route("game_sps")
+def cb_game_sps(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        f"✂️ <b>КАМЕНЬ-НОЖНИЦЫ-БУМАГА</b>\n\n"
+        f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
+        f"🎯 <b>Правила:</b>\n"
+        f"• Камень бьет ножницы\n"
+        f"• Ножницы бьют бумагу\n"
+        f"• Бумага бьет камень\n"
+        f"💰 <b>Выигрыш:</b> x2 от ставки\n\n"
+        f"Выберите ваш ход:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=sps_keyboard()
+    )
+
+# ИГРЫ: ВЫБОР ХОДА КНБ
+@router.route("sps_stone", "sps_paper", "sps_scissors")
+def cb_sps_choice(call, uid, user_data):
+    choice_map = {
+        "sps_stone": "stone",
+        "sps_paper": "paper",
+        "sps_scissors": "scissors"
+    }
+    choice = choice_map[call.data]
+    
+    choice_emoji = {
+        "stone": "🪨",
+        "paper": "📄",
+        "scissors": "✂️"
+    }
+    
+    text = f"""
 ✂️ <b>КАМЕНЬ-НОЖНИЦЫ-БУМАГА</b>
 
 🎯 <b>Ваш выбор:</b> {choice_emoji[choice]}
@@ -1362,520 +1530,568 @@ def callback_handler(call):
 
 Выберите сумму ставки:
 """
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard(f"sps_{choice}"))
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard(f"sps_{choice}"))
+
+# ИСПРАВЛЕННАЯ ИГРА КНБ: ОБРАБОТКА СТАВОК
+@router.route(prefix="bet_sps_", params=(str, int))
+def cb_bet_sps(call, uid, user_data, choice, bet_amount):
+    # Формат: bet_sps_paper_25
+    if user_data[2] < bet_amount:
+        bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+        return
+    
+    # Играем в КНБ
+    win, amount_won, bot_choice = StonePaperScissors.play(bet_amount, choice)
+    
+    choice_emoji = {
+        "stone": "🪨",
+        "paper": "📄",
+        "scissors": "✂️"
+    }
+    
+    # Ставка, статистика и опыт за игру - одной транзакцией
+    new_balance = settle_bet(uid, "sps", bet_amount, amount_won, exp=5)
+    if new_balance is None:
+        bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+        return
+
+    if win is None:  # Ничья
+        result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nСтавка возвращена\nНовый баланс: <b>{new_balance}💎</b>"
+    elif win:
+        result_text = f"✅ <b>ПОБЕДА!</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+    else:
+        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nВы проиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+
+    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=sps_keyboard())
+
+# ИГРЫ: РУЛЕТКА
+@router.route("game_roulette")
+def cb_game_roulette(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        f"🎡 <b>РУЛЕТКА</b>\n\n"
+        f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
+        f"🎯 <b>Шанс на победу:</b> 20%\n"
+        f"💰 <b>Награда:</b> x2 от ставки\n\n"
+        f"Выберите ставку:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=bet_keyboard("roulette")
+    )
+
+@router.route("game_dice")
+def cb_game_dice(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        f"🎲 <b>КУБИК</b>\n\n"
+        f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
+        f"🎯 <b>Правила:</b>\n"
+        f"• Выпало 6: награда x4\n"
+        f"• Выпало 1: возврат ставки\n"
+        f"• Другое: попробуйте еще\n\n"
+        f"Выберите ставку:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=bet_keyboard("dice")
+    )
+
+# ИГРЫ "МИНЫ" УДАЛЕНЫ
+@router.route("game_mines")
+def cb_game_mines(call, uid, user_data):
+    bot.answer_callback_query(call.id, "❌ Игра 'Мины' временно отключена")
+    return
+
+@router.route("game_slot")
+def cb_game_slot(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        f"🎰 <b>СЛОТ-МАШИНА</b>\n\n"
+        f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
+        f"🎯 <b>Выигрышные комбинации:</b>\n"
+        f"• 3x 7️⃣: x8\n"
+        f"• 3x 💎: x6\n"
+        f"• 3x ⭐: x4\n"
+        f"• 3x 🔔: x3\n"
+        f"• 3 одинаковых: x2\n"
+        f"• 2 одинаковых: x1.1-1.3\n\n"
+        f"Выберите ставку:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=slot_bet_keyboard()
+    )
+
+@router.route("game_blackjack")
+def cb_game_blackjack(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        f"🃏 <b>БЛЭКДЖЕК</b>\n\n"
+        f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
+        f"🎯 <b>Правила:</b>\n"
+        f"• Цель: набрать больше очков чем дилер, но не больше 21\n"
+        f"• Карты: 1-11 очков\n"
+        f"• Награда: x2 от ставки\n"
+        f"• Ничья: возврат ставки\n\n"
+        f"Выберите ставку:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=blackjack_bet_keyboard()
+    )
+
+@router.route("events")
+def cb_events(call, uid, user_data):
+    events = check_event()
+    if events:
+        text = "🎪 <b>АКТИВНЫЕ ИВЕНТЫ</b>\n\n"
+        for event in events:
+            text += f"• <b>{event.get('name')}</b>\n"
+            text += f"  {event.get('bonus')}\n\n"
+    else:
+        text = "🎪 <b>АКТИВНЫЕ ИВЕНТЫ</b>\n\n"
+        text += "В данный момент нет активных ивентов.\n\n"
+        text += "💡 Следите за обновлениями!"
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=games_keyboard())
+
+def play_native_bet(chat_id, uid, game, emoji, stake, payout, **settle_kwargs):
+    """Бросок send_dice с оплатой заранее: ((выигрыш, выплата, результат), баланс) или None.
+
+    Анимация видна сразу после send_dice, поэтому ставка списывается до броска;
+    если алмазов не хватает, кубик не отправляется.
+    """
+    if not reserve_stake(uid, stake):
+        return None
+    try:
+        dice_message = bot.send_dice(chat_id, emoji=emoji)
+    except Exception:
+        release_stake(uid, stake)
+        raise
+    result = payout(stake, dice_message.dice.value)
+    return result, settle_bet(uid, game, stake, result[1], reserved=True, **settle_kwargs)
+
+# ИГРЫ: СТАВКИ (кроме КНБ)
+@router.route(prefix="bet_", params=(str, int))
+def cb_bet(call, uid, user_data, game_type, bet_amount):
+    # Формат: bet_dice_25
+    if user_data[2] < bet_amount:
+        bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+        return
+    
+    # Обработка разных игр (кроме КНБ, который обрабатывается отдельно)
+    # Ставка, статистика, опыт и задания рассчитываются одной транзакцией
+    if game_type == "roulette":
+        win, amount_won = Roulette.spin(bet_amount)
+        new_balance = settle_bet(uid, "roulette", bet_amount, amount_won, exp=5)
+        if new_balance is None:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+            return
         
-        # ИСПРАВЛЕННАЯ ИГРА КНБ: ОБРАБОТКА СТАВОК
-        elif call.data.startswith("bet_sps_"):
-            try:
-                # Разбираем callback data
-                parts = call.data.split("_")
-                if len(parts) == 4:
-                    # Формат: bet_sps_paper_25
-                    choice = parts[2]  # paper, stone, scissors
-                    bet_amount = int(parts[3])
-                    
-                    if user_data[2] < bet_amount:
-                        bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
-                        return
-                    
-                    # Играем в КНБ
-                    win, amount_won, bot_choice = StonePaperScissors.play(bet_amount, choice)
-                    
-                    choice_emoji = {
-                        "stone": "🪨",
-                        "paper": "📄",
-                        "scissors": "✂️"
-                    }
-                    
-                    if win is None:  # Ничья
-                        update_balance(uid, 0, "sps_draw")
-                        result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nСтавка возвращена\nНовый баланс: <b>{user_data[2]}💎</b>"
-                    elif win:
-                        update_balance(uid, amount_won - bet_amount, "sps_win")
-                        update_game_stats(uid, True)
-                        result_text = f"✅ <b>ПОБЕДА!</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] + amount_won - bet_amount}💎</b>"
-                    else:
-                        update_balance(uid, -bet_amount, "sps_loss")
-                        update_game_stats(uid, False)
-                        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВаш выбор: {choice_emoji[choice]}\nВыбор бота: {choice_emoji[bot_choice]}\nВы проиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] - bet_amount}💎</b>"
-                    
-                    # Добавляем опыт за игру
-                    add_exp(uid, 5)
-                    
-                    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=sps_keyboard())
-                
-            except (ValueError, IndexError) as e:
-                logger.error(f"Error in KNB game: {e}")
-                bot.answer_callback_query(call.id, "❌ Ошибка обработки игры")
+        if win:
+            result_text = f"✅ <b>ПОБЕДА!</b>\n\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+        else:
+            result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
         
-        # ИГРЫ: РУЛЕТКА
-        elif call.data == "game_roulette":
-            safe_edit_message_text(
-                bot,
-                f"🎡 <b>РУЛЕТКА</b>\n\n"
-                f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
-                f"🎯 <b>Шанс на победу:</b> 20%\n"
-                f"💰 <b>Награда:</b> x2 от ставки\n\n"
-                f"Выберите ставку:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=bet_keyboard("roulette")
-            )
+        safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard("roulette"))
+    
+    elif game_type == "dice":
+        if DICE_ANIMATION_MODE == "native":
+            played = play_native_bet(call.message.chat.id, uid, "dice", "🎲", bet_amount, Dice.payout, exp=5)
+            if played is None:
+                bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+                return
+            (win, amount_won, roll), new_balance = played
+        else:
+            win, amount_won, roll = Dice.roll(bet_amount)
+            new_balance = settle_bet(uid, "dice", bet_amount, amount_won, exp=5)
+        if new_balance is None:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+            return
         
-        elif call.data == "game_dice":
-            safe_edit_message_text(
-                bot,
-                f"🎲 <b>КУБИК</b>\n\n"
-                f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
-                f"🎯 <b>Правила:</b>\n"
-                f"• Выпало 6: награда x4\n"
-                f"• Выпало 1: возврат ставки\n"
-                f"• Другое: попробуйте еще\n\n"
-                f"Выберите ставку:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=bet_keyboard("dice")
-            )
+        if win is None:  # Ничья
+            result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВыпало: <b>{roll}</b>\nСтавка возвращена\nНовый баланс: <b>{new_balance}💎</b>"
+        elif win:
+            result_text = f"✅ <b>ПОБЕДА!</b>\n\nВыпало: <b>{roll}</b>\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+        else:
+            result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВыпало: <b>{roll}</b>\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
         
-        # ИГРЫ "МИНЫ" УДАЛЕНЫ
-        elif call.data == "game_mines":
-            bot.answer_callback_query(call.id, "❌ Игра 'Мины' временно отключена")
+        if DICE_ANIMATION_MODE == "native":
+            # Результат - новым сообщением после анимации кубика
+            animations.play(call.message.chat.id, None, [], result_text,
+                            reply_markup=bet_keyboard("dice"), pause=NATIVE_DICE_RESULT_DELAY)
+        else:
+            safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard("dice"))
+    
+    elif game_type == "slot":
+        if SLOT_ANIMATION_MODE == "native":
+            played = play_native_bet(call.message.chat.id, uid, "slot", "🎰", bet_amount, SlotMachine.from_dice_value,
+                                     exp=5, quest_events={"play_slot": 1})
+            if played is None:
+                bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+                return
+            (win, amount_won, result), new_balance = played
+        else:
+            win, amount_won, result = SlotMachine.spin(bet_amount)
+            new_balance = settle_bet(uid, "slot", bet_amount, amount_won, exp=5, quest_events={"play_slot": 1})
+        if new_balance is None:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
             return
         
-        elif call.data == "game_slot":
-            safe_edit_message_text(
-                bot,
-                f"🎰 <b>СЛОТ-МАШИНА</b>\n\n"
-                f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
-                f"🎯 <b>Выигрышные комбинации:</b>\n"
-                f"• 3x 7️⃣: x8\n"
-                f"• 3x 💎: x6\n"
-                f"• 3x ⭐: x4\n"
-                f"• 3x 🔔: x3\n"
-                f"• 3 одинаковых: x2\n"
-                f"• 2 одинаковых: x1.1-1.3\n\n"
-                f"Выберите ставку:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=slot_bet_keyboard()
-            )
+        if win:
+            result_text = f"✅ <b>ПОБЕДА!</b>\n\nРезультат: {' '.join(result)}\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+        else:
+            result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nРезультат: {' '.join(result)}\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
         
-        elif call.data == "game_blackjack":
-            safe_edit_message_text(
-                bot,
-                f"🃏 <b>БЛЭКДЖЕК</b>\n\n"
-                f"💰 <b>Ваш баланс:</b> {user_data[2]}💎\n"
-                f"🎯 <b>Правила:</b>\n"
-                f"• Цель: набрать больше очков чем дилер, но не больше 21\n"
-                f"• Карты: 1-11 очков\n"
-                f"• Награда: x2 от ставки\n"
-                f"• Ничья: возврат ставки\n\n"
-                f"Выберите ставку:",
+        if SLOT_ANIMATION_MODE == "native":
+            # Результат - новым сообщением после анимации 🎰
+            animations.play(call.message.chat.id, None, [], result_text,
+                            reply_markup=slot_bet_keyboard(), pause=NATIVE_SLOT_RESULT_DELAY)
+        else:
+            # Анимация слотов, затем результат
+            animations.play(
                 call.message.chat.id,
                 call.message.message_id,
-                reply_markup=blackjack_bet_keyboard()
+                slot_spin_frames(),
+                result_text,
+                reply_markup=slot_bet_keyboard(),
+                pause=1.5
             )
+    
+    elif game_type == "blackjack":
+        win, amount_won, cards = BlackJack.play(bet_amount)
+        new_balance = settle_bet(uid, "blackjack", bet_amount, amount_won, exp=5, quest_events={"play_blackjack": 1})
+        if new_balance is None:
+            bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
+            return
         
-        elif call.data == "events":
-            events = check_event()
-            if events:
-                text = "🎪 <b>АКТИВНЫЕ ИВЕНТЫ</b>\n\n"
-                for event in events:
-                    text += f"• <b>{event.get('name')}</b>\n"
-                    text += f"  {event.get('bonus')}\n\n"
-            else:
-                text = "🎪 <b>АКТИВНЫЕ ИВЕНТЫ</b>\n\n"
-                text += "В данный момент нет активных ивентов.\n\n"
-                text += "💡 Следите за обновлениями!"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=games_keyboard())
-        
-        # ИГРЫ: СТАВКИ (кроме КНБ)
-        elif call.data.startswith("bet_"):
-            parts = call.data.split("_")
-            if len(parts) >= 3:
-                game_type = parts[1]
-                bet_amount = int(parts[2])
-                
-                if user_data[2] < bet_amount:
-                    bot.answer_callback_query(call.id, "❌ Недостаточно алмазов!")
-                    return
-                
-                # Обработка разных игр (кроме КНБ, который обрабатывается отдельно)
-                if game_type == "roulette":
-                    win, amount_won = Roulette.spin(bet_amount)
-                    
-                    if win:
-                        update_balance(uid, amount_won, "roulette_win")
-                        update_game_stats(uid, True)
-                        result_text = f"✅ <b>ПОБЕДА!</b>\n\nВы выиграли: <b>{amount_won}💎</b>\nНовый баланс: <b>{user_data[2] + amount_won - bet_amount}💎</b>"
-                    else:
-                        update_balance(uid, -bet_amount, "roulette_loss")
-                        update_game_stats(uid, False)
-                        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] - bet_amount}💎</b>"
-                    
-                    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard("roulette"))
-                
-                elif game_type == "dice":
-                    win, amount_won, roll = Dice.roll(bet_amount)
-                    
-                    if win is None:  # Ничья
-                        result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВыпало: <b>{roll}</b>\nСтавка возвращена\nНовый баланс: <b>{user_data[2]}💎</b>"
-                    elif win:
-                        update_balance(uid, amount_won - bet_amount, "dice_win")
-                        update_game_stats(uid, True)
-                        result_text = f"✅ <b>ПОБЕДА!</b>\n\nВыпало: <b>{roll}</b>\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] + amount_won - bet_amount}💎</b>"
-                    else:
-                        update_balance(uid, -bet_amount, "dice_loss")
-                        update_game_stats(uid, False)
-                        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВыпало: <b>{roll}</b>\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] - bet_amount}💎</b>"
-                    
-                    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=bet_keyboard("dice"))
-                
-                elif game_type == "slot":
-                    # Анимация слотов
-                    animate_slot_spin(bot, call.message.chat.id, call.message.message_id)
-                    time.sleep(1)
-                    
-                    win, amount_won, result = SlotMachine.spin(bet_amount)
-                    
-                    if win:
-                        update_balance(uid, amount_won - bet_amount, "slot_win")
-                        update_game_stats(uid, True)
-                        result_text = f"✅ <b>ПОБЕДА!</b>\n\nРезультат: {' '.join(result)}\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] + amount_won - bet_amount}💎</b>"
-                    else:
-                        update_balance(uid, -bet_amount, "slot_loss")
-                        update_game_stats(uid, False)
-                        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nРезультат: {' '.join(result)}\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] - bet_amount}💎</b>"
-                    
-                    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=slot_bet_keyboard())
-                
-                elif game_type == "blackjack":
-                    win, amount_won, cards = BlackJack.play(bet_amount)
-                    
-                    player_cards, dealer_cards = cards
-                    player_sum = sum(player_cards)
-                    dealer_sum = sum(dealer_cards)
-                    
-                    if win is None:  # Ничья
-                        result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nСтавка возвращена\nНовый баланс: <b>{user_data[2]}💎</b>"
-                        update_balance(uid, 0, "blackjack_draw")
-                    elif win:
-                        update_balance(uid, amount_won - bet_amount, "blackjack_win")
-                        update_game_stats(uid, True)
-                        result_text = f"✅ <b>ПОБЕДА!</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] + amount_won - bet_amount}💎</b>"
-                    else:
-                        update_balance(uid, -bet_amount, "blackjack_loss")
-                        update_game_stats(uid, False)
-                        result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{user_data[2] - bet_amount}💎</b>"
-                    
-                    safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=blackjack_bet_keyboard())
-                
-                # Добавляем опыт за игру
-                add_exp(uid, 5)
-        
-        # ПОКУПКА АЛМАЗОВ ЧЕРЕЗ CRYPTOBOT
-        elif call.data.startswith("buy_"):
-            try:
-                amount = int(call.data.split("_")[1])
-                from config import ALMAZ_PACKAGES
-                
-                if amount in ALMAZ_PACKAGES:
-                    price_usd = ALMAZ_PACKAGES[amount]
-                    
-                    # Создаем счет в CryptoBot
-                    invoice_id, pay_url = create_cryptobot_invoice(
-                        price_usd,
-                        f"Покупка {amount} алмазов"
-                    )
-                    
-                    if invoice_id and pay_url:
-                        # Сохраняем платеж в БД
-                        create_payment(uid, amount, invoice_id)
-                        
-                        safe_edit_message_text(
-                            bot,
-                            f"💎 <b>ПОКУПКА {amount} АЛМАЗОВ</b>\n\n"
-                            f"Сумма: <b>{price_usd}$</b>\n"
-                            f"Курс: 100💎 = 0.32$\n\n"
-                            f"<b>Инструкция:</b>\n"
-                            f"1. Нажмите кнопку 'Оплатить'\n"
-                            f"2. Оплатите счет криптовалютой\n"
-                            f"3. После оплаты алмазы будут зачислены автоматически\n\n"
-                            f"Статус: <b>Ожидание оплаты</b>",
-                            call.message.chat.id,
-                            call.message.message_id,
-                            reply_markup=types.InlineKeyboardMarkup().add(
-                                types.InlineKeyboardButton("💳 Оплатить", url=pay_url),
-                                types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"check_payment_{invoice_id}")
-                            )
-                        )
-                    else:
-                        bot.answer_callback_query(call.id, "❌ Ошибка создания счета")
-                
-            except (ValueError, IndexError) as e:
-                logger.error(f"Error in buy: {e}")
-                bot.answer_callback_query(call.id, "❌ Ошибка обработки запроса")
-        
-        # ПРОВЕРКА ОПЛАТЫ CRYPTOBOT
-        elif call.data.startswith("check_payment_"):
-            invoice_id = call.data.split("_")[2]
-            payment = get_payment_by_invoice(invoice_id)
-            
-            if not payment:
-                bot.answer_callback_query(call.id, "❌ Платеж не найден")
-                return
-            
-            payment_id, user_id, amount, invoice_id_db, status, created_at, completed_at = payment
-            
-            if status == 'paid':
-                bot.answer_callback_query(call.id, "✅ Платеж уже обработан")
-                return
-            
-            # Проверяем статус в CryptoBot
-            invoice_status = check_cryptobot_invoice(invoice_id)
-            
-            if invoice_status == 'paid':
-                # Обновляем статус платежа
-                update_payment_status(invoice_id, 'paid')
-                
-                # Начисляем алмазы
-                update_balance(uid, amount, f"cryptobot_payment_{invoice_id}")
-                
-                safe_edit_message_text(
-                    bot,
-                    f"✅ <b>ПЛАТЕЖ ОБРАБОТАН!</b>\n\n"
-                    f"На ваш баланс зачислено: <b>+{amount}💎</b>\n"
-                    f"Новый баланс: <b>{get_user(uid)[2]}💎</b>\n\n"
-                    f"Спасибо за покупку!",
-                    call.message.chat.id,
-                    call.message.message_id
-                )
-                
-                logger.info(f"Payment processed for user {uid}: {amount} алмазов")
-            else:
-                bot.answer_callback_query(call.id, "⏳ Платеж еще не получен")
-        
-        # АДМИН ФУНКЦИИ
-        elif call.data == "admin_add":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "➕ <b>ВЫДАТЬ АЛМАЗЫ</b>\n\n"
-                "Введите ID пользователя и количество алмазов через пробел:\n"
-                "Например: <code>123456789 100</code>"
-            )
-            bot.register_next_step_handler(msg, admin_add_balance)
-            bot.answer_callback_query(call.id)
+        player_cards, dealer_cards = cards
+        player_sum = sum(player_cards)
+        dealer_sum = sum(dealer_cards)
         
-        elif call.data == "admin_take":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "➖ <b>ЗАБРАТЬ АЛМАЗЫ</b>\n\n"
-                "Введите ID пользователя и количество алмазов через пробел:\n"
-                "Например: <code>123456789 50</code>"
-            )
-            bot.register_next_step_handler(msg, admin_take_balance)
-            bot.answer_callback_query(call.id)
+        if win is None:  # Ничья
+            result_text = f"⚖️ <b>НИЧЬЯ!</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nСтавка возвращена\nНовый баланс: <b>{new_balance}💎</b>"
+        elif win:
+            result_text = f"✅ <b>ПОБЕДА!</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nВы выиграли: <b>{amount_won - bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
+        else:
+            result_text = f"❌ <b>ПОПРОБУЙТЕ ЕЩЕ</b>\n\nВаши карты: {player_cards} (сумма: {player_sum})\nКарты дилера: {dealer_cards} (сумма: {dealer_sum})\nВы не выиграли: <b>{bet_amount}💎</b>\nНовый баланс: <b>{new_balance}💎</b>"
         
-        elif call.data == "admin_stats":
-            if not is_admin(uid):
-                return
-            
-            from database import get_bot_stats
-            stats = get_bot_stats()
-            
-            if stats:
-                total_users, total_balance, total_cases, total_refs, total_wins, total_lottery_paid = stats
-                text = f"""
-📊 <b>СТАТИСТИКА БОТА</b>
+        safe_edit_message_text(bot, result_text, call.message.chat.id, call.message.message_id, reply_markup=blackjack_bet_keyboard())
 
-👥 Пользователей: {total_users}
-💰 Всего алмазов: {total_balance}💎
-📦 Открыто сундуков: {total_cases}
-👥 Приглашено: {total_refs}
-🏆 Побед: {total_wins}
-🎰 Розыгрышей выплачено: {total_lottery_paid or 0}💎
-"""
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
-        
-        elif call.data == "admin_users":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            from database import get_all_users
-            users = get_all_users()
-            
-            if not users:
-                text = "👥 <b>СПИСОК ПОЛЬЗОВАТЕЛЕЙ</b>\n\n"
-                text += "Пользователей пока нет."
-            else:
-                text = f"👥 <b>СПИСОК ПОЛЬЗОВАТЕЛЕЙ ({len(users)})</b>\n\n"
-                for i, (user_id, username, balance) in enumerate(users[:20], 1):
-                    text += f"{i}. @{username or 'Нет'} (ID: {user_id}) - {balance}💎\n"
-                
-                if len(users) > 20:
-                    text += f"\n... и еще {len(users) - 20} пользователей"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
+# ПОКУПКА АЛМАЗОВ ЧЕРЕЗ CRYPTOBOT
+@router.route(prefix="buy_", params=(int,))
+def cb_buy(call, uid, user_data, amount):
+    from config import ALMAZ_PACKAGES
+    
+    if amount in ALMAZ_PACKAGES:
+        price_usd = ALMAZ_PACKAGES[amount]
         
-        elif call.data == "admin_broadcast":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "📢 <b>РАССЫЛКА</b>\n\n"
-                "Введите сообщение для рассылки всем пользователям:\n\n"
-                "💡 Можно использовать HTML разметку"
-            )
-            bot.register_next_step_handler(msg, admin_broadcast_message)
-            bot.answer_callback_query(call.id)
+        # Создаем счет в CryptoBot
+        invoice_id, pay_url = create_cryptobot_invoice(
+            price_usd,
+            f"Покупка {amount} алмазов"
+        )
         
-        elif call.data == "admin_settings":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
+        if invoice_id and pay_url:
+            # Сохраняем платеж в БД
+            create_payment(uid, amount, invoice_id)
             
             safe_edit_message_text(
                 bot,
-                "⚙ <b>НАСТРОЙКИ АДМИНИСТРАТОРА</b>\n\n"
-                "Выберите действие:",
+                f"💎 <b>ПОКУПКА {amount} АЛМАЗОВ</b>\n\n"
+                f"Сумма: <b>{price_usd}$</b>\n"
+                f"Курс: 100💎 = 0.32$\n\n"
+                f"<b>Инструкция:</b>\n"
+                f"1. Нажмите кнопку 'Оплатить'\n"
+                f"2. Оплатите счет криптовалютой\n"
+                f"3. После оплаты алмазы будут зачислены автоматически\n\n"
+                f"Статус: <b>Ожидание оплаты</b>",
                 call.message.chat.id,
                 call.message.message_id,
-                reply_markup=admin_settings_keyboard()
+                reply_markup=types.InlineKeyboardMarkup().add(
+                    types.InlineKeyboardButton("💳 Оплатить", url=pay_url),
+                    types.InlineKeyboardButton("🔄 Проверить оплату", callback_data=f"check_payment_{invoice_id}")
+                )
             )
+        else:
+            bot.answer_callback_query(call.id, "❌ Ошибка создания счета")
+
+# ПРОВЕРКА ОПЛАТЫ CRYPTOBOT
+@router.route(prefix="check_payment_", params=(str,))
+def cb_check_payment(call, uid, user_data, invoice_id):
+    payment = get_payment_by_invoice(invoice_id)
+    
+    if not payment:
+        bot.answer_callback_query(call.id, "❌ Платеж не найден")
+        return
+    
+    payment_id, user_id, amount, invoice_id_db, status, created_at, completed_at = payment
+    
+    if status == 'paid':
+        bot.answer_callback_query(call.id, "✅ Платеж уже обработан")
+        return
+    
+    # Проверяем статус в CryptoBot
+    invoice_status = check_cryptobot_invoice(invoice_id)
+    
+    if invoice_status == 'paid':
+        # Статус и начисление - одной транзакцией; если счет успела зачесть
+        # фоновая проверка, повторно не начисляем
+        if not credit_paid_payments([invoice_id]):
+            bot.answer_callback_query(call.id, "✅ Платеж уже обработан")
+            return
         
-        elif call.data == "admin_promocodes":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
+        with priority(PRIORITY_PAYMENT):
             safe_edit_message_text(
                 bot,
-                "🎫 <b>УПРАВЛЕНИЕ ПРОМОКОДАМИ</b>\n\n"
-                "Выберите действие:",
+                f"✅ <b>ПЛАТЕЖ ОБРАБОТАН!</b>\n\n"
+                f"На ваш баланс зачислено: <b>+{amount}💎</b>\n"
+                f"Новый баланс: <b>{get_user(uid)[2]}💎</b>\n\n"
+                f"Спасибо за покупку!",
                 call.message.chat.id,
-                call.message.message_id,
-                reply_markup=admin_promocodes_keyboard()
+                call.message.message_id
             )
         
-        elif call.data == "admin_create_lottery":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
+        logger.info(f"Payment processed for user {uid}: {amount} алмазов")
+    else:
+        bot.answer_callback_query(call.id, "⏳ Платеж еще не получен")
+
+# АДМИН ФУНКЦИИ
+@router.route("admin_add", admin_only=True)
+def cb_admin_add(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "➕ <b>ВЫДАТЬ АЛМАЗЫ</b>\n\n"
+        "Введите ID пользователя и количество алмазов через пробел:\n"
+        "Например: <code>123456789 100</code>"
+    )
+    bot.register_next_step_handler(msg, admin_add_balance)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_take", admin_only=True)
+def cb_admin_take(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "➖ <b>ЗАБРАТЬ АЛМАЗЫ</b>\n\n"
+        "Введите ID пользователя и количество алмазов через пробел:\n"
+        "Например: <code>123456789 50</code>"
+    )
+    bot.register_next_step_handler(msg, admin_take_balance)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_stats", admin_only=True)
+def cb_admin_stats(call, uid, user_data):
+    from database import get_bot_stats
+    stats = get_bot_stats()
+    
+    if stats:
+        total_users, total_balance, total_cases, total_refs, total_wins, total_lottery_paid = stats
+        text = f"""
+📊 <b>СТАТИСТИКА БОТА</b>
+
+👥 Пользователей: {total_users}
+💰 Всего алмазов: {total_balance}💎
+📦 Открыто сундуков: {total_cases}
+👥 Приглашено: {total_refs}
+🏆 Побед: {total_wins}
+🎰 Розыгрышей выплачено: {total_lottery_paid or 0}💎
+"""
+        cache_stats = get_user_cache_stats()
+        if cache_stats["enabled"]:
+            text += f"🗂 Кэш профилей: {cache_stats['size']} зап., попаданий {cache_stats['hit_rate']:.0%}\n"
+        pool_stats = handler_pool.stats()
+        text += (
+            f"🧵 Хендлеры: {pool_stats['active_users']} польз. в работе, в очереди {pool_stats['queued']}, "
+            f"ожидание {pool_stats['avg_wait_ms']:.0f} / {pool_stats['max_wait_ms']:.0f} мс\n"
+        )
+        text += (
+            f"🧾 Просроченные счета: проверено {payment_sweep_stats['checked']}, "
+            f"закрыто {payment_sweep_stats['expired'] + payment_sweep_stats['stars_expired']}\n"
+        )
+        media_stats = media.stats()
+        text += f"🖼 Картинки: загрузок {media_stats['uploads']}, по file_id {media_stats['cached_sends']}\n"
+        busiest = [row for row in router.stats() if row["calls"]][:5]
+        if busiest:
+            text += "\n<b>⏱ Колбэки (вызовы / среднее / макс):</b>\n"
+            for row in busiest:
+                text += f"<code>{row['route']}</code>: {row['calls']} / {row['avg_ms']:.0f} мс / {row['max_ms']:.0f} мс\n"
+        queue_stats = outbound.stats()
+        queued = queue_stats["queued"]
+        text += (
+            f"\n<b>📤 Очередь отправки:</b> {sum(queued.values())} "
+            f"(платежи {queued['payment']}, ответы {queued['interactive']}, "
+            f"анимации {queued['animation']}, рассылка {queued['bulk']})\n"
+            f"Отправлено: {queue_stats['sent']}, в работе: {queue_stats['inflight']}, "
+            f"429: {queue_stats['rate_limited']}\n"
+        )
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
+
+@router.route("admin_rtp", admin_only=True)
+def cb_admin_rtp(call, uid, user_data):
+    bot.answer_callback_query(call.id, "⏳ Считаем отдачу игр...")
+    
+    # Симуляция занимает несколько секунд, поэтому идет вне пула хендлеров
+    def job():
+        try:
+            import rtp
+            started = time.time()
+            report = rtp.format_report(rtp.run(RTP_REPORT_ROUNDS, RTP_REPORT_BET))
+            bot.send_message(
                 uid,
-                "🎰 <b>СОЗДАНИЕ РОЗЫГРЫША</b>\n\n"
-                "Введите данные розыгрыша в формате:\n"
-                "<code>Название|Приз|Цена билета|Дата окончания (ГГГГ-ММ-ДД)</code>\n\n"
-                "Пример:\n"
-                "<code>Новогодний розыгрыш|1000|50|2024-12-31</code>"
-            )
-            bot.register_next_step_handler(msg, admin_create_lottery)
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "admin_sponsors":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            sponsors = get_sponsor_channels_cached()
-            
-            if not sponsors:
-                text = "📺 <b>СПОНСОРСКИЕ КАНАЛЫ</b>\n\n"
-                text += "Спонсорские каналы не добавлены."
-            else:
-                text = "📺 <b>СПОНСОРСКИЕ КАНАЛЫ</b>\n\n"
-                for i, (channel_username, channel_name) in enumerate(sponsors, 1):
-                    text += f"{i}. {channel_name} - @{channel_username}\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
-        
-        elif call.data == "admin_exchange_requests":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            safe_edit_message_text(
-                bot,
-                "⭐ <b>УПРАВЛЕНИЕ ЗАЯВКАМИ НА ОБМЕН</b>\n\n"
-                "Выберите действие:",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=admin_exchange_requests_keyboard()
+                f"📈 <b>ОТДАЧА ИГР</b>\n\n<pre>{report}</pre>\n\n"
+                f"{RTP_REPORT_ROUNDS:,} раундов на игру, ставка {RTP_REPORT_BET}💎, {time.time() - started:.1f} с\n"
+                f"💡 Гистограммы выплат: <code>python rtp.py --histogram</code>"
             )
+        except Exception as e:
+            logger.error(f"RTP report failed: {e}")
+            bot.send_message(uid, f"❌ Не удалось посчитать отдачу: {e}")
+    
+    threading.Thread(target=job, daemon=True).start()
+
+@router.route("admin_users", admin_only=True)
+def cb_admin_users(call, uid, user_data):
+    from database import get_all_users
+    users = get_all_users()
+    
+    if not users:
+        text = "👥 <b>СПИСОК ПОЛЬЗОВАТЕЛЕЙ</b>\n\n"
+        text += "Пользователей пока нет."
+    else:
+        text = f"👥 <b>СПИСОК ПОЛЬЗОВАТЕЛЕЙ ({len(users)})</b>\n\n"
+        for i, (user_id, username, balance) in enumerate(users[:20], 1):
+            text += f"{i}. @{username or 'Нет'} (ID: {user_id}) - {balance}💎\n"
         
-        elif call.data == "admin_exchange_list":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            from database import get_all_exchange_requests
-            requests = get_all_exchange_requests(20)
-            
-            if not requests:
-                text = "📋 <b>СПИСОК ЗАЯВОК НА ОБМЕН</b>\n\n"
-                text += "Заявок пока нет."
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
-                return
-            
-            text = "📋 <b>СПИСОК ЗАЯВОК НА ОБМЕН</b>\n\n"
-            for req in requests[:10]:  # Показываем первые 10
-                req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = req
-                text += f"<b>#{req_id}</b> - {gift_emoji} {gift_name}\n"
-                text += f"Пользователь: @{username} (ID: {user_id})\n"
-                text += f"Стоимость: {diamonds_cost}💎 → ⭐ {stars_amount}\n"
-                text += f"Статус: {status}\n"
-                text += "━━━━━━━━━━━━━━━━\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
-        
-        elif call.data == "admin_exchange_pending":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            from database import get_pending_exchange_requests
-            requests = get_pending_exchange_requests(10)
-            
-            if not requests:
-                text = "✅ <b>ЗАЯВКИ НА ВЫДАЧУ</b>\n\n"
-                text += "Нет ожидающих заявок."
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
-                return
-            
-            text = "✅ <b>ЗАЯВКИ НА ВЫДАЧУ</b>\n\n"
-            for req in requests:
-                req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = req
-                text += f"<b>#{req_id}</b> - {gift_emoji} {gift_name}\n"
-                text += f"Пользователь: @{username} (ID: {user_id})\n"
-                text += f"Стоимость: {diamonds_cost}💎 → ⭐ {stars_amount}\n"
-                text += f"Время: {time.strftime('%H:%M %d.%m', time.localtime(created_at))}\n\n"
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
-        
-        elif call.data == "admin_exchange_stats":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            from database import get_exchange_stats
-            stats = get_exchange_stats()
-            
-            if stats:
-                total_requests, completed, pending, rejected, total_stars, total_diamonds = stats
-                text = f"""
+        if len(users) > 20:
+            text += f"\n... и еще {len(users) - 20} пользователей"
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
+
+@router.route("admin_broadcast", admin_only=True)
+def cb_admin_broadcast(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "📢 <b>РАССЫЛКА</b>\n\n"
+        "Введите сообщение для рассылки всем пользователям:\n\n"
+        "💡 Можно использовать HTML разметку"
+    )
+    bot.register_next_step_handler(msg, admin_broadcast_message)
+    bot.answer_callback_query(call.id)
+
+@router.route(prefix="broadcast_cancel_", params=(int,), admin_only=True)
+def cb_broadcast_cancel(call, uid, user_data, broadcast_id):
+    if broadcasts.cancel(broadcast_id):
+        bot.answer_callback_query(call.id, "⛔ Рассылка будет остановлена")
+    else:
+        bot.answer_callback_query(call.id, "Рассылка уже завершена")
+
+@router.route("admin_settings", admin_only=True)
+def cb_admin_settings(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "⚙ <b>НАСТРОЙКИ АДМИНИСТРАТОРА</b>\n\n"
+        "Выберите действие:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=admin_settings_keyboard()
+    )
+
+@router.route("admin_promocodes", admin_only=True)
+def cb_admin_promocodes(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "🎫 <b>УПРАВЛЕНИЕ ПРОМОКОДАМИ</b>\n\n"
+        "Выберите действие:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=admin_promocodes_keyboard()
+    )
+
+@router.route("admin_create_lottery", admin_only=True)
+def cb_admin_create_lottery(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "🎰 <b>СОЗДАНИЕ РОЗЫГРЫША</b>\n\n"
+        "Введите данные розыгрыша в формате:\n"
+        "<code>Название|Приз|Цена билета|Дата окончания (ГГГГ-ММ-ДД)</code>\n\n"
+        "Пример:\n"
+        "<code>Новогодний розыгрыш|1000|50|2024-12-31</code>"
+    )
+    bot.register_next_step_handler(msg, admin_create_lottery)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_sponsors", admin_only=True)
+def cb_admin_sponsors(call, uid, user_data):
+    sponsors = get_sponsor_channels_cached()
+    
+    if not sponsors:
+        text = "📺 <b>СПОНСОРСКИЕ КАНАЛЫ</b>\n\n"
+        text += "Спонсорские каналы не добавлены."
+    else:
+        text = "📺 <b>СПОНСОРСКИЕ КАНАЛЫ</b>\n\n"
+        for i, (channel_username, channel_name) in enumerate(sponsors, 1):
+            text += f"{i}. {channel_name} - @{channel_username}\n"
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_keyboard())
+
+@router.route("admin_exchange_requests", admin_only=True)
+def cb_admin_exchange_requests(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "⭐ <b>УПРАВЛЕНИЕ ЗАЯВКАМИ НА ОБМЕН</b>\n\n"
+        "Выберите действие:",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=admin_exchange_requests_keyboard()
+    )
+
+@router.route("admin_exchange_list", admin_only=True)
+def cb_admin_exchange_list(call, uid, user_data):
+    from database import get_all_exchange_requests
+    requests = get_all_exchange_requests(20)
+    
+    if not requests:
+        text = "📋 <b>СПИСОК ЗАЯВОК НА ОБМЕН</b>\n\n"
+        text += "Заявок пока нет."
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
+        return
+    
+    text = "📋 <b>СПИСОК ЗАЯВОК НА ОБМЕН</b>\n\n"
+    for req in requests[:10]:  # Показываем первые 10
+        req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = req
+        text += f"<b>#{req_id}</b> - {gift_emoji} {gift_name}\n"
+        text += f"Пользователь: @{username} (ID: {user_id})\n"
+        text += f"Стоимость: {diamonds_cost}💎 → ⭐ {stars_amount}\n"
+        text += f"Статус: {status}\n"
+        text += "━━━━━━━━━━━━━━━━\n"
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
+
+@router.route("admin_exchange_pending", admin_only=True)
+def cb_admin_exchange_pending(call, uid, user_data):
+    from database import get_pending_exchange_requests
+    requests = get_pending_exchange_requests(10)
+    
+    if not requests:
+        text = "✅ <b>ЗАЯВКИ НА ВЫДАЧУ</b>\n\n"
+        text += "Нет ожидающих заявок."
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
+        return
+    
+    text = "✅ <b>ЗАЯВКИ НА ВЫДАЧУ</b>\n\n"
+    for req in requests:
+        req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = req
+        text += f"<b>#{req_id}</b> - {gift_emoji} {gift_name}\n"
+        text += f"Пользователь: @{username} (ID: {user_id})\n"
+        text += f"Стоимость: {diamonds_cost}💎 → ⭐ {stars_amount}\n"
+        text += f"Время: {time.strftime('%H:%M %d.%m', time.localtime(created_at))}\n\n"
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
+
+@router.route("admin_exchange_stats", admin_only=True)
+def cb_admin_exchange_stats(call, uid, user_data):
+    from database import get_exchange_stats
+    stats = get_exchange_stats()
+    
+    if stats:
+        total_requests, completed, pending, rejected, total_stars, total_diamonds = stats
+        text = f"""
 📊 <b>СТАТИСТИКА ОБМЕНОВ</b>
 
 📋 <b>Заявки:</b>
@@ -1892,261 +2108,221 @@ def callback_handler(call):
 • Среднее время обработки: 15-30 минут
 • Отклонение заявки: при подозрении на мошенничество
 """
-                safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
-        
-        # ОБРАБОТКА ЗАЯВОК НА ОБМЕН (АДМИН) - НЕПОСРЕДСТВЕННАЯ ОБРАБОТКА
-        elif call.data.startswith("admin_exchange_complete_"):
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            request_id = int(call.data.split("_")[3])
-            update_exchange_request_status(request_id, "completed", uid, "Заявка выполнена")
-            
-            bot.answer_callback_query(call.id, "✅ Заявка отмечена как выполненная")
-            
-            # Уведомляем пользователя
-            request = get_exchange_request(request_id)
-            if request:
-                req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = request
-                try:
-                    bot.send_message(
-                        user_id,
-                        f"✅ <b>ВАША ЗАЯВКА #{request_id} ВЫПОЛНЕНА!</b>\n\n"
-                        f"📋 <b>Детали:</b>\n"
-                        f"• Подарок: {gift_emoji} {gift_name}\n"
-                        f"• Telegram Stars: ⭐ {stars_amount}\n"
-                        f"• Стоимость: {diamonds_cost}💎\n"
-                        f"• Администратор: ID {uid}\n\n"
-                        f"💡 Telegram Stars подарок должен быть отправлен вам в ближайшее время.\n"
-                        f"Если у вас возникли проблемы - обратитесь к администратору."
-                    )
-                except:
-                    pass
-            
-            # Удаляем сообщение с заявкой
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except:
-                pass
-        
-        elif call.data.startswith("admin_exchange_reject_"):
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            request_id = int(call.data.split("_")[3])
-            
-            # Возвращаем алмазы пользователю
-            request = get_exchange_request(request_id)
-            if request:
-                req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = request
-                update_balance(user_id, diamonds_cost, f"exchange_refund_{request_id}")
-                
-                # Отмечаем как отклоненную
-                update_exchange_request_status(request_id, "rejected", uid, "Заявка отклонена")
-                
-                bot.answer_callback_query(call.id, "❌ Заявка отклонена, алмазы возвращены")
-                
-                # Уведомляем пользователя
-                try:
-                    bot.send_message(
-                        user_id,
-                        f"❌ <b>ВАША ЗАЯВКА #{request_id} ОТКЛОНЕНА</b>\n\n"
-                        f"📋 <b>Детали:</b>\n"
-                        f"• Подарок: {gift_emoji} {gift_name}\n"
-                        f"• Стоимость: {diamonds_cost}💎 (возвращены)\n"
-                        f"• Администратор: ID {uid}\n\n"
-                        f"💡 Алмазы возвращены на ваш баланс.\n"
-                        f"Причина: проверка безопасности или технические проблемы."
-                    )
-                except:
-                    pass
-            
-            # Удаляем сообщение с заявкой
-            try:
-                bot.delete_message(call.message.chat.id, call.message.message_id)
-            except:
-                pass
-        
-        # АДМИН: БАН/РАЗБАН
-        elif call.data == "admin_ban_user":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "🔨 <b>БАН ПОЛЬЗОВАТЕЛЯ</b>\n\n"
-                "Введите ID пользователя для бана:\n"
-                "Например: <code>123456789</code>\n\n"
-                "💡 Забаненные пользователи не смогут пользоваться ботом."
-            )
-            bot.register_next_step_handler(msg, admin_ban_user)
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "admin_unban_user":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "🔓 <b>РАЗБАН ПОЛЬЗОВАТЕЛЯ</b>\n\n"
-                "Введите ID пользователя для разбана:\n"
-                "Например: <code>123456789</code>"
-            )
-            bot.register_next_step_handler(msg, admin_unban_user)
-            bot.answer_callback_query(call.id)
-        
-        # НАЗАД
-        elif call.data == "back_games":
-            safe_edit_message_text(
-                bot,
-                "<b>🎮 Выберите игру</b>",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=games_keyboard()
-            )
-        
-        elif call.data == "back_main":
-            bot.delete_message(call.message.chat.id, call.message.message_id)
-        
-        elif call.data == "back_admin":
-            safe_edit_message_text(
-                bot,
-                "🛠 <b>Панель администратора</b>",
-                call.message.chat.id,
-                call.message.message_id,
-                reply_markup=admin_keyboard()
+        safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_exchange_requests_keyboard())
+
+# ОБРАБОТКА ЗАЯВОК НА ОБМЕН (АДМИН) - НЕПОСРЕДСТВЕННАЯ ОБРАБОТКА
+@router.route(prefix="admin_exchange_complete_", params=(int,), admin_only=True)
+def cb_admin_exchange_complete(call, uid, user_data, request_id):
+    update_exchange_request_status(request_id, "completed", uid, "Заявка выполнена")
+    
+    bot.answer_callback_query(call.id, "✅ Заявка отмечена как выполненная")
+    
+    # Уведомляем пользователя
+    request = get_exchange_request(request_id)
+    if request:
+        req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = request
+        try:
+            bot.send_message(
+                user_id,
+                f"✅ <b>ВАША ЗАЯВКА #{request_id} ВЫПОЛНЕНА!</b>\n\n"
+                f"📋 <b>Детали:</b>\n"
+                f"• Подарок: {gift_emoji} {gift_name}\n"
+                f"• Telegram Stars: ⭐ {stars_amount}\n"
+                f"• Стоимость: {diamonds_cost}💎\n"
+                f"• Администратор: ID {uid}\n\n"
+                f"💡 Telegram Stars подарок должен быть отправлен вам в ближайшее время.\n"
+                f"Если у вас возникли проблемы - обратитесь к администратору."
             )
+        except:
+            pass
+    
+    # Удаляем сообщение с заявкой
+    try:
+        bot.delete_message(call.message.chat.id, call.message.message_id)
+    except:
+        pass
+
+@router.route(prefix="admin_exchange_reject_", params=(int,), admin_only=True)
+def cb_admin_exchange_reject(call, uid, user_data, request_id):
+    
+    # Возвращаем алмазы пользователю
+    request = get_exchange_request(request_id)
+    if request:
+        req_id, user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost, status, admin_id, admin_comment, created_at, completed_at = request
+        update_balance(user_id, diamonds_cost, f"exchange_refund_{request_id}")
         
-        # АДМИН: СПОНСОРЫ
-        elif call.data == "admin_whitelist":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            whitelist = get_whitelist()
-            
-            if not whitelist:
-                text = "👥 <b>БЕЛЫЙ СПИСОК</b>\n\n"
-                text += "Белый список пуст."
-            else:
-                text = "👥 <b>БЕЛЫЙ СПИСОК</b>\n\n"
-                text += f"Пользователей в белом списке: {len(whitelist)}\n\n"
-                text += "<b>ID пользователей:</b>\n"
-                text += ", ".join([str(user_id) for user_id in whitelist[:20]])
-                if len(whitelist) > 20:
-                    text += f" и еще {len(whitelist) - 20}..."
-            
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_settings_keyboard())
-        
-        elif call.data == "admin_restart":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            bot.answer_callback_query(call.id, "🔄 Перезапуск бота...")
-            bot.send_message(uid, "🔄 <b>Перезапуск бота...</b>")
-            
-            # Перезапуск бота
-            restart_bot()
+        # Отмечаем как отклоненную
+        update_exchange_request_status(request_id, "rejected", uid, "Заявка отклонена")
         
-        elif call.data == "admin_add_sponsor":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "📝 <b>ДОБАВЛЕНИЕ СПОНСОРА</b>\n\n"
-                "Введите username канала и название через пробел:\n"
-                "Например: <code>@channel_name Название канала</code>"
-            )
-            bot.register_next_step_handler(msg, admin_add_sponsor)
-            bot.answer_callback_query(call.id)
+        bot.answer_callback_query(call.id, "❌ Заявка отклонена, алмазы возвращены")
         
-        elif call.data == "admin_remove_sponsor":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            sponsors = get_sponsor_channels_cached()
-            
-            if not sponsors:
-                bot.send_message(uid, "❌ Нет спонсорских каналов для удаления")
-                return
-            
-            text = "🗑 <b>УДАЛЕНИЕ СПОНСОРА</b>\n\n"
-            text += "Введите username канала для удаления:\n\n"
-            text += "<b>Текущие спонсоры:</b>\n"
-            for sp_username, sp_name in sponsors:
-                text += f"• @{sp_username} - {sp_name}\n"
-            
-            msg = bot.send_message(uid, text)
-            bot.register_next_step_handler(msg, admin_remove_sponsor)
-            bot.answer_callback_query(call.id)
-        
-        # АДМИН: ПРОМОКОДЫ
-        elif call.data == "admin_create_promo":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            msg = bot.send_message(
-                uid,
-                "🎫 <b>СОЗДАНИЕ ПРОМОКОДА</b>\n\n"
-                "Введите данные промокода в формате:\n"
-                "<code>КОД|НАГРАДА|ЛИМИТ|СРОК_ЧАСЫ</code>\n\n"
-                "Пример:\n"
-                "<code>NEWYEAR2024|100|50|168</code>\n\n"
-                "• КОД: промокод (только буквы и цифры)\n"
-                "• НАГРАДА: количество алмазов\n"
-                "• ЛИМИТ: максимальное количество использований\n"
-                "• СРОК_ЧАСЫ: срок действия в часах (0 = бессрочно)"
+        # Уведомляем пользователя
+        try:
+            bot.send_message(
+                user_id,
+                f"❌ <b>ВАША ЗАЯВКА #{request_id} ОТКЛОНЕНА</b>\n\n"
+                f"📋 <b>Детали:</b>\n"
+                f"• Подарок: {gift_emoji} {gift_name}\n"
+                f"• Стоимость: {diamonds_cost}💎 (возвращены)\n"
+                f"• Администратор: ID {uid}\n\n"
+                f"💡 Алмазы возвращены на ваш баланс.\n"
+                f"Причина: проверка безопасности или технические проблемы."
             )
-            bot.register_next_step_handler(msg, admin_create_promo)
-            bot.answer_callback_query(call.id)
-        
-        elif call.data == "admin_list_promos":
-            if not is_admin(uid):
-                bot.answer_callback_query(call.id, "❌ Доступ запрещен")
-                return
-            
-            from database import get_all_promo_codes
-            promos = get_all_promo_codes()
-            
-            if not promos:
-                text = "📋 <b>СПИСОК ПРОМОКОДОВ</b>\n\n"
-                text += "Промокодов пока нет."
-            else:
-                text = "📋 <b>СПИСОК ПРОМОКОДОВ</b>\n\n"
-                for promo in promos[:10]:
-                    code, reward, usage_limit, used_count, created_at, expires_at = promo
-                    time_str = time.strftime('%d.%m.%Y', time.localtime(created_at))
-                    expires_str = "Бессрочно" if expires_at == 0 else time.strftime('%d.%m.%Y %H:%M', time.localtime(expires_at))
-                    
-                    text += f"<b>{code}</b>\n"
-                    text += f"Награда: {reward}💎 | Использовано: {used_count}/{usage_limit}\n"
-                    text += f"Создан: {time_str} | Действует до: {expires_str}\n"
-                    text += "━━━━━━━━━━━━━━━━\n"
-                
-                if len(promos) > 10:
-                    text += f"\n... и еще {len(promos) - 10} промокодов"
+        except:
+            pass
+    
+    # Удаляем сообщение с заявкой
+    try:
+        bot.delete_message(call.message.chat.id, call.message.message_id)
+    except:
+        pass
+
+# АДМИН: БАН/РАЗБАН
+@router.route("admin_ban_user", admin_only=True)
+def cb_admin_ban_user(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "🔨 <b>БАН ПОЛЬЗОВАТЕЛЯ</b>\n\n"
+        "Введите ID пользователя для бана:\n"
+        "Например: <code>123456789</code>\n\n"
+        "💡 Забаненные пользователи не смогут пользоваться ботом."
+    )
+    bot.register_next_step_handler(msg, admin_ban_user)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_unban_user", admin_only=True)
+def cb_admin_unban_user(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "🔓 <b>РАЗБАН ПОЛЬЗОВАТЕЛЯ</b>\n\n"
+        "Введите ID пользователя для разбана:\n"
+        "Например: <code>123456789</code>"
+    )
+    bot.register_next_step_handler(msg, admin_unban_user)
+    bot.answer_callback_query(call.id)
+
+# НАЗАД
+@router.route("back_games")
+def cb_back_games(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "<b>🎮 Выберите игру</b>",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=games_keyboard()
+    )
+
+@router.route("back_main")
+def cb_back_main(call, uid, user_data):
+    bot.delete_message(call.message.chat.id, call.message.message_id)
+
+@router.route("back_admin")
+def cb_back_admin(call, uid, user_data):
+    safe_edit_message_text(
+        bot,
+        "🛠 <b>Панель администратора</b>",
+        call.message.chat.id,
+        call.message.message_id,
+        reply_markup=admin_keyboard()
+    )
+
+# АДМИН: СПОНСОРЫ
+@router.route("admin_whitelist", admin_only=True)
+def cb_admin_whitelist(call, uid, user_data):
+    whitelist = get_whitelist()
+    
+    if not whitelist:
+        text = "👥 <b>БЕЛЫЙ СПИСОК</b>\n\n"
+        text += "Белый список пуст."
+    else:
+        text = "👥 <b>БЕЛЫЙ СПИСОК</b>\n\n"
+        text += f"Пользователей в белом списке: {len(whitelist)}\n\n"
+        text += "<b>ID пользователей:</b>\n"
+        text += ", ".join([str(user_id) for user_id in whitelist[:20]])
+        if len(whitelist) > 20:
+            text += f" и еще {len(whitelist) - 20}..."
+    
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_settings_keyboard())
+
+@router.route("admin_restart", admin_only=True)
+def cb_admin_restart(call, uid, user_data):
+    bot.answer_callback_query(call.id, "🔄 Перезапуск бота...")
+    bot.send_message(uid, "🔄 <b>Перезапуск бота...</b>")
+    
+    # Перезапуск бота
+    restart_bot()
+
+@router.route("admin_add_sponsor", admin_only=True)
+def cb_admin_add_sponsor(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "📝 <b>ДОБАВЛЕНИЕ СПОНСОРА</b>\n\n"
+        "Введите username канала и название через пробел:\n"
+        "Например: <code>@channel_name Название канала</code>"
+    )
+    bot.register_next_step_handler(msg, admin_add_sponsor)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_remove_sponsor", admin_only=True)
+def cb_admin_remove_sponsor(call, uid, user_data):
+    sponsors = get_sponsor_channels_cached()
+    
+    if not sponsors:
+        bot.send_message(uid, "❌ Нет спонсорских каналов для удаления")
+        return
+    
+    text = "🗑 <b>УДАЛЕНИЕ СПОНСОРА</b>\n\n"
+    text += "Введите username канала для удаления:\n\n"
+    text += "<b>Текущие спонсоры:</b>\n"
+    for sp_username, sp_name in sponsors:
+        text += f"• @{sp_username} - {sp_name}\n"
+    
+    msg = bot.send_message(uid, text)
+    bot.register_next_step_handler(msg, admin_remove_sponsor)
+    bot.answer_callback_query(call.id)
+
+# АДМИН: ПРОМОКОДЫ
+@router.route("admin_create_promo", admin_only=True)
+def cb_admin_create_promo(call, uid, user_data):
+    msg = bot.send_message(
+        uid,
+        "🎫 <b>СОЗДАНИЕ ПРОМОКОДА</b>\n\n"
+        "Введите данные промокода в формате:\n"
+        "<code>КОД|НАГРАДА|ЛИМИТ|СРОК_ЧАСЫ</code>\n\n"
+        "Пример:\n"
+        "<code>NEWYEAR2024|100|50|168</code>\n\n"
+        "• КОД: промокод (только буквы и цифры)\n"
+        "• НАГРАДА: количество алмазов\n"
+        "• ЛИМИТ: максимальное количество использований\n"
+        "• СРОК_ЧАСЫ: срок действия в часах (0 = бессрочно)"
+    )
+    bot.register_next_step_handler(msg, admin_create_promo)
+    bot.answer_callback_query(call.id)
+
+@router.route("admin_list_promos", admin_only=True)
+def cb_admin_list_promos(call, uid, user_data):
+    from database import get_all_promo_codes
+    promos = get_all_promo_codes()
+    
+    if not promos:
+        text = "📋 <b>СПИСОК ПРОМОКОДОВ</b>\n\n"
+        text += "Промокодов пока нет."
+    else:
+        text = "📋 <b>СПИСОК ПРОМОКОДОВ</b>\n\n"
+        for promo in promos[:10]:
+            code, reward, usage_limit, used_count, created_at, expires_at = promo
+            time_str = time.strftime('%d.%m.%Y', time.localtime(created_at))
+            expires_str = "Бессрочно" if expires_at == 0 else time.strftime('%d.%m.%Y %H:%M', time.localtime(expires_at))
             
-            safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_promocodes_keyboard())
+            text += f"<b>{code}</b>\n"
+            text += f"Награда: {reward}💎 | Использовано: {used_count}/{usage_limit}\n"
+            text += f"Создан: {time_str} | Действует до: {expires_str}\n"
+            text += "━━━━━━━━━━━━━━━━\n"
         
-        # Если не найдено - просто отвечаем
-        else:
-            bot.answer_callback_query(call.id, "⏳ Обработка...")
+        if len(promos) > 10:
+            text += f"\n... и еще {len(promos) - 10} промокодов"
     
-    except Exception as e:
-        logger.error(f"Error in callback {call.data}: {e}")
-        try:
-            bot.answer_callback_query(call.id, "❌ Произошла ошибка")
-        except:
-            pass
+    safe_edit_message_text(bot, text, call.message.chat.id, call.message.message_id, reply_markup=admin_promocodes_keyboard())
 
 # ========== АДМИН ФУНКЦИИ ==========
 
@@ -2265,30 +2441,9 @@ def admin_broadcast_message(message):
     
     text = message.text
     
-    bot.send_message(uid, f"📢 <b>Начинаю рассылку...</b>\n\nПолучателей: ?")
-    
-    from database import get_all_users
-    users = get_all_users()
-    
-    success = 0
-    failed = 0
-    
-    for user_id, username, _ in users:
-        try:
-            bot.send_message(user_id, text, parse_mode="HTML")
-            success += 1
-            time.sleep(0.05)  # Задержка чтобы не превысить лимиты
-        except Exception as e:
-            logger.error(f"Failed to send to {user_id}: {e}")
-            failed += 1
-    
-    bot.send_message(
-        uid,
-        f"✅ <b>Рассылка завершена!</b>\n\n"
-        f"📊 <b>Результаты:</b>\n"
-        f"├ Успешно: {success}\n"
-        f"└ Не удалось: {failed}"
-    )
+    # Прогресс рассылки движок показывает в этом сообщении
+    status = bot.send_message(uid, f"📢 <b>Начинаю рассылку...</b>")
+    broadcasts.start(uid, text, status.chat.id, status.message_id)
 
 def admin_create_lottery(message):
     """Админ: создание розыгрыша"""
@@ -2305,12 +2460,18 @@ def admin_create_lottery(message):
         name = parts[0].strip()
         prize = int(parts[1])
         ticket_price = int(parts[2])
-        end_date = parts[3].strip()
         
         if prize <= 0 or ticket_price <= 0:
             bot.send_message(uid, "❌ Приз и цена билета должны быть больше 0")
             return
         
+        # Дата хранится в ISO-виде: get_due_custom_lotteries сравнивает ее строкой
+        try:
+            end_date = datetime.strptime(parts[3].strip(), "%Y-%m-%d").strftime("%Y-%m-%d")
+        except ValueError:
+            bot.send_message(uid, "❌ Неверная дата. Используйте формат ГГГГ-ММ-ДД, например 2024-12-31")
+            return
+        
         lottery_id = create_custom_lottery(name, prize, ticket_price, end_date, uid)
         
         bot.send_message(
@@ -2613,6 +2774,20 @@ def handle_subscription_check(message, check_result):
 
 # ========== ПРОВЕРКА ПЛАТЕЖЕЙ ПО ТАЙМЕРУ ==========
 
+def notify_payment_credited(user_id, amount):
+    """Сообщить пользователю о зачисленном платеже CryptoBot"""
+    try:
+        with priority(PRIORITY_PAYMENT):
+            bot.send_message(
+                user_id,
+                f"✅ <b>ПЛАТЕЖ ОБРАБОТАН!</b>\n\n"
+                f"На ваш баланс зачислено: <b>+{amount}💎</b>\n"
+                f"Новый баланс: <b>{get_user(user_id)[2]}💎</b>\n\n"
+                f"Спасибо за покупку!"
+            )
+    except Exception as e:
+        logger.error(f"Failed to notify {user_id} about payment: {e}")
+
 def check_payments_job():
     """Периодическая проверка статуса платежей"""
     import threading
@@ -2620,42 +2795,11 @@ def check_payments_job():
     def job():
         while True:
             try:
-                # Получаем все ожидающие платежи
-                cursor.execute("SELECT invoice_id FROM payments WHERE status='pending'")
-                pending_payments = cursor.fetchall()
+                # Статусы ожидающих платежей запрашиваются пачками по CRYPTOBOT_BATCH_SIZE
+                poll_pending_payments(on_credited=notify_payment_credited)
                 
-                for (invoice_id,) in pending_payments:
-                    # Проверяем статус в CryptoBot
-                    status = check_cryptobot_invoice(invoice_id)
-                    
-                    if status == 'paid':
-                        # Получаем информацию о платеже
-                        payment = get_payment_by_invoice(invoice_id)
-                        if payment:
-                            payment_id, user_id, amount, invoice_id_db, status_db, created_at, completed_at = payment
-                            
-                            if status_db != 'paid':
-                                # Обновляем статус
-                                update_payment_status(invoice_id, 'paid')
-                                
-                                # Начисляем алмазы
-                                update_balance(user_id, amount, f"cryptobot_payment_{invoice_id}")
-                                
-                                # Уведомляем пользователя
-                                try:
-                                    bot.send_message(
-                                        user_id,
-                                        f"✅ <b>ПЛАТЕЖ ОБРАБОТАН!</b>\n\n"
-                                        f"На ваш баланс зачислено: <b>+{amount}💎</b>\n"
-                                        f"Новый баланс: <b>{get_user(user_id)[2]}💎</b>\n\n"
-                                        f"Спасибо за покупку!"
-                                    )
-                                except:
-                                    pass
-                                
-                                logger.info(f"Auto payment processed for user {user_id}: {amount} алмазов")
-                
-                time.sleep(60)  # Проверяем каждые 60 секунд
+                # С вебхуком опрос только подбирает пропущенные счета
+                time.sleep(CRYPTOBOT_RECONCILE_INTERVAL if CRYPTOBOT_WEBHOOK_ENABLED else CRYPTOBOT_POLL_INTERVAL)
                 
             except Exception as e:
                 logger.error(f"Error in payments job: {e}")
@@ -2665,6 +2809,77 @@ def check_payments_job():
     thread = threading.Thread(target=job, daemon=True)
     thread.start()
 
+# Итоги последней проверки просроченных счетов (для статистики админа)
+payment_sweep_stats = {"checked": 0, "expired": 0, "credited": 0, "stars_expired": 0}
+
+def expire_payments_job():
+    """Периодическое закрытие просроченных счетов"""
+    def job():
+        while True:
+            try:
+                payment_sweep_stats.update(sweep_expired_payments(on_credited=notify_payment_credited))
+            except Exception as e:
+                logger.error(f"Error in payment expiry job: {e}")
+            time.sleep(PAYMENT_EXPIRY_SWEEP_INTERVAL)
+    
+    thread = threading.Thread(target=job, daemon=True)
+    thread.start()
+
+# ========== РОЗЫГРЫШИ ПО РАСПИСАНИЮ ==========
+
+lottery_rng = random.SystemRandom()
+
+def notify_lottery_winner(user_id, title, ticket_number, prize):
+    try:
+        with priority(PRIORITY_PAYMENT):
+            bot.send_message(
+                user_id,
+                f"🎉 <b>ВЫ ВЫИГРАЛИ В РОЗЫГРЫШЕ!</b>\n\n"
+                f"🎰 <b>Розыгрыш:</b> {title}\n"
+                f"🎫 <b>Счастливый билет:</b> #{ticket_number}\n"
+                f"💰 <b>Приз:</b> +{prize}💎"
+            )
+    except Exception as e:
+        logger.error(f"Failed to notify lottery winner {user_id}: {e}")
+
+def run_due_lottery_draws():
+    """Провести все розыгрыши, дата которых наступила (в том числе пропущенные, пока бот не работал)"""
+    today = datetime.now().strftime("%Y-%m-%d")
+    
+    for draw_date in get_due_lottery_draws(today):
+        ticket_count = get_lottery_ticket_count(draw_date)
+        if not ticket_count:
+            continue
+        prize = Lottery.get_current_jackpot(ticket_count)
+        result = settle_lottery_draw(draw_date, lottery_rng.randint(1, ticket_count), prize)
+        if result:
+            winner_id, username, ticket_number = result
+            logger.info(f"Lottery {draw_date}: winner {winner_id} (ticket #{ticket_number} of {ticket_count}), prize {prize}")
+            notify_lottery_winner(winner_id, f"еженедельный, {draw_date}", ticket_number, prize)
+    
+    for lottery_id, name, _ in get_due_custom_lotteries(today):
+        ticket_count = get_custom_lottery_ticket_count(lottery_id)
+        result = settle_custom_lottery(lottery_id, lottery_rng.randint(1, max(ticket_count, 1)))
+        if result:
+            winner_id, username, ticket_number, prize = result
+            logger.info(f"Custom lottery #{lottery_id}: winner {winner_id} (ticket #{ticket_number} of {ticket_count}), prize {prize}")
+            notify_lottery_winner(winner_id, name, ticket_number, prize)
+        else:
+            logger.info(f"Custom lottery #{lottery_id} closed without tickets")
+
+def lottery_draw_job():
+    """Периодическая проверка розыгрышей"""
+    def job():
+        while True:
+            try:
+                run_due_lottery_draws()
+            except Exception as e:
+                logger.error(f"Error in lottery draw job: {e}")
+            time.sleep(LOTTERY_DRAW_CHECK_INTERVAL)
+    
+    thread = threading.Thread(target=job, daemon=True)
+    thread.start()
+
 # ========== ЗАПУСК БОТА ==========
 
 if __name__ == "__main__":
@@ -2695,8 +2910,31 @@ if __name__ == "__main__":
     print("• 🔄 Автоматический перезапуск при критических ошибках")
     print("• 💾 Бот сохраняет состояние при перезагрузке сервера")
     
-    # Запускаем проверку платежей
+    # Запускаем отложенную запись счетчиков
+    start_counter_flusher()
+    atexit.register(flush_counters)
+    
+    # Запускаем проверку платежей и закрытие просроченных счетов
     check_payments_job()
+    expire_payments_job()
+    
+    # Проводим розыгрыши по расписанию
+    lottery_draw_job()
+    
+    # Продолжаем рассылки, прерванные перезапуском
+    broadcasts.resume()
+    
+    # Вебхуки Telegram и CryptoBot
+    start_webhook_server()
+    
+    if UPDATE_MODE == "webhook":
+        run_webhook()
+    
+    # Long polling не работает, пока установлен вебхук
+    try:
+        bot.remove_webhook()
+    except Exception as e:
+        logger.error(f"Failed to remove webhook: {e}")
     
     # Основной цикл с перезапуском при ошибках
     while True:
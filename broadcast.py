@@ -0,0 +1,126 @@
+import threading
+import time
+from database import (
+    create_broadcast, get_broadcast, get_running_broadcasts, get_broadcast_recipients,
+    save_broadcast_progress, finish_broadcast,
+)
+from keyboards import broadcast_keyboard
+from outbound import priority, PRIORITY_BULK
+from utils import logger, safe_edit_message_text
+
+class BroadcastEngine:
+    """Рассылки сообщений всем пользователям в фоновых потоках.
+
+    Получатели читаются из БД порциями по возрастанию user_id, порция целиком
+    ставится в очередь отправки (скорость ограничивает сама очередь), после
+    нее курсор и счетчики сохраняются в БД. После перезапуска незавершенные
+    рассылки продолжаются с курсора: повторно может прийти не больше одной
+    порции. Пользователи, заблокировавшие бота (403), исключаются из
+    следующих рассылок.
+    """
+
+    def __init__(self, bot, chunk_size=200, progress_interval=5):
+        self.bot = bot
+        self.chunk_size = chunk_size
+        self.progress_interval = progress_interval
+        self._lock = threading.Lock()
+        self._running = set()
+        self._cancelled = set()
+
+    def start(self, admin_id, text, status_chat_id, status_message_id):
+        """Создать рассылку и запустить ее; возвращает id рассылки"""
+        broadcast_id = create_broadcast(admin_id, text, status_chat_id, status_message_id)
+        self._spawn(broadcast_id)
+        return broadcast_id
+
+    def resume(self):
+        """Продолжить рассылки, прерванные перезапуском бота"""
+        for broadcast_id in get_running_broadcasts():
+            logger.info(f"Resuming broadcast {broadcast_id}")
+            self._spawn(broadcast_id)
+
+    def cancel(self, broadcast_id):
+        with self._lock:
+            if broadcast_id not in self._running:
+                return False
+            self._cancelled.add(broadcast_id)
+            return True
+
+    def _spawn(self, broadcast_id):
+        with self._lock:
+            if broadcast_id in self._running:
+                return
+            self._running.add(broadcast_id)
+        threading.Thread(target=self._run, args=(broadcast_id,), name=f"broadcast-{broadcast_id}", daemon=True).start()
+
+    def _run(self, broadcast_id):
+        try:
+            self._send_all(broadcast_id)
+        except Exception as e:
+            logger.error(f"Broadcast {broadcast_id} stopped: {e}")
+        finally:
+            with self._lock:
+                self._running.discard(broadcast_id)
+                self._cancelled.discard(broadcast_id)
+
+    def _send_all(self, broadcast_id):
+        _, _, text, _, position, *_ = get_broadcast(broadcast_id)
+        last_report = 0
+        while True:
+            with self._lock:
+                cancelled = broadcast_id in self._cancelled
+            if cancelled:
+                finish_broadcast(broadcast_id, 'cancelled')
+                break
+            recipients = get_broadcast_recipients(position, self.chunk_size)
+            if not recipients:
+                finish_broadcast(broadcast_id)
+                break
+            sent, failed, blocked = self._send_chunk(recipients, text)
+            position = recipients[-1]
+            save_broadcast_progress(broadcast_id, position, sent, failed, blocked)
+            if time.monotonic() - last_report >= self.progress_interval:
+                self._report(broadcast_id)
+                last_report = time.monotonic()
+        self._report(broadcast_id)
+        logger.info(f"Broadcast {broadcast_id} finished")
+
+    def _send_chunk(self, recipients, text):
+        with priority(PRIORITY_BULK):
+            futures = [(user_id, self.bot.submit("send_message", user_id, text, parse_mode="HTML"))
+                       for user_id in recipients]
+        sent, failed, blocked = 0, 0, []
+        for user_id, future in futures:
+            try:
+                future.result()
+                sent += 1
+            except Exception as e:
+                if getattr(e, "error_code", None) == 403:
+                    blocked.append(user_id)
+                else:
+                    logger.error(f"Failed to send to {user_id}: {e}")
+                    failed += 1
+        return sent, failed, blocked
+
+    def _report(self, broadcast_id):
+        """Обновить сообщение админа с прогрессом рассылки"""
+        (_, _, _, status, _, total, sent, failed, blocked,
+         chat_id, message_id) = get_broadcast(broadcast_id)
+        done = sent + failed + blocked
+        percent = min(done * 100 // total, 100) if total else 100
+        if status == 'running':
+            title = f"📢 <b>Рассылка #{broadcast_id}: {percent}%</b>"
+        elif status == 'cancelled':
+            title = f"⛔ <b>Рассылка #{broadcast_id} остановлена</b>"
+        else:
+            title = f"✅ <b>Рассылка #{broadcast_id} завершена!</b>"
+        text = (
+            f"{title}\n\n"
+            f"📊 <b>Результаты:</b>\n"
+            f"├ Получателей: {total}\n"
+            f"├ Успешно: {sent}\n"
+            f"├ Заблокировали бота: {blocked}\n"
+            f"└ Не удалось: {failed}"
+        )
+        reply_markup = broadcast_keyboard(broadcast_id) if status == 'running' else None
+        safe_edit_message_text(self.bot, text, chat_id, message_id, reply_markup=reply_markup)
@@ -86,6 +86,93 @@ CRYPTOBOT_API_URL = os.environ.get("CRYPTOBOT_API_URL", "https://api.cryptobot.e
 ALMAZ_PRICE_USD = float(os.environ.get("ALMAZ_PRICE_USD", 1))
 ALMAZ_PACKAGES = [int(x) for x in os.environ.get("ALMAZ_PACKAGES", "10,20,50").split(",")]
 RATE_LIMIT_SECONDS = int(os.environ.get("RATE_LIMIT_SECONDS", 1))
+# Игры: шанс выигрыша в рулетке и минимальная ставка (меньшая ставка проигрывает)
+ROULETTE_WIN_CHANCE = float(os.environ.get("ROULETTE_WIN_CHANCE", 0.2))
+MIN_BET = int(os.environ.get("MIN_BET", 10))
+# Проверка счетов CryptoBot: сколько счетов в одном запросе getInvoices и как часто (сек)
+CRYPTOBOT_BATCH_SIZE = int(os.environ.get("CRYPTOBOT_BATCH_SIZE", 100))
+CRYPTOBOT_POLL_INTERVAL = int(os.environ.get("CRYPTOBOT_POLL_INTERVAL", 60))
+# Вебхук CryptoBot (invoice_paid) на том же HTTP-сервере, что и вебхук Telegram;
+# когда он включен, опрос остается редкой сверкой на случай потерянных вебхуков
+CRYPTOBOT_WEBHOOK_ENABLED = os.environ.get("CRYPTOBOT_WEBHOOK_ENABLED", "0") == "1"
+CRYPTOBOT_WEBHOOK_PATH = os.environ.get("CRYPTOBOT_WEBHOOK_PATH", "/cryptobot")
+CRYPTOBOT_RECONCILE_INTERVAL = int(os.environ.get("CRYPTOBOT_RECONCILE_INTERVAL", 900))
+# Срок жизни неоплаченного счета (сек) и как часто помечать просроченные счета
+PAYMENT_INVOICE_TTL = int(os.environ.get("PAYMENT_INVOICE_TTL", 3600))
+PAYMENT_EXPIRY_SWEEP_INTERVAL = int(os.environ.get("PAYMENT_EXPIRY_SWEEP_INTERVAL", 300))
+
+# Как часто проверять, не пора ли провести розыгрыши (сек)
+LOTTERY_DRAW_CHECK_INTERVAL = int(os.environ.get("LOTTERY_DRAW_CHECK_INTERVAL", 300))
+# Цена билета еженедельного розыгрыша и пакеты "купить N билетов" в меню розыгрыша
+LOTTERY_TICKET_PRICE = int(os.environ.get("LOTTERY_TICKET_PRICE", 10))
+LOTTERY_BULK_SIZES = [int(x) for x in os.environ.get("LOTTERY_BULK_SIZES", "5,10,25").split(",")]
+
+# Отчет об отдаче игр в админке (rtp.py): раундов на игру и ставка
+RTP_REPORT_ROUNDS = int(os.environ.get("RTP_REPORT_ROUNDS", 1000000))
+RTP_REPORT_BET = int(os.environ.get("RTP_REPORT_BET", 100))
+
+# -------------------------
+# SQLite storage profile
+# -------------------------
+DB_PATH = os.environ.get("DB_PATH", "casino.db")
+DB_JOURNAL_MODE = os.environ.get("DB_JOURNAL_MODE", "WAL")
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")
+DB_CACHE_SIZE = int(os.environ.get("DB_CACHE_SIZE", -16000))  # отрицательное значение = КиБ
+DB_MMAP_SIZE = int(os.environ.get("DB_MMAP_SIZE", 128 * 1024 * 1024))
+DB_TEMP_STORE = os.environ.get("DB_TEMP_STORE", "MEMORY")
+DB_BUSY_TIMEOUT = float(os.environ.get("DB_BUSY_TIMEOUT", 10))
+
+# Отложенная запись счетчиков (победы, сундуки, задания, активность)
+COUNTER_FLUSH_INTERVAL_MS = int(os.environ.get("COUNTER_FLUSH_INTERVAL_MS", 1000))
+COUNTER_FLUSH_MAX_ENTRIES = int(os.environ.get("COUNTER_FLUSH_MAX_ENTRIES", 500))
+
+# Кэш строк users перед get_user
+USER_CACHE_ENABLED = os.environ.get("USER_CACHE_ENABLED", "1") == "1"
+USER_CACHE_SIZE = int(os.environ.get("USER_CACHE_SIZE", 10000))
+USER_CACHE_TTL = float(os.environ.get("USER_CACHE_TTL", 300))
+
+# Кэш проверки подписки на спонсоров: подписан - надолго, не подписан - коротко
+SUBSCRIPTION_CACHE_TTL = float(os.environ.get("SUBSCRIPTION_CACHE_TTL", 600))
+SUBSCRIPTION_NEGATIVE_TTL = float(os.environ.get("SUBSCRIPTION_NEGATIVE_TTL", 15))
+SUBSCRIPTION_CACHE_SIZE = int(os.environ.get("SUBSCRIPTION_CACHE_SIZE", 50000))
+SUBSCRIPTION_CHECK_WORKERS = int(os.environ.get("SUBSCRIPTION_CHECK_WORKERS", 4))
+
+# Потоки, отправляющие кадры анимаций сундуков и слотов
+ANIMATION_WORKERS = int(os.environ.get("ANIMATION_WORKERS", 4))
+
+# Режим показа игр: "edit" - анимация правками сообщения, "native" - анимированный
+# send_dice Telegram (1 вызов API на бросок + 1 на результат)
+SLOT_ANIMATION_MODE = os.environ.get("SLOT_ANIMATION_MODE", "edit")
+DICE_ANIMATION_MODE = os.environ.get("DICE_ANIMATION_MODE", "edit")
+# Сколько ждать окончания нативной анимации перед показом результата (сек)
+NATIVE_SLOT_RESULT_DELAY = float(os.environ.get("NATIVE_SLOT_RESULT_DELAY", 2.0))
+NATIVE_DICE_RESULT_DELAY = float(os.environ.get("NATIVE_DICE_RESULT_DELAY", 3.5))
+
+# Лимиты очереди исходящих запросов к Bot API
+OUTBOUND_GLOBAL_RATE = float(os.environ.get("OUTBOUND_GLOBAL_RATE", 30))  # сообщений в секунду на бота
+OUTBOUND_PRIVATE_RATE = float(os.environ.get("OUTBOUND_PRIVATE_RATE", 1))  # в секунду на личный чат
+OUTBOUND_GROUP_RATE_PER_MIN = float(os.environ.get("OUTBOUND_GROUP_RATE_PER_MIN", 20))  # в минуту на группу
+OUTBOUND_CHAT_BURST = int(os.environ.get("OUTBOUND_CHAT_BURST", 3))
+OUTBOUND_WORKERS = int(os.environ.get("OUTBOUND_WORKERS", 8))
+
+# Рассылки: сколько получателей читать из БД за раз и как часто обновлять прогресс (сек)
+BROADCAST_CHUNK_SIZE = int(os.environ.get("BROADCAST_CHUNK_SIZE", 200))
+BROADCAST_PROGRESS_INTERVAL = float(os.environ.get("BROADCAST_PROGRESS_INTERVAL", 5))
+
+# Как часто обновлять закэшированные данные бота из get_me() (сек)
+BOT_INFO_REFRESH_INTERVAL = int(os.environ.get("BOT_INFO_REFRESH_INTERVAL", 3600))
+
+# Получение обновлений: "polling" (long polling) или "webhook" (встроенный HTTP-сервер)
+UPDATE_MODE = os.environ.get("UPDATE_MODE", "polling")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL", "")  # публичный адрес вебхука, например https://bot.example.com/webhook
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", os.environ.get("PORT", 8080)))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/webhook")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET", "")  # обязателен в режиме webhook (1-256 символов A-Z, a-z, 0-9, _ и -)
+WEBHOOK_MAX_CONNECTIONS = int(os.environ.get("WEBHOOK_MAX_CONNECTIONS", 40))
+
+# Потоки для хендлеров (апдейты одного пользователя все равно идут по очереди)
+HANDLER_WORKERS = int(os.environ.get("HANDLER_WORKERS", 16))
 
 # -------------------------
 # Функции для работы бота
@@ -1,11 +1,63 @@
 import sqlite3
 import time
 import json
+import threading
+from datetime import datetime
+from collections import OrderedDict
 from contextlib import contextmanager
 from utils import logger
-
-conn = sqlite3.connect("casino.db", check_same_thread=False, isolation_level=None)
-cursor = conn.cursor()
+from leaderboard import LeaderboardRegistry
+from config import (DB_PATH, DB_JOURNAL_MODE, DB_SYNCHRONOUS, DB_CACHE_SIZE,
+                    DB_MMAP_SIZE, DB_TEMP_STORE, DB_BUSY_TIMEOUT,
+                    COUNTER_FLUSH_INTERVAL_MS, COUNTER_FLUSH_MAX_ENTRIES,
+                    USER_CACHE_ENABLED, USER_CACHE_SIZE, USER_CACHE_TTL,
+                    PAYMENT_INVOICE_TTL)
+
+# Каждый поток получает собственное соединение и курсор: хендлеры telebot
+# больше не делят один курсор и не перетирают друг другу результаты fetchone()
+_local = threading.local()
+
+def _apply_storage_profile(connection):
+    """Применить настройки производительности SQLite к новому соединению"""
+    connection.execute(f"PRAGMA journal_mode={DB_JOURNAL_MODE}")
+    connection.execute(f"PRAGMA synchronous={DB_SYNCHRONOUS}")
+    connection.execute(f"PRAGMA cache_size={int(DB_CACHE_SIZE)}")
+    connection.execute(f"PRAGMA mmap_size={int(DB_MMAP_SIZE)}")
+    connection.execute(f"PRAGMA temp_store={DB_TEMP_STORE}")
+
+def get_connection():
+    """Соединение текущего потока (создается при первом обращении)"""
+    connection = getattr(_local, "conn", None)
+    if connection is None:
+        connection = sqlite3.connect(DB_PATH, timeout=DB_BUSY_TIMEOUT, isolation_level=None)
+        _apply_storage_profile(connection)
+        _local.conn = connection
+        _local.cursor = connection.cursor()
+    return connection
+
+def get_cursor():
+    """Курсор текущего потока"""
+    get_connection()
+    return _local.cursor
+
+def close_connection():
+    """Закрыть соединение текущего потока"""
+    connection = getattr(_local, "conn", None)
+    if connection is not None:
+        connection.close()
+        _local.conn = None
+        _local.cursor = None
+
+class _ThreadLocalProxy:
+    """Прокси, перенаправляющий обращения к объекту текущего потока"""
+    def __init__(self, factory):
+        self._factory = factory
+
+    def __getattr__(self, name):
+        return getattr(self._factory(), name)
+
+conn = _ThreadLocalProxy(get_connection)
+cursor = _ThreadLocalProxy(get_cursor)
 
 # Создаем все таблицы
 cursor.executescript("""
@@ -213,19 +265,342 @@ conn.commit()
 
 @contextmanager
 def transaction():
+    """Транзакция BEGIN IMMEDIATE...COMMIT; вложенные вызовы входят во внешнюю"""
+    connection = get_connection()
+    depth = getattr(_local, "tx_depth", 0)
+    if depth == 0:
+        connection.execute("BEGIN IMMEDIATE")
+        _local.after_commit = []
+    _local.tx_depth = depth + 1
     try:
         yield
-        conn.commit()
+        if depth == 0:
+            connection.execute("COMMIT")
     except Exception as e:
-        conn.rollback()
-        logger.error(f"Transaction failed: {e}")
+        if depth == 0:
+            connection.execute("ROLLBACK")
+            callbacks, _local.after_commit = _local.after_commit, []
+            for _, on_rollback in callbacks:
+                if on_rollback:
+                    on_rollback()
+            logger.error(f"Transaction failed: {e}")
         raise
+    finally:
+        _local.tx_depth = depth
+    if depth == 0:
+        callbacks, _local.after_commit = _local.after_commit, []
+        for callback, _ in callbacks:
+            callback()
+
+def after_commit(callback, on_rollback=None):
+    """Выполнить callback после фиксации текущей транзакции (или сразу вне ее)"""
+    if getattr(_local, "tx_depth", 0):
+        _local.after_commit.append((callback, on_rollback))
+    else:
+        callback()
+
+class UserCache:
+    """LRU/TTL-кэш строк users по user_id.
+
+    Хранит строку в том виде, в каком она лежит в БД (без отложенных
+    счетчиков CounterBuffer). Пишущие функции помечают пользователя внутри
+    своей транзакции (begin_write), а после COMMIT патчат или удаляют запись
+    (end_write). Пока запись пользователя не завершена, а также если между
+    чтением из БД и сохранением кто-то писал, прочитанная строка в кэш не
+    попадает - так устаревшая строка не может перезаписать свежую.
+    """
+
+    COLUMNS = {"balance": 2, "free_cases": 3, "refs": 5, "wins": 8, "losses": 9}
+
+    def __init__(self, max_size, ttl, enabled=True):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._rows = OrderedDict()
+        self._writers = {}
+        self._generation = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, uid, load):
+        """Строка пользователя из кэша или через load(uid) с сохранением"""
+        if not self.enabled:
+            return load(uid)
+        now = time.time()
+        with self._lock:
+            cached = self._rows.get(uid)
+            if cached and cached[1] > now:
+                self._rows.move_to_end(uid)
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+            generation = self._generation
+        row = load(uid)
+        if row is not None:
+            with self._lock:
+                if generation == self._generation and uid not in self._writers:
+                    self._rows[uid] = (row, now + self.ttl)
+                    self._rows.move_to_end(uid)
+                    if len(self._rows) > self.max_size:
+                        self._rows.popitem(last=False)
+        return row
+
+    def begin_write(self, uid):
+        with self._lock:
+            self._writers[uid] = self._writers.get(uid, 0) + 1
+            self._generation += 1
+
+    def end_write(self, uid, deltas=None):
+        """Завершить запись: применить дельты к строке в кэше или удалить ее"""
+        with self._lock:
+            cached = self._rows.get(uid)
+            if cached and deltas:
+                row = list(cached[0])
+                for column, delta in deltas.items():
+                    row[self.COLUMNS[column]] += delta
+                self._rows[uid] = (tuple(row), cached[1])
+            else:
+                self._rows.pop(uid, None)
+            if self._writers.get(uid, 0) > 1:
+                self._writers[uid] -= 1
+            else:
+                self._writers.pop(uid, None)
+            self._generation += 1
+
+    def invalidate(self, *uids):
+        with self._lock:
+            for uid in uids:
+                self._rows.pop(uid, None)
+            self._generation += 1
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+            self._generation += 1
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "enabled": self.enabled,
+                "size": len(self._rows),
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": self.hits / total if total else 0.0,
+            }
+
+user_cache = UserCache(USER_CACHE_SIZE, USER_CACHE_TTL, USER_CACHE_ENABLED)
+
+def _user_changed(uid, **deltas):
+    """Отметить изменение строки users в текущей транзакции (для кэша).
+
+    Вызывается внутри transaction(); после COMMIT строка в кэше патчится
+    дельтами, без дельт - удаляется.
+    """
+    user_cache.begin_write(uid)
+    after_commit(lambda: user_cache.end_write(uid, deltas), lambda: user_cache.end_write(uid))
+
+class CounterBuffer:
+    """Отложенная запись горячих счетчиков.
+
+    Дельты побед/поражений, открытых сундуков, прогресса заданий и активности
+    копятся в памяти по пользователям и пишутся одной транзакцией через
+    executemany - раз в interval_ms или при накоплении max_entries записей.
+    Чтения (get_user, get_weekly_quests, get_user_activity) накладывают
+    ожидающие дельты поверх строки из БД.
+    """
+
+    USER_COLUMNS = {"opened_cases": 7, "wins": 8, "losses": 9, "total_wagered": 12}
+
+    def __init__(self, interval_ms, max_entries):
+        self.interval = interval_ms / 1000
+        self.max_entries = max_entries
+        self._lock = threading.RLock()
+        self._users = {}
+        self._quests = {}
+        self._activity = {}
+        self._entries = 0
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def has_pending(self, uid):
+        return uid in self._users or uid in self._quests or uid in self._activity
+
+    def add_user(self, uid, **deltas):
+        with self._lock:
+            pending = self._users.setdefault(uid, dict.fromkeys(self.USER_COLUMNS, 0))
+            for column, delta in deltas.items():
+                pending[column] += delta
+            self._entries += 1
+        self._after_add()
+
+    def add_quest(self, uid, quest_id, week_number, amount):
+        with self._lock:
+            pending = self._quests.setdefault(uid, {})
+            key = (quest_id, week_number)
+            pending[key] = pending.get(key, 0) + amount
+            self._entries += 1
+        self._after_add()
+
+    def touch_activity(self, uid, now):
+        with self._lock:
+            last_active, logins = self._activity.get(uid, (0, 0))
+            self._activity[uid] = (max(last_active, now), logins + 1)
+            self._entries += 1
+        self._after_add()
+
+    def _after_add(self):
+        # Без фонового потока (скрипты, админ-утилиты) пишем сразу
+        if not self.running:
+            self.flush()
+        elif self._entries >= self.max_entries:
+            self._wakeup.set()
+
+    @contextmanager
+    def reading(self, uid):
+        """Блокировка на время чтения строки и наложения дельт.
+
+        Без нее flush может закоммитить дельты после проверки has_pending, но до
+        очистки буфера, и чтение наложит их на уже обновленную строку второй раз.
+        flush берет блокировку SQLite до этой, поэтому под ней не ждут БД.
+        """
+        with self._lock:
+            yield
+
+    def apply_user(self, row):
+        if not row or row[0] not in self._users:
+            return row
+        row = list(row)
+        for column, delta in self._users[row[0]].items():
+            row[self.USER_COLUMNS[column]] += delta
+        return tuple(row)
+
+    def apply_quests(self, uid, week_number, rows):
+        pending = self._quests.get(uid)
+        if not pending:
+            return rows
+        return [
+            (quest_id, progress + pending.get((quest_id, week_number), 0)) + tuple(rest)
+            for quest_id, progress, *rest in rows
+        ]
+
+    def apply_activity(self, uid, row):
+        pending = self._activity.get(uid)
+        if not pending:
+            return row
+        last_active, logins = pending
+        if not row:
+            return (uid, last_active, logins, 0, 0)
+        return (uid, max(row[1] or 0, last_active), (row[2] or 0) + logins) + tuple(row[3:])
+
+    def flush(self):
+        """Записать все накопленные дельты одной транзакцией"""
+        if not self._entries:
+            return 0
+        connection = get_connection()
+        own_transaction = getattr(_local, "tx_depth", 0) == 0
+        # Блокировку записи SQLite берем до своей блокировки, чтобы не ждать БД под ней
+        if own_transaction:
+            connection.execute("BEGIN IMMEDIATE")
+        try:
+            with self._lock:
+                entries = self._entries
+                cursor.executemany("""
+                    UPDATE users
+                    SET opened_cases = opened_cases + ?, wins = wins + ?,
+                        losses = losses + ?, total_wagered = total_wagered + ?
+                    WHERE user_id = ?
+                """, [
+                    (d["opened_cases"], d["wins"], d["losses"], d["total_wagered"], uid)
+                    for uid, d in self._users.items()
+                ])
+                cursor.executemany("""
+                    UPDATE weekly_quests
+                    SET progress = progress + ?
+                    WHERE user_id=? AND quest_id=? AND week_number=?
+                """, [
+                    (amount, uid, quest_id, week_number)
+                    for uid, quests in self._quests.items()
+                    for (quest_id, week_number), amount in quests.items()
+                ])
+                cursor.executemany("""
+                    INSERT INTO user_activity (user_id, last_active, daily_login_count)
+                    VALUES (?, ?, ?)
+                    ON CONFLICT(user_id) DO UPDATE SET
+                        last_active = MAX(COALESCE(last_active, 0), excluded.last_active),
+                        daily_login_count = daily_login_count + excluded.daily_login_count
+                """, [
+                    (uid, last_active, logins)
+                    for uid, (last_active, logins) in self._activity.items()
+                ])
+                if own_transaction:
+                    connection.execute("COMMIT")
+                    user_cache.invalidate(*self._users)
+                else:
+                    flushed = list(self._users)
+                    after_commit(lambda: user_cache.invalidate(*flushed))
+                self._users, self._quests, self._activity = {}, {}, {}
+                self._entries = 0
+                return entries
+        except Exception as e:
+            if own_transaction:
+                connection.execute("ROLLBACK")
+            logger.error(f"Counter flush failed: {e}")
+            raise
+
+    def _run(self):
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception:
+                time.sleep(self.interval)
+
+    def start(self):
+        if self.running:
+            return
+        self._stopped.clear()
+        self._thread = threading.Thread(target=self._run, name="counter-flusher", daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        """Остановить фоновый поток и записать остаток"""
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.flush()
+
+counter_buffer = CounterBuffer(COUNTER_FLUSH_INTERVAL_MS, COUNTER_FLUSH_MAX_ENTRIES)
+leaderboards = LeaderboardRegistry()
+
+def start_counter_flusher():
+    counter_buffer.start()
+
+def flush_counters():
+    """Записать отложенные счетчики (вызывать перед остановкой/перезапуском)"""
+    return counter_buffer.flush()
 
 # Основные функции
 def get_user(uid):
+    with counter_buffer.reading(uid):
+        return counter_buffer.apply_user(user_cache.get(uid, _select_user))
+
+def _select_user(uid):
     cursor.execute("SELECT * FROM users WHERE user_id=?", (uid,))
     return cursor.fetchone()
 
+def get_user_cache_stats():
+    return user_cache.stats()
+
 def create_user(uid, username, referrer_id=0):
     with transaction():
         cursor.execute("SELECT 1 FROM users WHERE user_id=?", (uid,))
@@ -247,6 +622,7 @@ def create_user(uid, username, referrer_id=0):
         """, (uid, int(time.time())))
         
         init_weekly_quests(uid)
+        after_commit(lambda: leaderboards.register_user(uid, username))
         
         logger.info(f"Created user {uid} (@{username}), Referrer: {referrer_id}")
         return True
@@ -286,6 +662,7 @@ def add_referral(ref_uid):
             SET free_cases = free_cases + 1, refs = refs + 1 
             WHERE user_id = ?
         """, (ref_uid,))
+        _user_changed(ref_uid, free_cases=1, refs=1)
         
         week_number = get_current_week_number()
         cursor.execute("""
@@ -293,6 +670,7 @@ def add_referral(ref_uid):
             SET progress = progress + 1 
             WHERE user_id=? AND quest_id='invite_friends' AND week_number=?
         """, (ref_uid, week_number))
+        after_commit(lambda: leaderboards["refs"].add(ref_uid, 1))
         
         logger.info(f"Bonus given to referrer {ref_uid}: +1 free case, +1 ref")
         return True
@@ -300,6 +678,8 @@ def add_referral(ref_uid):
 def update_balance(uid, amount, reason=""):
     with transaction():
         cursor.execute("UPDATE users SET balance=balance+? WHERE user_id=?", (amount, uid))
+        _user_changed(uid, balance=amount)
+        after_commit(lambda: leaderboards["balance"].add(uid, amount))
         
         if reason:
             cursor.execute("""
@@ -317,6 +697,17 @@ def update_balance(uid, amount, reason=""):
         
         logger.info(f"Balance update: user {uid}, amount {amount}, reason: {reason}")
 
+def update_username(uid, username):
+    with transaction():
+        cursor.execute("UPDATE users SET username=? WHERE user_id=?", (username, uid))
+        _user_changed(uid)
+        after_commit(lambda: leaderboards.rename_user(uid, username))
+
+def set_referrer(uid, referrer_id):
+    with transaction():
+        cursor.execute("UPDATE users SET referrer_id=? WHERE user_id=?", (referrer_id, uid))
+        _user_changed(uid)
+
 def get_user_referrals(uid):
     """Получить список рефералов пользователя"""
     cursor.execute("SELECT user_id, username, created_at FROM users WHERE referrer_id=? ORDER BY created_at DESC", (uid,))
@@ -334,75 +725,145 @@ def get_referrer_info(uid):
 def use_free_case(uid):
     with transaction():
         cursor.execute("UPDATE users SET free_cases=free_cases-1 WHERE user_id=?", (uid,))
+        _user_changed(uid, free_cases=-1)
 
 def update_last_free(uid):
     with transaction():
         cursor.execute("UPDATE users SET last_free=? WHERE user_id=?", (int(time.time()), uid))
+        _user_changed(uid)
 
 def update_case_stats(uid, win, amount_won=0):
-    with transaction():
-        cursor.execute("""
-            UPDATE users 
-            SET opened_cases=opened_cases+1, 
-                wins=wins+?, 
-                losses=losses+?,
-                total_wagered=total_wagered+?
-            WHERE user_id=?
-        """, (1 if win else 0, 0 if win else 1, amount_won, uid))
-        
-        week_number = get_current_week_number()
-        cursor.execute("""
-            UPDATE weekly_quests 
-            SET progress = progress + 1 
-            WHERE user_id=? AND quest_id='open_cases' AND week_number=?
-        """, (uid, week_number))
+    counter_buffer.add_user(
+        uid,
+        opened_cases=1,
+        wins=1 if win else 0,
+        losses=0 if win else 1,
+        total_wagered=amount_won
+    )
+    counter_buffer.add_quest(uid, "open_cases", get_current_week_number(), 1)
+    if win:
+        leaderboards["wins"].add(uid, 1)
 
 def update_game_stats(uid, win):
+    counter_buffer.add_user(uid, wins=1 if win else 0, losses=0 if win else 1)
+    if win:
+        counter_buffer.add_quest(uid, "win_games", get_current_week_number(), 1)
+        leaderboards["wins"].add(uid, 1)
+
+def add_exp(uid, exp_amount):
     with transaction():
-        cursor.execute("""
-            UPDATE users 
-            SET wins=wins+?, 
-                losses=losses+?
-            WHERE user_id=?
-        """, (1 if win else 0, 0 if win else 1, uid))
-        
-        week_number = get_current_week_number()
-        if win:
+        return _apply_exp(uid, exp_amount)
+
+def _apply_exp(uid, exp_amount):
+    """Начислить опыт внутри текущей транзакции, повысить уровень при необходимости"""
+    cursor.execute("""
+        UPDATE user_levels
+        SET exp = exp + ?, total_exp = total_exp + ?
+        WHERE user_id=?
+        RETURNING level, exp
+    """, (exp_amount, exp_amount, uid))
+    level_data = cursor.fetchone()
+    after_commit(lambda: leaderboards["levels"].add(uid, 0, exp_amount))
+    if level_data:
+        current_level = level_data[0]
+        current_exp = level_data[1]
+        exp_needed = int(100 * (current_level ** 1.5))
+
+        if current_exp >= exp_needed:
+            new_level = current_level + 1
+            new_exp = current_exp - exp_needed
+
             cursor.execute("""
-                UPDATE weekly_quests 
-                SET progress = progress + 1 
-                WHERE user_id=? AND quest_id='win_games' AND week_number=?
-            """, (uid, week_number))
+                UPDATE user_levels
+                SET level = ?, exp = ?, last_level_up = ?
+                WHERE user_id=?
+            """, (new_level, new_exp, int(time.time()), uid))
+            after_commit(lambda: leaderboards["levels"].add(uid, 1, 0))
+
+            level_reward = new_level * 50
+            update_balance(uid, level_reward, f"level_up_{new_level}")
+            return new_level, level_reward
+    return None, 0
+
+def reserve_stake(uid, stake):
+    """Списать ставку до броска (нативный send_dice: результат виден сразу).
+
+    Возвращает False, если алмазов недостаточно. Зарезервированная ставка
+    рассчитывается settle_bet(..., reserved=True) или возвращается release_stake.
+    """
+    with transaction():
+        cursor.execute("UPDATE users SET balance = balance - ? WHERE user_id = ? AND balance >= ?", (stake, uid, stake))
+        if cursor.rowcount == 0:
+            return False
+        _user_changed(uid, balance=-stake)
+        after_commit(lambda: leaderboards["balance"].add(uid, -stake))
+        return True
+
+def release_stake(uid, stake):
+    """Вернуть зарезервированную ставку, если бросок не состоялся"""
+    with transaction():
+        cursor.execute("UPDATE users SET balance = balance + ? WHERE user_id = ?", (stake, uid))
+        _user_changed(uid, balance=stake)
+        after_commit(lambda: leaderboards["balance"].add(uid, stake))
+
+def settle_bet(uid, game, stake, payout, exp=0, quest_events=None, reserved=False):
+    """Рассчитать ставку одной транзакцией.
+
+    Списывает ставку и начисляет выигрыш условным UPDATE (balance >= stake),
+    обновляет победы/поражения, опыт и задания, пишет строку в transactions.
+    Если ставка уже списана reserve_stake (reserved=True), начисляется только
+    выигрыш. Возвращает новый баланс или None, если алмазов недостаточно.
+    """
+    net = payout - stake
+    # Изменение баланса в этой транзакции и сколько на нем должно быть до нее
+    credit, required = (payout, 0) if reserved else (net, stake)
+    if payout > stake:
+        outcome = "win"
+    elif payout == stake:
+        outcome = "draw"
+    else:
+        outcome = "loss"
 
-def add_exp(uid, exp_amount):
     with transaction():
         cursor.execute("""
-            UPDATE user_levels 
-            SET exp = exp + ?, total_exp = total_exp + ? 
-            WHERE user_id=?
-        """, (exp_amount, exp_amount, uid))
-        
-        cursor.execute("SELECT level, exp FROM user_levels WHERE user_id=?", (uid,))
-        level_data = cursor.fetchone()
-        if level_data:
-            current_level = level_data[0]
-            current_exp = level_data[1]
-            exp_needed = int(100 * (current_level ** 1.5))
-            
-            if current_exp >= exp_needed:
-                new_level = current_level + 1
-                new_exp = current_exp - exp_needed
-                
-                cursor.execute("""
-                    UPDATE user_levels 
-                    SET level = ?, exp = ?, last_level_up = ?
-                    WHERE user_id=?
-                """, (new_level, new_exp, int(time.time()), uid))
-                
-                level_reward = new_level * 50
-                update_balance(uid, level_reward, f"level_up_{new_level}")
-                return new_level, level_reward
-    return None, 0
+            UPDATE users
+            SET balance = balance + ?, wins = wins + ?, losses = losses + ?
+            WHERE user_id = ? AND balance >= ?
+            RETURNING balance
+        """, (credit, 1 if outcome == "win" else 0, 1 if outcome == "loss" else 0, uid, required))
+        row = cursor.fetchone()
+        if not row:
+            return None
+        new_balance = row[0]
+        _user_changed(uid, balance=credit, wins=1 if outcome == "win" else 0, losses=1 if outcome == "loss" else 0)
+        after_commit(lambda: leaderboards["balance"].add(uid, credit))
+        if outcome == "win":
+            after_commit(lambda: leaderboards["wins"].add(uid, 1))
+
+        cursor.execute("""
+            INSERT INTO transactions (user_id, type, amount, details, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (uid, f"{game}_{outcome}", net, json.dumps({"stake": stake, "payout": payout}), int(time.time())))
+
+        quest_updates = dict(quest_events or {})
+        if net < 0:
+            quest_updates["spend_stars"] = quest_updates.get("spend_stars", 0) + abs(net)
+        if outcome == "win":
+            quest_updates["win_games"] = quest_updates.get("win_games", 0) + 1
+        if quest_updates:
+            week_number = get_current_week_number()
+            cursor.executemany("""
+                UPDATE weekly_quests
+                SET progress = progress + ?
+                WHERE user_id=? AND quest_id=? AND week_number=?
+            """, [(amount, uid, quest_id, week_number) for quest_id, amount in quest_updates.items()])
+
+        if exp:
+            new_level, level_reward = _apply_exp(uid, exp)
+            new_balance += level_reward
+
+        logger.info(f"Bet settled: user {uid}, game {game}, stake {stake}, payout {payout}")
+        return new_balance
 
 def get_user_level(uid):
     cursor.execute("""
@@ -415,6 +876,10 @@ def get_user_level(uid):
 
 def get_weekly_quests(uid):
     week_number = get_current_week_number()
+    with counter_buffer.reading(uid):
+        return counter_buffer.apply_quests(uid, week_number, _select_weekly_quests(uid, week_number))
+
+def _select_weekly_quests(uid, week_number):
     cursor.execute("""
         SELECT quest_id, progress, completed, claimed,
                CASE quest_id
@@ -433,13 +898,7 @@ def get_weekly_quests(uid):
     return cursor.fetchall()
 
 def update_quest_progress(uid, quest_id, amount=1):
-    week_number = get_current_week_number()
-    with transaction():
-        cursor.execute("""
-            UPDATE weekly_quests 
-            SET progress = progress + ?
-            WHERE user_id=? AND quest_id=? AND week_number=?
-        """, (amount, uid, quest_id, week_number))
+    counter_buffer.add_quest(uid, quest_id, get_current_week_number(), amount)
 
 def complete_quest(uid, quest_id):
     week_number = get_current_week_number()
@@ -459,41 +918,73 @@ def claim_quest_reward(uid, quest_id):
             WHERE user_id=? AND quest_id=? AND week_number=?
         """, (uid, quest_id, week_number))
 
-def buy_lottery_ticket(uid, draw_date):
+# Билеты хранятся диапазонами: строка (user_id, ticket_number, ticket_count)
+# означает номера ticket_number .. ticket_number + ticket_count - 1. Номера
+# выдает счетчик розыгрыша в lottery_draws (lottery_id=0 - еженедельный
+# розыгрыш по draw_date, иначе пользовательский с draw_date=''), там же
+# хранится число участников, поэтому статистика и джекпот не читают билеты
+def _allocate_tickets(lottery_id, draw_date, count, new_player):
+    """Выделить count номеров подряд из счетчика розыгрыша; возвращает первый номер"""
+    cursor.execute("""
+        INSERT INTO lottery_draws (lottery_id, draw_date, tickets, players)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT(lottery_id, draw_date) DO UPDATE
+        SET tickets = tickets + excluded.tickets, players = players + excluded.players
+        RETURNING tickets
+    """, (lottery_id, draw_date, count, 1 if new_player else 0))
+    return cursor.fetchone()[0] - count + 1
+
+def _charge_for_tickets(uid, amount, reason):
+    """Списать стоимость билетов внутри транзакции, если алмазов хватает"""
+    cursor.execute("SELECT balance FROM users WHERE user_id=?", (uid,))
+    row = cursor.fetchone()
+    if not row or row[0] < amount:
+        return False
+    update_balance(uid, -amount, reason)
+    return True
+
+def buy_lottery_tickets(uid, draw_date, count=1, price=0):
+    """Купить count билетов одной транзакцией: списание и один диапазон номеров.
+
+    Возвращает (первый, последний номер) или None, если алмазов недостаточно.
+    """
     with transaction():
-        cursor.execute("SELECT COUNT(*) FROM lottery_tickets WHERE draw_date=?", (draw_date,))
-        count = cursor.fetchone()[0]
-        ticket_number = count + 1
-        
+        if price and not _charge_for_tickets(uid, price * count, "lottery_ticket"):
+            return None
+        cursor.execute("SELECT 1 FROM lottery_tickets WHERE user_id=? AND draw_date=? LIMIT 1", (uid, draw_date))
+        first = _allocate_tickets(0, draw_date, count, cursor.fetchone() is None)
         cursor.execute("""
-            INSERT INTO lottery_tickets (user_id, ticket_number, draw_date, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (uid, ticket_number, draw_date, int(time.time())))
-        return ticket_number
+            INSERT INTO lottery_tickets (user_id, ticket_number, ticket_count, draw_date, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (uid, first, count, draw_date, int(time.time())))
+        return first, first + count - 1
 
 def get_user_tickets(uid, draw_date):
+    """Билеты пользователя диапазонами: [(первый, последний номер)]"""
     cursor.execute("""
-        SELECT ticket_number FROM lottery_tickets 
+        SELECT ticket_number, ticket_number + ticket_count - 1 FROM lottery_tickets
         WHERE user_id=? AND draw_date=?
         ORDER BY ticket_number
     """, (uid, draw_date))
-    return [row[0] for row in cursor.fetchall()]
+    return cursor.fetchall()
+
+def get_user_ticket_count(uid, draw_date):
+    cursor.execute("SELECT SUM(ticket_count) FROM lottery_tickets WHERE user_id=? AND draw_date=?", (uid, draw_date))
+    return cursor.fetchone()[0] or 0
 
 def get_all_tickets(draw_date):
+    """Все диапазоны билетов розыгрыша: [(user_id, первый номер, количество)]"""
     cursor.execute("""
-        SELECT user_id, ticket_number FROM lottery_tickets 
+        SELECT user_id, ticket_number, ticket_count FROM lottery_tickets
         WHERE draw_date=?
         ORDER BY ticket_number
     """, (draw_date,))
     return cursor.fetchall()
 
 def get_lottery_stats(draw_date):
-    cursor.execute("""
-        SELECT COUNT(DISTINCT user_id), COUNT(*) 
-        FROM lottery_tickets 
-        WHERE draw_date=?
-    """, (draw_date,))
-    return cursor.fetchone()
+    """(участников, билетов) еженедельного розыгрыша"""
+    cursor.execute("SELECT players, tickets FROM lottery_draws WHERE lottery_id=0 AND draw_date=?", (draw_date,))
+    return cursor.fetchone() or (0, 0)
 
 def add_lottery_winner(draw_date, winner_id, winner_username, prize, ticket_count):
     with transaction():
@@ -502,6 +993,101 @@ def add_lottery_winner(draw_date, winner_id, winner_username, prize, ticket_coun
             VALUES (?, ?, ?, ?, ?, ?)
         """, (draw_date, winner_id, winner_username, prize, ticket_count, int(time.time())))
 
+# Розыгрыши. Номера билетов внутри розыгрыша идут подряд с 1, число билетов
+# берется из счетчика, а победитель находится одним поиском диапазона по индексу
+def get_lottery_ticket_count(draw_date):
+    return get_lottery_stats(draw_date)[1]
+
+def get_due_lottery_draws(today):
+    """Даты еженедельных розыгрышей, которые пора провести, включая пропущенные.
+
+    Розыгрыши проводятся по порядку дат, поэтому счетчики читаются только
+    после последнего проведенного.
+    """
+    cursor.execute("SELECT MAX(draw_date) FROM lottery_history WHERE lottery_id=0")
+    last_drawn = cursor.fetchone()[0] or ""
+    cursor.execute("""
+        SELECT draw_date FROM lottery_draws
+        WHERE lottery_id=0 AND draw_date > ? AND draw_date <= ? AND tickets > 0
+        ORDER BY draw_date
+    """, (last_drawn, today))
+    return [row[0] for row in cursor.fetchall()]
+
+def _find_ticket_owner(table, key_column, key, number):
+    """Владелец билета number: (user_id, number) или None, если номер не выдан"""
+    cursor.execute(f"""
+        SELECT user_id, ticket_number, ticket_count FROM {table}
+        WHERE {key_column}=? AND ticket_number <= ?
+        ORDER BY ticket_number DESC
+        LIMIT 1
+    """, (key, number))
+    row = cursor.fetchone()
+    if not row or number >= row[1] + row[2]:
+        return None
+    return row[0], number
+
+def _pay_lottery_winner(draw_date, lottery_id, user_id, prize, ticket_count):
+    cursor.execute("SELECT username FROM users WHERE user_id=?", (user_id,))
+    row = cursor.fetchone()
+    username = row[0] if row else None
+    update_balance(user_id, prize, f"lottery_win_{lottery_id or draw_date}")
+    cursor.execute("""
+        INSERT INTO lottery_history (draw_date, winner_id, winner_username, prize, ticket_count, created_at, lottery_id)
+        VALUES (?, ?, ?, ?, ?, ?, ?)
+    """, (draw_date, user_id, username, prize, ticket_count, int(time.time()), lottery_id))
+    return username
+
+def settle_lottery_draw(draw_date, winning_number, prize):
+    """Провести еженедельный розыгрыш: выплата и запись в историю одной транзакцией.
+
+    Возвращает (winner_id, username, ticket_number) или None, если розыгрыш
+    уже проведен или билетов нет.
+    """
+    with transaction():
+        cursor.execute("SELECT 1 FROM lottery_history WHERE lottery_id=0 AND draw_date=?", (draw_date,))
+        if cursor.fetchone():
+            return None
+        ticket = _find_ticket_owner("lottery_tickets", "draw_date", draw_date, winning_number)
+        if not ticket:
+            return None
+        user_id, ticket_number = ticket
+        username = _pay_lottery_winner(draw_date, 0, user_id, prize, get_lottery_ticket_count(draw_date))
+        return user_id, username, ticket_number
+
+def get_custom_lottery_ticket_count(lottery_id):
+    cursor.execute("SELECT tickets FROM lottery_draws WHERE lottery_id=? AND draw_date=''", (lottery_id,))
+    row = cursor.fetchone()
+    return row[0] if row else 0
+
+def get_due_custom_lotteries(today):
+    """Активные пользовательские розыгрыши, дата окончания которых наступила: [(id, name, prize)]"""
+    cursor.execute("""
+        SELECT id, name, prize_amount FROM active_lotteries
+        WHERE is_active=1 AND end_date <= ?
+        ORDER BY end_date, id
+    """, (today,))
+    return cursor.fetchall()
+
+def settle_custom_lottery(lottery_id, winning_number):
+    """Провести пользовательский розыгрыш и закрыть его одной транзакцией.
+
+    Возвращает (winner_id, username, ticket_number, prize) или None, если
+    розыгрыш уже закрыт или на него не купили ни одного билета.
+    """
+    with transaction():
+        cursor.execute("SELECT end_date, prize_amount FROM active_lotteries WHERE id=? AND is_active=1", (lottery_id,))
+        lottery = cursor.fetchone()
+        if not lottery:
+            return None
+        end_date, prize = lottery
+        cursor.execute("UPDATE active_lotteries SET is_active=0 WHERE id=?", (lottery_id,))
+        ticket = _find_ticket_owner("custom_lottery_tickets", "lottery_id", lottery_id, winning_number)
+        if not ticket:
+            return None
+        user_id, ticket_number = ticket
+        username = _pay_lottery_winner(end_date, lottery_id, user_id, prize, get_custom_lottery_ticket_count(lottery_id))
+        return user_id, username, ticket_number, prize
+
 def get_lottery_history(limit=10):
     cursor.execute("""
         SELECT draw_date, winner_username, prize, ticket_count, created_at
@@ -512,16 +1098,12 @@ def get_lottery_history(limit=10):
     return cursor.fetchall()
 
 def update_user_activity(uid):
-    now = int(time.time())
-    with transaction():
-        cursor.execute("""
-            INSERT OR REPLACE INTO user_activity (user_id, last_active, daily_login_count)
-            VALUES (?, ?, COALESCE((SELECT daily_login_count FROM user_activity WHERE user_id=?) + 1, 1))
-        """, (uid, now, uid))
+    counter_buffer.touch_activity(uid, int(time.time()))
 
 def get_user_activity(uid):
-    cursor.execute("SELECT * FROM user_activity WHERE user_id=?", (uid,))
-    return cursor.fetchone()
+    with counter_buffer.reading(uid):
+        cursor.execute("SELECT * FROM user_activity WHERE user_id=?", (uid,))
+        return counter_buffer.apply_activity(uid, cursor.fetchone())
 
 def claim_streak_bonus(uid, bonus_amount):
     with transaction():
@@ -555,6 +1137,7 @@ def update_daily_streak(uid, streak):
             SET daily_streak=?, last_daily=?, free_cases=free_cases+1 
             WHERE user_id=?
         """, (streak, int(time.time()), uid))
+        _user_changed(uid)
         
         week_number = get_current_week_number()
         cursor.execute("""
@@ -568,7 +1151,7 @@ def get_top_balance(limit=10):
         SELECT username, balance 
         FROM users 
         WHERE username IS NOT NULL 
-        ORDER BY balance DESC 
+        ORDER BY balance DESC, user_id
         LIMIT ?
     """, (limit,))
     return cursor.fetchall()
@@ -578,7 +1161,7 @@ def get_top_refs(limit=10):
         SELECT username, refs 
         FROM users 
         WHERE username IS NOT NULL 
-        ORDER BY refs DESC 
+        ORDER BY refs DESC, user_id
         LIMIT ?
     """, (limit,))
     return cursor.fetchall()
@@ -588,7 +1171,7 @@ def get_top_players(limit=10):
         SELECT username, wins 
         FROM users 
         WHERE username IS NOT NULL 
-        ORDER BY wins DESC 
+        ORDER BY wins DESC, user_id
         LIMIT ?
     """, (limit,))
     return cursor.fetchall()
@@ -599,15 +1182,138 @@ def get_top_levels(limit=10):
         FROM user_levels ul
         JOIN users u ON u.user_id = ul.user_id
         WHERE u.username IS NOT NULL 
-        ORDER BY ul.level DESC, ul.total_exp DESC
+        ORDER BY ul.level DESC, ul.total_exp DESC, u.user_id
         LIMIT ?
     """, (limit,))
     return cursor.fetchall()
 
+def rebuild_leaderboards():
+    """Полностью пересобрать лидерборды из базы"""
+    cursor.execute("SELECT user_id, username, balance, refs, wins FROM users")
+    users = cursor.fetchall()
+    leaderboards["balance"].load((uid, name, (balance,)) for uid, name, balance, _, _ in users)
+    leaderboards["refs"].load((uid, name, (refs,)) for uid, name, _, refs, _ in users)
+    leaderboards["wins"].load((uid, name, (wins,)) for uid, name, _, _, wins in users)
+    cursor.execute("""
+        SELECT u.user_id, u.username, ul.level, ul.total_exp
+        FROM users u
+        JOIN user_levels ul ON ul.user_id = u.user_id
+    """)
+    leaderboards["levels"].load((uid, name, (level, total_exp)) for uid, name, level, total_exp in cursor.fetchall())
+    logger.info(f"Leaderboards rebuilt from {len(users)} users")
+
+def check_leaderboards(limit=10):
+    """Сверить лидерборды с SQL-запросами; возвращает список расхождений.
+
+    Равные значения оба упорядочивают по user_id (в RankIndex ключ - (значение, uid)),
+    поэтому списки сравниваются целиком, вместе с именами.
+    """
+    flush_counters()
+    queries = {
+        "balance": get_top_balance,
+        "refs": get_top_refs,
+        "wins": get_top_players,
+        "levels": get_top_levels,
+    }
+    mismatches = []
+    for metric, query in queries.items():
+        expected = [tuple(row[1:]) for row in query(limit)]
+        actual = [row[1:] for row in leaderboards.top(metric, limit)]
+        if expected != actual:
+            mismatches.append((metric, expected, actual))
+            logger.warning(f"Leaderboard {metric} is stale: {actual} != {expected}")
+    return mismatches
+
 def get_all_users():
     cursor.execute("SELECT user_id, username, balance FROM users")
     return cursor.fetchall()
 
+# Рассылки: получатели читаются порциями по курсору user_id, прогресс
+# сохраняется после каждой порции, чтобы рассылку можно было продолжить
+def create_broadcast(admin_id, text, status_chat_id, status_message_id):
+    with transaction():
+        cursor.execute("""
+            SELECT COUNT(*) FROM users
+            WHERE user_id NOT IN (SELECT user_id FROM bot_blocked)
+        """)
+        total = cursor.fetchone()[0]
+        cursor.execute("""
+            INSERT INTO broadcasts (admin_id, text, total, status_chat_id, status_message_id, created_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (admin_id, text, total, status_chat_id, status_message_id, int(time.time())))
+        return cursor.lastrowid
+
+def get_broadcast(broadcast_id):
+    cursor.execute("""
+        SELECT id, admin_id, text, status, cursor_user_id, total, sent, failed, blocked,
+               status_chat_id, status_message_id
+        FROM broadcasts WHERE id=?
+    """, (broadcast_id,))
+    return cursor.fetchone()
+
+def get_running_broadcasts():
+    cursor.execute("SELECT id FROM broadcasts WHERE status='running' ORDER BY id")
+    return [row[0] for row in cursor.fetchall()]
+
+def get_broadcast_recipients(after_user_id, limit):
+    """Следующая порция получателей после after_user_id (keyset-пагинация по PK)"""
+    cursor.execute("""
+        SELECT user_id FROM users
+        WHERE user_id > ? AND user_id NOT IN (SELECT user_id FROM bot_blocked)
+        ORDER BY user_id
+        LIMIT ?
+    """, (after_user_id, limit))
+    return [row[0] for row in cursor.fetchall()]
+
+def save_broadcast_progress(broadcast_id, cursor_user_id, sent, failed, blocked_ids):
+    """Сдвинуть курсор рассылки, прибавить счетчики и отметить заблокировавших бота"""
+    now = int(time.time())
+    with transaction():
+        cursor.executemany(
+            "INSERT OR IGNORE INTO bot_blocked (user_id, blocked_at) VALUES (?, ?)",
+            [(user_id, now) for user_id in blocked_ids]
+        )
+        after_commit(lambda: _bot_blocked_ids.update(blocked_ids))
+        cursor.execute("""
+            UPDATE broadcasts
+            SET cursor_user_id = ?, sent = sent + ?, failed = failed + ?, blocked = blocked + ?
+            WHERE id=?
+        """, (cursor_user_id, sent, failed, len(blocked_ids), broadcast_id))
+
+def finish_broadcast(broadcast_id, status='done'):
+    with transaction():
+        cursor.execute("""
+            UPDATE broadcasts SET status = ?, finished_at = ?
+            WHERE id=? AND status='running'
+        """, (status, int(time.time()), broadcast_id))
+        return cursor.rowcount > 0
+
+def clear_bot_blocked(user_id):
+    """Пользователь снова пишет боту - возвращаем его в рассылки"""
+    # Вызывается на каждый /start: транзакция только если пользователь правда в списке
+    if user_id not in _bot_blocked_ids:
+        return False
+    with transaction():
+        cursor.execute("DELETE FROM bot_blocked WHERE user_id=?", (user_id,))
+        after_commit(lambda: _bot_blocked_ids.discard(user_id))
+        return True
+
+def get_media_file_ids():
+    """Сохраненные file_id картинок: {имя: (sha256, file_id)}"""
+    cursor.execute("SELECT name, content_hash, file_id FROM media_cache")
+    return {name: (content_hash, file_id) for name, content_hash, file_id in cursor.fetchall()}
+
+def save_media_file_id(name, content_hash, file_id):
+    with transaction():
+        cursor.execute("""
+            INSERT OR REPLACE INTO media_cache (name, content_hash, file_id, updated_at)
+            VALUES (?, ?, ?, ?)
+        """, (name, content_hash, file_id, int(time.time())))
+
+def delete_media_file_id(name):
+    with transaction():
+        cursor.execute("DELETE FROM media_cache WHERE name=?", (name,))
+
 def get_bot_stats():
     cursor.execute("""
         SELECT 
@@ -621,17 +1327,30 @@ def get_bot_stats():
     """)
     return cursor.fetchone()
 
+# Версия списка спонсоров: растет при каждом изменении, по ней кэши
+# (список каналов, результаты проверки подписки) понимают, что устарели
+_sponsors_version = 0
+
+def _bump_sponsors_version():
+    global _sponsors_version
+    _sponsors_version += 1
+
+def get_sponsors_version():
+    return _sponsors_version
+
 def add_sponsor_channel(channel_username, channel_name, added_by):
     with transaction():
         cursor.execute("""
             INSERT OR REPLACE INTO sponsors (channel_username, channel_name, added_by, added_at)
             VALUES (?, ?, ?, ?)
         """, (channel_username, channel_name, added_by, int(time.time())))
+        after_commit(_bump_sponsors_version)
         return True
 
 def remove_sponsor_channel(channel_username):
     with transaction():
         cursor.execute("DELETE FROM sponsors WHERE channel_username=?", (channel_username,))
+        after_commit(_bump_sponsors_version)
         return cursor.rowcount > 0
 
 def get_sponsor_channels():
@@ -695,33 +1414,39 @@ def create_custom_lottery(name, prize_amount, ticket_price, end_date, created_by
         """, (name, prize_amount, ticket_price, end_date, created_by, int(time.time())))
         return cursor.lastrowid
 
-def buy_custom_lottery_ticket(lottery_id, user_id):
+def buy_custom_lottery_ticket(lottery_id, user_id, count=1):
+    """Купить count билетов пользовательского розыгрыша: (True, (первый, последний)) или (False, причина)"""
     with transaction():
-        cursor.execute("SELECT is_active FROM active_lotteries WHERE id=?", (lottery_id,))
+        cursor.execute("SELECT is_active, ticket_price FROM active_lotteries WHERE id=?", (lottery_id,))
         lottery = cursor.fetchone()
         if not lottery or lottery[0] == 0:
             return False, "Лотерея не активна"
         
-        cursor.execute("SELECT COUNT(*) FROM custom_lottery_tickets WHERE lottery_id=?", (lottery_id,))
-        count = cursor.fetchone()[0]
-        ticket_number = count + 1
+        if lottery[1] and not _charge_for_tickets(user_id, lottery[1] * count, f"custom_lottery_ticket_{lottery_id}"):
+            return False, "Недостаточно алмазов"
         
+        cursor.execute("SELECT 1 FROM custom_lottery_tickets WHERE user_id=? AND lottery_id=? LIMIT 1", (user_id, lottery_id))
+        first = _allocate_tickets(lottery_id, '', count, cursor.fetchone() is None)
         cursor.execute("""
-            INSERT INTO custom_lottery_tickets (lottery_id, user_id, ticket_number, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (lottery_id, user_id, ticket_number, int(time.time())))
-        return True, ticket_number
+            INSERT INTO custom_lottery_tickets (lottery_id, user_id, ticket_number, ticket_count, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (lottery_id, user_id, first, count, int(time.time())))
+        return True, (first, first + count - 1)
 
 def create_payment(user_id, amount, invoice_id):
+    now = int(time.time())
     with transaction():
         cursor.execute("""
-            INSERT INTO payments (user_id, amount, invoice_id, created_at)
-            VALUES (?, ?, ?, ?)
-        """, (user_id, amount, invoice_id, int(time.time())))
+            INSERT INTO payments (user_id, amount, invoice_id, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?)
+        """, (user_id, amount, invoice_id, now, now + PAYMENT_INVOICE_TTL))
         return True
 
 def get_payment_by_invoice(invoice_id):
-    cursor.execute("SELECT * FROM payments WHERE invoice_id=?", (invoice_id,))
+    cursor.execute("""
+        SELECT id, user_id, amount, invoice_id, status, created_at, completed_at
+        FROM payments WHERE invoice_id=?
+    """, (invoice_id,))
     return cursor.fetchone()
 
 def update_payment_status(invoice_id, status):
@@ -733,6 +1458,70 @@ def update_payment_status(invoice_id, status):
         """, (status, int(time.time()) if status == 'paid' else 0, invoice_id))
         return True
 
+def get_pending_payments():
+    """Живые неоплаченные счета (индекс idx_payments_live)"""
+    cursor.execute(
+        "SELECT invoice_id FROM payments WHERE status='pending' AND expires_at > ?",
+        (int(time.time()),)
+    )
+    return [row[0] for row in cursor.fetchall()]
+
+def get_due_payments(limit=1000):
+    """Неоплаченные счета, срок которых истек"""
+    cursor.execute("""
+        SELECT invoice_id FROM payments
+        WHERE status='pending' AND expires_at <= ?
+        ORDER BY expires_at
+        LIMIT ?
+    """, (int(time.time()), limit))
+    return [row[0] for row in cursor.fetchall()]
+
+def expire_payments(invoice_ids):
+    """Пометить счета просроченными (только те, что еще pending); возвращает количество"""
+    if not invoice_ids:
+        return 0
+    with transaction():
+        cursor.executemany(
+            "UPDATE payments SET status='expired' WHERE invoice_id=? AND status='pending'",
+            [(str(invoice_id),) for invoice_id in invoice_ids]
+        )
+        return cursor.rowcount
+
+def expire_stars_payments():
+    """Пометить просроченными неоплаченные счета Stars; возвращает количество"""
+    with transaction():
+        cursor.execute(
+            "UPDATE stars_payments SET status='expired' WHERE status='pending' AND expires_at <= ?",
+            (int(time.time()),)
+        )
+        return cursor.rowcount
+
+def credit_paid_payments(invoice_ids):
+    """Отметить оплаченные счета и начислить алмазы одной транзакцией.
+
+    Начисляются только счета, которые еще не оплачены (pending или
+    expired - деньги, пришедшие после срока, тоже зачисляются), поэтому
+    повторная проверка того же счета ничего не начислит. Возвращает
+    [(invoice_id, user_id, amount)] начисленных счетов.
+    """
+    credited = []
+    if not invoice_ids:
+        return credited
+    with transaction():
+        for invoice_id in invoice_ids:
+            cursor.execute(
+                "SELECT user_id, amount FROM payments WHERE invoice_id=? AND status IN ('pending', 'expired')",
+                (str(invoice_id),)
+            )
+            row = cursor.fetchone()
+            if not row:
+                continue
+            user_id, amount = row
+            update_payment_status(str(invoice_id), 'paid')
+            update_balance(user_id, amount, f"cryptobot_payment_{invoice_id}")
+            credited.append((invoice_id, user_id, amount))
+    return credited
+
 def get_user_payments(user_id, limit=10):
     cursor.execute("""
         SELECT amount, status, created_at 
@@ -743,17 +1532,36 @@ def get_user_payments(user_id, limit=10):
     """, (user_id, limit))
     return cursor.fetchall()
 
+# Белый список и баны держим в памяти: проверки доступа идут на каждое
+# сообщение и callback и не должны обращаться к БД. Так же - заблокировавшие
+# бота: clear_bot_blocked вызывается на каждый /start
+_whitelist_ids = set()
+_banned_ids = set()
+_bot_blocked_ids = set()
+
+def load_access_lists():
+    """Загрузить белый список, баны и заблокировавших бота из БД в память"""
+    global _whitelist_ids, _banned_ids, _bot_blocked_ids
+    cursor.execute("SELECT user_id FROM whitelist")
+    _whitelist_ids = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT user_id FROM banned_users")
+    _banned_ids = {row[0] for row in cursor.fetchall()}
+    cursor.execute("SELECT user_id FROM bot_blocked")
+    _bot_blocked_ids = {row[0] for row in cursor.fetchall()}
+
 def add_to_whitelist(user_id, added_by):
     with transaction():
         cursor.execute("""
             INSERT OR REPLACE INTO whitelist (user_id, added_by, added_at)
             VALUES (?, ?, ?)
         """, (user_id, added_by, int(time.time())))
+        after_commit(lambda: _whitelist_ids.add(user_id))
         return True
 
 def remove_from_whitelist(user_id):
     with transaction():
         cursor.execute("DELETE FROM whitelist WHERE user_id=?", (user_id,))
+        after_commit(lambda: _whitelist_ids.discard(user_id))
         return cursor.rowcount > 0
 
 def get_whitelist():
@@ -761,8 +1569,7 @@ def get_whitelist():
     return [row[0] for row in cursor.fetchall()]
 
 def is_in_whitelist(user_id):
-    cursor.execute("SELECT 1 FROM whitelist WHERE user_id=?", (user_id,))
-    return cursor.fetchone() is not None
+    return user_id in _whitelist_ids
 
 def create_exchange_request(user_id, username, stars_amount, gift_name, gift_emoji, diamonds_cost):
     with transaction():
@@ -839,15 +1646,19 @@ def get_exchange_stats():
     return cursor.fetchone()
 
 def create_stars_payment(user_id, stars_amount, diamonds_received, invoice_payload):
+    now = int(time.time())
     with transaction():
         cursor.execute("""
-            INSERT INTO stars_payments (user_id, stars_amount, diamonds_received, invoice_payload, created_at)
-            VALUES (?, ?, ?, ?, ?)
-        """, (user_id, stars_amount, diamonds_received, invoice_payload, int(time.time())))
+            INSERT INTO stars_payments (user_id, stars_amount, diamonds_received, invoice_payload, created_at, expires_at)
+            VALUES (?, ?, ?, ?, ?, ?)
+        """, (user_id, stars_amount, diamonds_received, invoice_payload, now, now + PAYMENT_INVOICE_TTL))
         return cursor.lastrowid
 
 def get_stars_payment_by_payload(invoice_payload):
-    cursor.execute("SELECT * FROM stars_payments WHERE invoice_payload=?", (invoice_payload,))
+    cursor.execute("""
+        SELECT id, user_id, stars_amount, diamonds_received, invoice_payload, status, created_at, completed_at
+        FROM stars_payments WHERE invoice_payload=?
+    """, (invoice_payload,))
     return cursor.fetchone()
 
 def update_stars_payment_status(invoice_payload, status):
@@ -875,16 +1686,17 @@ def ban_user(user_id, admin_id, reason=""):
             INSERT OR REPLACE INTO banned_users (user_id, banned_by, reason, banned_at)
             VALUES (?, ?, ?, ?)
         """, (user_id, admin_id, reason, int(time.time())))
+        after_commit(lambda: _banned_ids.add(user_id))
         return True
 
 def unban_user(user_id):
     with transaction():
         cursor.execute("DELETE FROM banned_users WHERE user_id=?", (user_id,))
+        after_commit(lambda: _banned_ids.discard(user_id))
         return cursor.rowcount > 0
 
 def is_user_banned(user_id):
-    cursor.execute("SELECT 1 FROM banned_users WHERE user_id=?", (user_id,))
-    return cursor.fetchone() is not None
+    return user_id in _banned_ids
 
 def check_and_create_tables():
     tables = ['users', 'achievements', 'transactions', 'user_levels', 'weekly_quests', 
@@ -903,4 +1715,153 @@ def check_and_create_tables():
     
     conn.commit()
 
-check_and_create_tables()
\ No newline at end of file
+# Форматы, в которых даты окончания розыгрышей вводились до проверки в
+# admin_create_lottery; strptime принимает и даты без ведущих нулей
+LEGACY_END_DATE_FORMATS = ("%Y-%m-%d", "%d.%m.%Y", "%d.%m.%y", "%d/%m/%Y", "%Y/%m/%d",
+                           "%Y-%m-%d %H:%M", "%Y-%m-%d %H:%M:%S", "%d.%m.%Y %H:%M")
+
+def normalize_end_date(value):
+    """Дата окончания в виде ГГГГ-ММ-ДД или None, если формат не распознан"""
+    for date_format in LEGACY_END_DATE_FORMATS:
+        try:
+            return datetime.strptime(str(value).strip(), date_format).strftime("%Y-%m-%d")
+        except ValueError:
+            continue
+    return None
+
+def _normalize_lottery_end_dates():
+    """Привести end_date розыгрышей к ISO-виду: get_due_custom_lotteries сравнивает даты строкой"""
+    cursor.execute("SELECT id, end_date FROM active_lotteries")
+    updates = []
+    for lottery_id, end_date in cursor.fetchall():
+        normalized = normalize_end_date(end_date)
+        if normalized is None:
+            logger.warning(f"Lottery #{lottery_id}: unrecognized end_date {end_date!r}, left as is")
+        elif normalized != end_date:
+            updates.append((normalized, lottery_id))
+    cursor.executemany("UPDATE active_lotteries SET end_date=? WHERE id=?", updates)
+    if updates:
+        logger.info(f"Normalized end_date of {len(updates)} lotteries")
+
+# Миграции схемы: номер миграции = позиция в списке, применённая версия
+# хранится в PRAGMA user_version. Новые миграции только добавляются в конец.
+# Шаг миграции - SQL-запрос или функция, выполняемая в той же транзакции.
+MIGRATIONS = [
+    # 1: индексы под основные пути доступа
+    [
+        "CREATE INDEX IF NOT EXISTS idx_users_referrer ON users(referrer_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_users_balance ON users(balance)",
+        "CREATE INDEX IF NOT EXISTS idx_users_refs ON users(refs)",
+        "CREATE INDEX IF NOT EXISTS idx_users_wins ON users(wins)",
+        "CREATE INDEX IF NOT EXISTS idx_user_levels_rank ON user_levels(level, total_exp)",
+        "CREATE INDEX IF NOT EXISTS idx_lottery_tickets_draw ON lottery_tickets(draw_date, ticket_number)",
+        "CREATE INDEX IF NOT EXISTS idx_lottery_tickets_user ON lottery_tickets(user_id, draw_date, ticket_number)",
+        "CREATE INDEX IF NOT EXISTS idx_lottery_history_created ON lottery_history(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_custom_lottery_tickets_lottery ON custom_lottery_tickets(lottery_id)",
+        "CREATE INDEX IF NOT EXISTS idx_promo_usage_user_code ON promo_usage(user_id, promo_code)",
+        "CREATE INDEX IF NOT EXISTS idx_payments_pending ON payments(status) WHERE status='pending'",
+        "CREATE INDEX IF NOT EXISTS idx_payments_user ON payments(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_exchange_requests_status ON exchange_requests(status, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_exchange_requests_user ON exchange_requests(user_id, created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_exchange_requests_created ON exchange_requests(created_at)",
+        "CREATE INDEX IF NOT EXISTS idx_stars_payments_payload ON stars_payments(invoice_payload)",
+        "CREATE INDEX IF NOT EXISTS idx_stars_payments_user ON stars_payments(user_id, created_at)",
+    ],
+    # 2: рассылки с сохраняемым курсором и пользователи, заблокировавшие бота
+    [
+        """CREATE TABLE IF NOT EXISTS broadcasts (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER,
+            text TEXT,
+            status TEXT DEFAULT 'running',
+            cursor_user_id INTEGER DEFAULT 0,
+            total INTEGER DEFAULT 0,
+            sent INTEGER DEFAULT 0,
+            failed INTEGER DEFAULT 0,
+            blocked INTEGER DEFAULT 0,
+            status_chat_id INTEGER,
+            status_message_id INTEGER,
+            created_at INTEGER,
+            finished_at INTEGER DEFAULT 0
+        )""",
+        "CREATE INDEX IF NOT EXISTS idx_broadcasts_status ON broadcasts(status)",
+        """CREATE TABLE IF NOT EXISTS bot_blocked (
+            user_id INTEGER PRIMARY KEY,
+            blocked_at INTEGER
+        )""",
+    ],
+    # 3: file_id загруженных в Telegram картинок
+    [
+        """CREATE TABLE IF NOT EXISTS media_cache (
+            name TEXT PRIMARY KEY,
+            content_hash TEXT,
+            file_id TEXT,
+            updated_at INTEGER
+        )""",
+    ],
+    # 4: срок жизни счетов; опрос и сверка идут только по живым pending-счетам
+    [
+        "ALTER TABLE payments ADD COLUMN expires_at INTEGER DEFAULT 0",
+        "ALTER TABLE stars_payments ADD COLUMN expires_at INTEGER DEFAULT 0",
+        f"UPDATE payments SET expires_at = created_at + {PAYMENT_INVOICE_TTL} WHERE status='pending'",
+        f"UPDATE stars_payments SET expires_at = created_at + {PAYMENT_INVOICE_TTL} WHERE status='pending'",
+        "DROP INDEX IF EXISTS idx_payments_pending",
+        "CREATE INDEX IF NOT EXISTS idx_payments_live ON payments(expires_at) WHERE status='pending'",
+        "CREATE INDEX IF NOT EXISTS idx_stars_payments_live ON stars_payments(expires_at) WHERE status='pending'",
+    ],
+    # 5: розыгрыши: победитель ищется по номеру билета, история знает пользовательские розыгрыши
+    [
+        "ALTER TABLE lottery_history ADD COLUMN lottery_id INTEGER DEFAULT 0",
+        "CREATE INDEX IF NOT EXISTS idx_lottery_history_draw ON lottery_history(lottery_id, draw_date)",
+        "DROP INDEX IF EXISTS idx_custom_lottery_tickets_lottery",
+        "CREATE INDEX IF NOT EXISTS idx_custom_lottery_tickets_number ON custom_lottery_tickets(lottery_id, ticket_number)",
+        "CREATE INDEX IF NOT EXISTS idx_active_lotteries_end ON active_lotteries(end_date) WHERE is_active=1",
+    ],
+    # 6: билеты диапазонами и счетчики номеров/участников по розыгрышам
+    [
+        "ALTER TABLE lottery_tickets ADD COLUMN ticket_count INTEGER DEFAULT 1",
+        "ALTER TABLE custom_lottery_tickets ADD COLUMN ticket_count INTEGER DEFAULT 1",
+        """CREATE TABLE IF NOT EXISTS lottery_draws (
+            lottery_id INTEGER,
+            draw_date TEXT,
+            tickets INTEGER DEFAULT 0,
+            players INTEGER DEFAULT 0,
+            PRIMARY KEY (lottery_id, draw_date)
+        )""",
+        """INSERT OR IGNORE INTO lottery_draws (lottery_id, draw_date, tickets, players)
+           SELECT 0, draw_date, MAX(ticket_number), COUNT(DISTINCT user_id)
+           FROM lottery_tickets GROUP BY draw_date""",
+        """INSERT OR IGNORE INTO lottery_draws (lottery_id, draw_date, tickets, players)
+           SELECT lottery_id, '', MAX(ticket_number), COUNT(DISTINCT user_id)
+           FROM custom_lottery_tickets GROUP BY lottery_id""",
+        "CREATE INDEX IF NOT EXISTS idx_custom_lottery_tickets_user ON custom_lottery_tickets(user_id, lottery_id)",
+    ],
+    # 7: даты окончания розыгрышей, введенные до проверки формата, - в ISO-вид
+    [
+        _normalize_lottery_end_dates,
+    ],
+]
+
+def get_schema_version():
+    cursor.execute("PRAGMA user_version")
+    return cursor.fetchone()[0]
+
+def run_migrations():
+    """Применить миграции, которые еще не были применены к базе"""
+    version = get_schema_version()
+    for number, statements in enumerate(MIGRATIONS, 1):
+        if number <= version:
+            continue
+        with transaction():
+            for statement in statements:
+                if callable(statement):
+                    statement()
+                else:
+                    cursor.execute(statement)
+            cursor.execute(f"PRAGMA user_version={number}")
+        logger.info(f"Applied schema migration {number}")
+
+check_and_create_tables()
+run_migrations()
+rebuild_leaderboards()
+load_access_lists()
\ No newline at end of file
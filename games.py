@@ -9,17 +9,26 @@ class Roulette:
             return False, 0
         
         # Уменьшенный шанс выигрыша (20%)
-        if random.random() < ROULETTE_WIN_CHANCE:  # 20% шанс
+        return Roulette.payout(bet, random.random() < ROULETTE_WIN_CHANCE)  # 20% шанс
+
+    @staticmethod
+    def payout(bet, won):
+        """Выигрыш по исходу вращения"""
+        if won:
             return True, bet * 2
         return False, 0
 
 class Dice:
     @staticmethod
     def roll(bet):
+        return Dice.payout(bet, random.randint(1, 6))
+
+    @staticmethod
+    def payout(bet, roll):
+        """Выигрыш по выпавшему значению кубика (1-6), в т.ч. из нативного send_dice"""
         if bet < MIN_BET:
             return False, 0, 1
         
-        roll = random.randint(1, 6)
         if roll == 6:
             return True, bet * 4, roll  # Уменьшен с x5 до x4
         elif roll == 1:
@@ -27,17 +36,22 @@ class Dice:
         return False, 0, roll  # Проигрыш
 
 class StonePaperScissors:
+    # Создаем весовую систему с небольшим смещением в пользу компьютера
+    CHOICES = ['stone', 'paper', 'scissors']
+    WEIGHTS = [0.32, 0.34, 0.34]  # Слегка смещенные веса
+
     @staticmethod
     def play(bet, choice):
         """choice: 'stone', 'paper', 'scissors'"""
         if bet < MIN_BET:
             return False, 0
         
-        # Создаем весовую систему с небольшим смещением в пользу компьютера
-        choices = ['stone', 'paper', 'scissors']
-        weights = [0.32, 0.34, 0.34]  # Слегка смещенные веса
-        bot_choice = random.choices(choices, weights=weights, k=1)[0]
-        
+        bot_choice = random.choices(StonePaperScissors.CHOICES, weights=StonePaperScissors.WEIGHTS, k=1)[0]
+        return StonePaperScissors.payout(bet, choice, bot_choice)
+
+    @staticmethod
+    def payout(bet, choice, bot_choice):
+        """Выигрыш по выбору игрока и бота"""
         # Определяем победителя
         if choice == bot_choice:
             return None, bet, bot_choice  # Ничья - возврат ставки
@@ -51,28 +65,44 @@ class StonePaperScissors:
             return False, 0, bot_choice
 
 class SlotMachine:
+    # Увеличены веса на менее выигрышные символы
+    WEIGHTS = {
+        "🍒": 40,  # Увеличен вес
+        "🍋": 35,  # Увеличен вес
+        "🔔": 15,  # Уменьшен вес
+        "💎": 6,   # Уменьшен вес
+        "⭐": 3,    # Уменьшен вес
+        "7️⃣": 1    # Минимальный вес
+    }
+
     @staticmethod
     def spin(bet):
         if bet < MIN_BET:
             return False, 0, []
         
-        symbols = ["🍒", "🍋", "⭐", "7️⃣", "🔔", "💎"]
-        
-        # Увеличены веса на менее выигрышные символы
-        weights = {
-            "🍒": 40,  # Увеличен вес
-            "🍋": 35,  # Увеличен вес
-            "🔔": 15,  # Уменьшен вес
-            "💎": 6,   # Уменьшен вес
-            "⭐": 3,    # Уменьшен вес
-            "7️⃣": 1    # Минимальный вес
-        }
-        
         weighted_symbols = []
-        for symbol, weight in weights.items():
+        for symbol, weight in SlotMachine.WEIGHTS.items():
             weighted_symbols.extend([symbol] * weight)
         
         result = [random.choice(weighted_symbols) for _ in range(3)]
+        return SlotMachine.payout(bet, result)
+
+    # Барабаны нативного 🎰 (значение send_dice 1-64) и их аналоги в нашей
+    # таблице выплат; BAR сопоставлен 🔔, чтобы отдача осталась близкой к spin()
+    DICE_REELS = ["🔔", "🍒", "🍋", "7️⃣"]  # BAR, виноград, лимон, семерка
+
+    @staticmethod
+    def from_dice_value(bet, value):
+        """Выигрыш по значению нативного 🎰 из send_dice"""
+        index = value - 1
+        result = [SlotMachine.DICE_REELS[(index >> shift) & 3] for shift in (0, 2, 4)]
+        return SlotMachine.payout(bet, result)
+
+    @staticmethod
+    def payout(bet, result):
+        """Выигрыш по трем символам барабанов"""
+        if bet < MIN_BET:
+            return False, 0, result
         
         # Определяем выигрыш
         if result[0] == result[1] == result[2]:
@@ -96,6 +126,13 @@ class SlotMachine:
         return False, 0, result
 
 class BlackJack:
+    CARD_MIN, CARD_MAX = 1, 11
+    PLAYER_HIT_LIMIT = 16
+    PLAYER_HIT_CHANCE = 0.8
+    DEALER_STAND = 17
+    DEALER_STEAL_CHANCE = 0.1
+    TIE_LOSS_CHANCE = 0.7
+
     @staticmethod
     def play(bet):
         if bet < MIN_BET:
@@ -105,20 +142,20 @@ class BlackJack:
         dealer_cards = []
         
         for _ in range(2):
-            player_cards.append(random.randint(1, 11))
-            dealer_cards.append(random.randint(1, 11))
+            player_cards.append(random.randint(BlackJack.CARD_MIN, BlackJack.CARD_MAX))
+            dealer_cards.append(random.randint(BlackJack.CARD_MIN, BlackJack.CARD_MAX))
         
         player_sum = sum(player_cards)
         dealer_sum = sum(dealer_cards)
         
         # Увеличен шанс взять карту с риском перебора
-        if player_sum <= 16 and random.random() < 0.8:
-            player_cards.append(random.randint(1, 11))
+        if player_sum <= BlackJack.PLAYER_HIT_LIMIT and random.random() < BlackJack.PLAYER_HIT_CHANCE:
+            player_cards.append(random.randint(BlackJack.CARD_MIN, BlackJack.CARD_MAX))
             player_sum = sum(player_cards)
         
         # Дилер с увеличенным преимуществом
-        while dealer_sum < 17:
-            dealer_cards.append(random.randint(1, 11))
+        while dealer_sum < BlackJack.DEALER_STAND:
+            dealer_cards.append(random.randint(BlackJack.CARD_MIN, BlackJack.CARD_MAX))
             dealer_sum = sum(dealer_cards)
         
         # Увеличен шанс выигрыша дилера
@@ -128,12 +165,12 @@ class BlackJack:
             return True, bet * 2, (player_cards, dealer_cards)
         elif player_sum > dealer_sum:
             # 10% шанс что дилер выиграет даже при меньшей сумме
-            if random.random() < 0.1:
+            if random.random() < BlackJack.DEALER_STEAL_CHANCE:
                 return False, 0, (player_cards, dealer_cards)
             return True, bet * 2, (player_cards, dealer_cards)
         elif player_sum == dealer_sum:
             # 70% шанс что дилер выиграет при ничьей
-            if random.random() < 0.7:
+            if random.random() < BlackJack.TIE_LOSS_CHANCE:
                 return False, 0, (player_cards, dealer_cards)
             return None, bet, (player_cards, dealer_cards)
         else:
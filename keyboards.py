@@ -108,6 +108,9 @@ def admin_keyboard():
         types.InlineKeyboardButton("🔨 Бан пользователя", callback_data="admin_ban_user"),
         types.InlineKeyboardButton("🔓 Разбан пользователя", callback_data="admin_unban_user"),
     )
+    kb.add(
+        types.InlineKeyboardButton("📈 Отдача игр (RTP)", callback_data="admin_rtp"),
+    )
     kb.add(
         types.InlineKeyboardButton("🔙 Назад", callback_data="back_admin"),
     )
@@ -204,11 +207,15 @@ def weekly_quests_keyboard():
 def lottery_keyboard(draw_date, user_tickets_count=0):
     kb = types.InlineKeyboardMarkup(row_width=2)
     
-    from config import LOTTERY_TICKET_PRICE
+    from config import LOTTERY_TICKET_PRICE, LOTTERY_BULK_SIZES
     kb.add(types.InlineKeyboardButton(
         f"🎫 Купить билет ({LOTTERY_TICKET_PRICE}💎)", 
         callback_data="buy_lottery_ticket"
     ))
+    kb.add(*[types.InlineKeyboardButton(
+        f"🎫 x{count} ({count * LOTTERY_TICKET_PRICE}💎)",
+        callback_data=f"buy_lottery_tickets_{count}"
+    ) for count in LOTTERY_BULK_SIZES])
     
     if user_tickets_count > 0:
         kb.add(types.InlineKeyboardButton(
@@ -371,6 +378,12 @@ def admin_exchange_action_keyboard(request_id):
     )
     return kb
 
+def broadcast_keyboard(broadcast_id):
+    """Кнопка остановки идущей рассылки"""
+    kb = types.InlineKeyboardMarkup()
+    kb.add(types.InlineKeyboardButton("⛔ Остановить рассылку", callback_data=f"broadcast_cancel_{broadcast_id}"))
+    return kb
+
 def sponsors_keyboard(sponsors):
     kb = types.InlineKeyboardMarkup(row_width=1)
     for channel_username, channel_name in sponsors:
@@ -0,0 +1,99 @@
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from utils import logger
+
+class UserMailboxPool:
+    """Пул воркеров для хендлеров telebot с очередью на каждого пользователя.
+
+    Подменяет bot.worker_pool: telebot кладет сюда put(handler, update, ...).
+    Обновления одного пользователя выполняются строго по очереди (второе
+    нажатие не начнется, пока не закончилось первое), обновления разных
+    пользователей - параллельно на общем пуле потоков.
+    """
+
+    def __init__(self, workers=16):
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="handler")
+        self._lock = threading.Lock()
+        self._mailboxes = {}
+        self.workers = workers
+        self.handled = 0
+        self.errors = 0
+        self.total_wait = 0.0
+        self.max_wait = 0.0
+        # Интерфейс util.ThreadPool, который ждет цикл polling
+        self.exception_event = threading.Event()
+        self.exception_info = None
+
+    @staticmethod
+    def _key(args):
+        """Очередь задачи: id пользователя из апдейта, иначе отдельная очередь"""
+        update = args[0] if args else None
+        user = getattr(update, "from_user", None)
+        if user is not None:
+            return user.id
+        chat = getattr(update, "chat", None)
+        if chat is not None:
+            return chat.id
+        return object()
+
+    def put(self, func, *args, **kwargs):
+        key = self._key(args)
+        item = (time.monotonic(), func, args, kwargs)
+        with self._lock:
+            mailbox = self._mailboxes.get(key)
+            if mailbox is not None:
+                mailbox.append(item)
+                return
+            self._mailboxes[key] = deque([item])
+        self._executor.submit(self._drain, key)
+
+    def _drain(self, key):
+        while True:
+            with self._lock:
+                mailbox = self._mailboxes[key]
+                if not mailbox:
+                    del self._mailboxes[key]
+                    return
+                enqueued, func, args, kwargs = mailbox.popleft()
+            wait = time.monotonic() - enqueued
+            failed = False
+            try:
+                func(*args, **kwargs)
+            except Exception as e:
+                failed = True
+                logger.error(f"Handler error for {key}: {e}")
+            with self._lock:
+                self.handled += 1
+                self.errors += failed
+                self.total_wait += wait
+                self.max_wait = max(self.max_wait, wait)
+
+    def raise_exceptions(self):
+        # Ошибки хендлеров логируются в _drain и не перезапускают polling
+        pass
+
+    def clear_exceptions(self):
+        self.exception_info = None
+        self.exception_event.clear()
+
+    def close(self):
+        self._executor.shutdown(wait=False)
+
+    def stats(self):
+        """Глубина очередей и время ожидания хендлеров"""
+        with self._lock:
+            # Очередь считается вместе с выполняющимся сейчас апдейтом
+            depths = {key: len(mailbox) + 1 for key, mailbox in self._mailboxes.items()}
+            deepest = sorted(depths.items(), key=lambda item: item[1], reverse=True)[:5]
+            return {
+                "workers": self.workers,
+                "active_users": len(depths),
+                "queued": sum(depths.values()) - len(depths),
+                "deepest": [(key, depth) for key, depth in deepest if isinstance(key, int)],
+                "handled": self.handled,
+                "errors": self.errors,
+                "avg_wait_ms": self.total_wait / self.handled * 1000 if self.handled else 0.0,
+                "max_wait_ms": self.max_wait * 1000,
+            }
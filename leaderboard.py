@@ -0,0 +1,243 @@
+import bisect
+import threading
+import time
+
+class RankIndex:
+    """Упорядоченное множество с поиском позиции за O(log n).
+
+    Элементы лежат в отсортированных корзинах размером до 2*load, длины
+    корзин хранятся в дереве Фенвика: позиция элемента = сумма длин
+    предыдущих корзин + bisect внутри своей корзины.
+    """
+
+    def __init__(self, load=256):
+        self.load = load
+        self._buckets = []
+        self._maxes = []
+        self._tree = []
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def load_sorted(self, items):
+        """Заполнить из уже отсортированной последовательности"""
+        items = list(items)
+        self._buckets = [items[i:i + self.load] for i in range(0, len(items), self.load)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(items)
+        self._rebuild_tree()
+
+    def _rebuild_tree(self):
+        tree = [0] + [len(bucket) for bucket in self._buckets]
+        for i in range(1, len(tree)):
+            parent = i + (i & -i)
+            if parent < len(tree):
+                tree[parent] += tree[i]
+        self._tree = tree
+
+    def _update(self, bucket_index, delta):
+        i = bucket_index + 1
+        while i < len(self._tree):
+            self._tree[i] += delta
+            i += i & -i
+
+    def _prefix(self, bucket_index):
+        """Количество элементов в корзинах [0, bucket_index)"""
+        total = 0
+        i = bucket_index
+        while i > 0:
+            total += self._tree[i]
+            i -= i & -i
+        return total
+
+    def _locate(self, position):
+        """Корзина и смещение для позиции position"""
+        bucket_index = 0
+        step = 1 << (len(self._tree) - 1).bit_length()
+        while step:
+            nxt = bucket_index + step
+            if nxt < len(self._tree) and self._tree[nxt] <= position:
+                bucket_index = nxt
+                position -= self._tree[nxt]
+            step >>= 1
+        return bucket_index, position
+
+    def add(self, item):
+        if not self._buckets:
+            self.load_sorted([item])
+            return
+        index = bisect.bisect_left(self._maxes, item)
+        if index == len(self._maxes):
+            index -= 1
+        bucket = self._buckets[index]
+        bisect.insort(bucket, item)
+        self._maxes[index] = bucket[-1]
+        self._len += 1
+        if len(bucket) > 2 * self.load:
+            self._buckets[index:index + 1] = [bucket[:self.load], bucket[self.load:]]
+            self._maxes[index:index + 1] = [bucket[self.load - 1], bucket[-1]]
+            self._rebuild_tree()
+        else:
+            self._update(index, 1)
+
+    def remove(self, item):
+        index = bisect.bisect_left(self._maxes, item)
+        bucket = self._buckets[index]
+        del bucket[bisect.bisect_left(bucket, item)]
+        self._len -= 1
+        if bucket:
+            self._maxes[index] = bucket[-1]
+            self._update(index, -1)
+        else:
+            del self._buckets[index]
+            del self._maxes[index]
+            self._rebuild_tree()
+
+    def index(self, item):
+        """Количество элементов меньше item"""
+        index = bisect.bisect_left(self._maxes, item)
+        if index == len(self._maxes):
+            return self._len
+        return self._prefix(index) + bisect.bisect_left(self._buckets[index], item)
+
+    def slice(self, start, stop):
+        start = max(start, 0)
+        stop = min(stop, self._len)
+        if start >= stop:
+            return []
+        index, offset = self._locate(start)
+        result = []
+        while len(result) < stop - start:
+            bucket = self._buckets[index]
+            result.extend(bucket[offset:offset + stop - start - len(result)])
+            index += 1
+            offset = 0
+        return result
+
+
+class Leaderboard:
+    """Рейтинг пользователей по одной метрике, поддерживаемый инкрементально.
+
+    Значение метрики хранится для каждого пользователя кортежем (например
+    (balance,) или (level, total_exp)). В рейтинг попадают только пользователи
+    с username, как и в SQL-топах.
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self._lock = threading.RLock()
+        self._values = {}
+        self._names = {}
+        self._index = RankIndex()  # (отрицательный ключ, uid): по возрастанию = по убыванию метрики
+        self.rebuilt_at = 0
+
+    def _entry(self, uid):
+        if self._names.get(uid) is None:
+            return None
+        return (tuple(-x for x in self._values[uid]), uid)
+
+    def load(self, rows):
+        """Полная пересборка из строк (uid, username, key)"""
+        with self._lock:
+            self._values = {}
+            self._names = {}
+            for uid, username, key in rows:
+                self._values[uid] = tuple(key)
+                self._names[uid] = username
+            entries = (self._entry(uid) for uid in self._values)
+            self._index.load_sorted(sorted(entry for entry in entries if entry is not None))
+            self.rebuilt_at = time.time()
+
+    def _replace(self, uid, key=None, username=None):
+        entry = self._entry(uid)
+        if entry is not None:
+            self._index.remove(entry)
+        if key is not None:
+            self._values[uid] = key
+        if username is not None:
+            self._names[uid] = username
+        entry = self._entry(uid)
+        if entry is not None:
+            self._index.add(entry)
+
+    def register(self, uid, username, key):
+        """Новый пользователь"""
+        with self._lock:
+            if uid in self._values:
+                return
+            self._names[uid] = username
+            self._values[uid] = tuple(key)
+            entry = self._entry(uid)
+            if entry is not None:
+                self._index.add(entry)
+
+    def rename(self, uid, username):
+        with self._lock:
+            if uid in self._values:
+                self._replace(uid, username=username)
+
+    def add(self, uid, *delta):
+        """Прибавить дельту к значению пользователя (операции коммутативны)"""
+        with self._lock:
+            key = self._values.get(uid)
+            if key is not None:
+                self._replace(uid, key=tuple(a + b for a, b in zip(key, delta)))
+
+    def _rows(self, start, stop):
+        return [(self._names[uid],) + self._values[uid] for _, uid in self._index.slice(start, stop)]
+
+    def top(self, limit=10):
+        """Лучшие limit записей в формате (username, *значения)"""
+        with self._lock:
+            return self._rows(0, limit)
+
+    def rank(self, uid):
+        """Место пользователя (с 1) или None, если он не участвует в рейтинге"""
+        with self._lock:
+            entry = self._entry(uid) if uid in self._values else None
+            if entry is None:
+                return None
+            return self._index.index(entry) + 1
+
+    def around(self, uid, radius=1):
+        """Место пользователя и соседи: (rank, [(место, username, *значения), ...])"""
+        with self._lock:
+            rank = self.rank(uid)
+            if rank is None:
+                return None, []
+            start = max(rank - 1 - radius, 0)
+            rows = self._rows(start, rank + radius)
+            return rank, [(start + i + 1,) + row for i, row in enumerate(rows)]
+
+    def value(self, uid):
+        return self._values.get(uid)
+
+
+class LeaderboardRegistry:
+    """Набор лидербордов бота: баланс, рефералы, победы, уровни"""
+
+    def __init__(self):
+        self.boards = {
+            "balance": Leaderboard("balance"),
+            "refs": Leaderboard("refs"),
+            "wins": Leaderboard("wins"),
+            "levels": Leaderboard("levels"),
+        }
+
+    def __getitem__(self, metric):
+        return self.boards[metric]
+
+    def register_user(self, uid, username):
+        for metric, board in self.boards.items():
+            board.register(uid, username, (1, 0) if metric == "levels" else (0,))
+
+    def rename_user(self, uid, username):
+        for board in self.boards.values():
+            board.rename(uid, username)
+
+    def top(self, metric, limit=10):
+        return self.boards[metric].top(limit)
+
+    def around(self, metric, uid, radius=1):
+        return self.boards[metric].around(uid, radius)
@@ -0,0 +1,83 @@
+import hashlib
+import os
+import threading
+from database import get_media_file_ids, save_media_file_id, delete_media_file_id
+from utils import logger
+
+class MediaCache:
+    """Картинки меню: байты в памяти и file_id, полученные от Telegram.
+
+    Картинка загружается в Telegram один раз, дальше отправляется по file_id.
+    file_id хранится в БД вместе с sha256 содержимого, поэтому замена файла
+    в папке сбрасывает его при следующем запуске.
+    """
+
+    def __init__(self, directory):
+        self.directory = directory
+        self._images = {}  # имя -> (байты, sha256)
+        self._file_ids = {}
+        self._locks = {}
+        self.uploads = 0
+        self.cached_sends = 0
+
+    def preload(self):
+        """Прочитать картинки с диска и сохраненные file_id из БД"""
+        images = {}
+        if os.path.isdir(self.directory):
+            for name in sorted(os.listdir(self.directory)):
+                path = os.path.join(self.directory, name)
+                if os.path.isfile(path):
+                    with open(path, 'rb') as f:
+                        data = f.read()
+                    images[name] = (data, hashlib.sha256(data).hexdigest())
+        stored = get_media_file_ids()
+        self._images = images
+        self._file_ids = {
+            name: file_id for name, (content_hash, file_id) in stored.items()
+            if name in images and images[name][1] == content_hash
+        }
+        self._locks = {name: threading.Lock() for name in images}
+        logger.info(f"Media cache: {len(images)} images, {len(self._file_ids)} file_id")
+
+    def has(self, name):
+        return name in self._images
+
+    def send_photo(self, bot, chat_id, name, **kwargs):
+        """Отправить картинку по file_id, а если его нет или он устарел - загрузить"""
+        file_id = self._file_ids.get(name)
+        if file_id is not None:
+            try:
+                message = bot.send_photo(chat_id, file_id, **kwargs)
+                self.cached_sends += 1
+                return message
+            except Exception as e:
+                # Устаревший file_id Telegram отклоняет: 400 "wrong file identifier"
+                if getattr(e, "error_code", None) != 400 or "file" not in str(e).lower():
+                    raise
+                logger.warning(f"Cached file_id for {name} rejected, re-uploading: {e}")
+                self._forget(name, file_id)
+        with self._locks[name]:
+            # Пока ждали, картинку мог загрузить другой поток
+            file_id = self._file_ids.get(name)
+            if file_id is not None:
+                return bot.send_photo(chat_id, file_id, **kwargs)
+            data, content_hash = self._images[name]
+            message = bot.send_photo(chat_id, data, **kwargs)
+            self.uploads += 1
+            file_id = message.photo[-1].file_id
+            self._file_ids[name] = file_id
+            save_media_file_id(name, content_hash, file_id)
+            return message
+
+    def _forget(self, name, file_id):
+        if self._file_ids.get(name) == file_id:
+            del self._file_ids[name]
+            delete_media_file_id(name)
+
+    def stats(self):
+        return {
+            "images": len(self._images),
+            "file_ids": len(self._file_ids),
+            "uploads": self.uploads,
+            "cached_sends": self.cached_sends,
+        }
@@ -2,6 +2,9 @@ import random
 import time
 from datetime import datetime
 
+# 80% шанс на безопасный диапазон, 20% на остальное (ИЗМЕНЕНО с 90%)
+CASE_SAFE_CHANCE = 0.8
+
 class Case:
     def __init__(self, name, price, min_reward, max_reward, safe_range, emoji):
         self.name = name
@@ -13,8 +16,7 @@ class Case:
     
     def open(self):
         """Открытие платного сундука с новыми шансами"""
-        # 80% шанс на безопасный диапазон, 20% на остальное (ИЗМЕНЕНО с 90%)
-        if random.random() < 0.8:  # 80% шанс
+        if random.random() < CASE_SAFE_CHANCE:  # 80% шанс
             return random.randint(self.min_reward, self.safe_range)
         else:  # 20% шанс
             return random.randint(self.safe_range + 1, self.max_reward)
@@ -28,13 +30,12 @@ CASES = {
     "c500": Case("Незеритовый", 500, 355, 850, 555, "🪨"), # 355-850, 80% шанс 355-555 (ИЗМЕНЕНО)
 }
 
+# Бесплатный сундук = деревянный: 0-20, 80% шанс 0-8 (ИЗМЕНЕНО с 90%)
+FREE_CASE = Case("Бесплатный", 0, 0, 20, 8, "🎁")
+
 def open_free_case():
     """Открытие бесплатного сундука с новыми шансами"""
-    # Деревянный сундук: 0-20, 80% шанс 0-8 (ИЗМЕНЕНО с 90%)
-    if random.random() < 0.8:  # 80% шанс
-        return random.randint(0, 8)
-    else:  # 20% шанс
-        return random.randint(9, 20)
+    return FREE_CASE.open()
 
 class UserModel:
     @staticmethod
@@ -0,0 +1,345 @@
+import heapq
+import inspect
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from contextlib import contextmanager
+from utils import logger
+
+# Классы приоритета исходящих запросов (меньше - раньше)
+PRIORITY_PAYMENT = 0
+PRIORITY_INTERACTIVE = 1
+PRIORITY_ANIMATION = 2
+PRIORITY_BULK = 3
+
+PRIORITY_NAMES = {
+    PRIORITY_PAYMENT: "payment",
+    PRIORITY_INTERACTIVE: "interactive",
+    PRIORITY_ANIMATION: "animation",
+    PRIORITY_BULK: "bulk",
+}
+
+_local = threading.local()
+
+@contextmanager
+def priority(level):
+    """Приоритет для всех запросов к Bot API из текущего потока внутри блока"""
+    previous = getattr(_local, "priority", PRIORITY_INTERACTIVE)
+    _local.priority = level
+    try:
+        yield
+    finally:
+        _local.priority = previous
+
+def current_priority():
+    return getattr(_local, "priority", PRIORITY_INTERACTIVE)
+
+
+class TokenBucket:
+    """Ведро токенов: rate токенов в секунду, не больше capacity"""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0
+
+    def _refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def ready_at(self, now):
+        """Когда будет доступен токен (now, если уже доступен)"""
+        self._refill(now)
+        ready = now if self.tokens >= 1 else now + (1 - self.tokens) / self.rate
+        return max(ready, self.paused_until)
+
+    def take(self, now):
+        self._refill(now)
+        self.tokens -= 1
+
+    def pause(self, until):
+        self.paused_until = max(self.paused_until, until)
+
+    def idle(self, now):
+        return self.ready_at(now) <= now and self.tokens >= self.capacity
+
+
+class OutboundRequest:
+    def __init__(self, priority, seq, chat_id, func, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+        self.lane = None
+
+    @property
+    def key(self):
+        return (self.priority, self.seq)
+
+
+class ChatLane:
+    """Запросы одного чата по порядку постановки.
+
+    В куче очереди чат представлен одной записью с ключом самого срочного
+    из своих запросов (key); пока запрос чата выполняется (busy) или
+    запросов нет, чата в куче нет и key равен None.
+    """
+
+    def __init__(self, chat_id):
+        self.chat_id = chat_id
+        self.requests = deque()
+        self.key = None
+        self.busy = False
+
+    def __lt__(self, other):
+        return self.key < other.key
+
+
+class OutboundQueue:
+    """Очередь исходящих запросов к Bot API.
+
+    Общий лимит (global_rate в секунду) и лимиты на чат: личные чаты -
+    private_rate в секунду, группы - group_rate в минуту, оба с запасом
+    burst. Приоритет выбирает, какой чат обслужить следующим (платежи раньше
+    анимаций, внутри класса - по порядку постановки), но внутри одного чата
+    запросы уходят строго по порядку и по одному: срочный запрос поднимает
+    приоритет всей очереди своего чата. Ответ 429 ставит чат (или всю
+    очередь) на паузу retry_after и возвращает запрос в начало очереди чата.
+    В куче лежит по одной записи на чат (ChatLane), а не на запрос.
+    """
+
+    def __init__(self, global_rate=30, private_rate=1, group_rate=20, burst=3, workers=8, max_retries=3):
+        self.private_rate = private_rate
+        self.group_rate = group_rate / 60
+        self.burst = burst
+        self.max_retries = max_retries
+        self._global = TokenBucket(global_rate, global_rate)
+        self._chats = {}
+        self._heap = []  # ChatLane, у которых есть запросы и ничего не выполняется
+        self._lanes = {}  # chat_id -> ChatLane; запросы без chat_id получают свою ChatLane
+        self._queued = dict.fromkeys(PRIORITY_NAMES, 0)
+        self._seq = 0
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="outbound")
+        self._thread = None
+        self._inflight = 0
+        self.sent = 0
+        self.retries = 0
+        self.rate_limited = 0
+        self._last_prune = time.monotonic()
+
+    def submit(self, chat_id, func, /, *args, **kwargs):
+        """Поставить вызов func(*args, **kwargs) в очередь; возвращает Future"""
+        with self._cond:
+            self._seq += 1
+            request = OutboundRequest(current_priority(), self._seq, chat_id, func, args, kwargs)
+            if chat_id is None:
+                lane = ChatLane(None)
+            else:
+                lane = self._lanes.get(chat_id)
+                if lane is None:
+                    lane = self._lanes[chat_id] = ChatLane(chat_id)
+            request.lane = lane
+            lane.requests.append(request)
+            self._queued[request.priority] = self._queued.get(request.priority, 0) + 1
+            self._schedule(lane, request.key)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="outbound-dispatcher", daemon=True)
+                self._thread.start()
+            self._cond.notify()
+        return request.future
+
+    def call(self, chat_id, func, /, *args, **kwargs):
+        """Выполнить вызов через очередь и дождаться результата"""
+        return self.submit(chat_id, func, *args, **kwargs).result()
+
+    def _bucket(self, chat_id):
+        bucket = self._chats.get(chat_id)
+        if bucket is None:
+            # Отрицательные id - группы и каналы
+            rate = self.group_rate if isinstance(chat_id, int) and chat_id < 0 else self.private_rate
+            bucket = self._chats[chat_id] = TokenBucket(rate, self.burst)
+        return bucket
+
+    def _schedule(self, lane, key=None):
+        """Поставить чат в кучу или поднять его ключ (под self._cond).
+
+        key - ключ только что добавленного запроса; без него ключ считается
+        по всей очереди чата (чат возвращается в кучу после выполнения).
+        """
+        if lane.busy or not lane.requests:
+            return
+        if key is None:
+            key = min(request.key for request in lane.requests)
+        if lane.key is None:
+            lane.key = key
+            heapq.heappush(self._heap, lane)
+        elif key < lane.key:
+            # Срочный запрос поднимает чат, который уже в куче; это редкость
+            # (платеж за анимацией), поэтому кучу просто перестраиваем
+            lane.key = key
+            heapq.heapify(self._heap)
+
+    def _next_ready(self, now):
+        """Первый по приоритету запрос, который можно отправить сейчас, или время ожидания"""
+        global_ready = self._global.ready_at(now)
+        if global_ready > now:
+            return None, global_ready - now
+        skipped = []
+        found = None
+        wake_at = None
+        while self._heap:
+            lane = heapq.heappop(self._heap)
+            if lane.chat_id is not None:
+                ready = self._bucket(lane.chat_id).ready_at(now)
+                if ready > now:
+                    wake_at = ready if wake_at is None else min(wake_at, ready)
+                    skipped.append(lane)
+                    continue
+                self._bucket(lane.chat_id).take(now)
+            # Внутри чата - строго по порядку: уходит первый запрос чата,
+            # а более срочный запрос лишь поднял чат вперед
+            found = lane.requests.popleft()
+            lane.key = None
+            lane.busy = True
+            self._queued[found.priority] -= 1
+            self._global.take(now)
+            break
+        for lane in skipped:
+            heapq.heappush(self._heap, lane)
+        if found is not None:
+            return found, None
+        return None, (wake_at - now) if wake_at is not None else None
+
+    def _prune(self, now):
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        self._chats = {chat_id: bucket for chat_id, bucket in self._chats.items() if not bucket.idle(now)}
+
+    def _run(self):
+        while True:
+            with self._cond:
+                now = time.monotonic()
+                self._prune(now)
+                request, wait = self._next_ready(now)
+                if request is None:
+                    self._cond.wait(wait)
+                    continue
+                self._inflight += 1
+            self._pool.submit(self._execute, request)
+
+    def _execute(self, request):
+        request.attempts += 1
+        try:
+            result = request.func(*request.args, **request.kwargs)
+        except Exception as e:
+            retry_after = self._retry_after(e)
+            if retry_after is not None and request.attempts <= self.max_retries:
+                self._requeue(request, retry_after)
+                return
+            with self._cond:
+                self._finish(request)
+            request.future.set_exception(e)
+            return
+        with self._cond:
+            self._finish(request)
+            self.sent += 1
+        request.future.set_result(result)
+
+    def _finish(self, request):
+        """Снять запрос с выполнения (под self._cond) и разбудить диспетчер для следующего запроса чата"""
+        self._inflight -= 1
+        lane = request.lane
+        lane.busy = False
+        if lane.requests:
+            self._schedule(lane)
+        elif self._lanes.get(lane.chat_id) is lane:
+            del self._lanes[lane.chat_id]
+        self._cond.notify()
+
+    @staticmethod
+    def _retry_after(error):
+        """retry_after из ответа 429 или None для остальных ошибок"""
+        if getattr(error, "error_code", None) != 429:
+            return None
+        result_json = getattr(error, "result_json", None) or {}
+        return (result_json.get("parameters") or {}).get("retry_after", 1)
+
+    def _requeue(self, request, retry_after):
+        until = time.monotonic() + retry_after
+        with self._cond:
+            self.retries += 1
+            self.rate_limited += 1
+            if request.chat_id is not None:
+                self._bucket(request.chat_id).pause(until)
+            else:
+                self._global.pause(until)
+            # Повтор идет раньше запросов, поставленных после него
+            request.lane.requests.appendleft(request)
+            self._queued[request.priority] += 1
+            self._finish(request)
+        logger.warning(f"Bot API 429 for chat {request.chat_id}, retry in {retry_after}s")
+
+    def stats(self):
+        """Глубина очереди по классам приоритета и счетчики"""
+        with self._cond:
+            return {
+                "queued": {PRIORITY_NAMES.get(level, str(level)): count for level, count in self._queued.items()},
+                "inflight": self._inflight,
+                "sent": self.sent,
+                "retries": self.retries,
+                "rate_limited": self.rate_limited,
+                "chats": len(self._chats),
+            }
+
+
+class QueuedBot:
+    """Обертка над TeleBot: отправки и правки сообщений идут через OutboundQueue.
+
+    Остальные атрибуты (декораторы хендлеров, polling, get_chat_member...)
+    отдаются как есть. Вызовы синхронные: поток ждет своей очереди и
+    получает результат или исключение как от обычного TeleBot; submit()
+    ставит вызов в очередь без ожидания.
+    """
+
+    QUEUED_METHODS = {
+        "send_message", "send_photo", "send_document", "send_dice", "send_invoice",
+        "forward_message", "copy_message", "edit_message_text", "edit_message_caption",
+        "edit_message_reply_markup", "edit_message_media", "delete_message",
+    }
+
+    def __init__(self, bot, queue):
+        self._bot = bot
+        self._queue = queue
+        self._signatures = {}
+
+    def _chat_id(self, name, method, args, kwargs):
+        signature = self._signatures.get(name)
+        if signature is None:
+            signature = self._signatures[name] = inspect.signature(method)
+        try:
+            return signature.bind_partial(*args, **kwargs).arguments.get("chat_id")
+        except TypeError:
+            return None
+
+    def submit(self, name, *args, **kwargs):
+        """Поставить вызов метода TeleBot в очередь; возвращает Future"""
+        method = getattr(self._bot, name)
+        return self._queue.submit(self._chat_id(name, method, args, kwargs), method, *args, **kwargs)
+
+    def __getattr__(self, name):
+        attr = getattr(self._bot, name)
+        if name not in self.QUEUED_METHODS:
+            return attr
+
+        def queued(*args, **kwargs):
+            return self._queue.call(self._chat_id(name, attr, args, kwargs), attr, *args, **kwargs)
+        return queued
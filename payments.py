@@ -0,0 +1,97 @@
+"""Счета CryptoBot: вебхуки invoice_paid, опрос getInvoices пачками и просрочка.
+
+Функции только отмечают счета в базе; уведомления пользователям шлет
+bot.py через переданный on_credited(user_id, amount).
+"""
+from config import CRYPTOBOT_BATCH_SIZE
+from database import (get_pending_payments, get_due_payments, credit_paid_payments, expire_payments,
+                      expire_stars_payments)
+from utils import logger, get_cryptobot_invoices
+
+
+def _batches(invoice_ids, batch_size):
+    for start in range(0, len(invoice_ids), batch_size):
+        yield invoice_ids[start:start + batch_size]
+
+
+def _paid(batch, statuses):
+    return [invoice_id for invoice_id in batch if statuses.get(str(invoice_id)) == 'paid']
+
+
+def paid_invoice_ids(raw_updates):
+    """invoice_id из вебхуков invoice_paid; другие типы и битые обновления пропускаются"""
+    paid = []
+    for update in raw_updates:
+        try:
+            if update.get("update_type") != "invoice_paid":
+                continue
+            payload = update["payload"]
+            if payload.get("status") == "paid":
+                paid.append(int(payload["invoice_id"]))
+        except (AttributeError, KeyError, TypeError, ValueError):
+            # Одно битое обновление не должно терять остальные в пачке
+            logger.warning(f"Skipping malformed CryptoBot update: {str(update)[:200]}")
+    return paid
+
+
+def credit_webhook_updates(raw_updates, on_credited=None):
+    """Зачислить оплаченные счета из пачки вебхуков; возвращает число зачисленных.
+
+    Повторная доставка того же вебхука ничего не начислит: credit_paid_payments
+    берет только счета, которые еще не оплачены.
+    """
+    credited = credit_paid_payments(paid_invoice_ids(raw_updates))
+    for invoice_id, user_id, amount in credited:
+        logger.info(f"Webhook payment processed for user {user_id}: {amount} алмазов")
+        if on_credited:
+            on_credited(user_id, amount)
+    return len(credited)
+
+
+def poll_pending_payments(on_credited=None, batch_size=CRYPTOBOT_BATCH_SIZE):
+    """Сверить живые счета с CryptoBot, по одному запросу getInvoices на пачку.
+
+    Если запрос пачки не удался (get_cryptobot_invoices вернул None), ее
+    счета остаются pending до следующего опроса. Возвращает число зачисленных.
+    """
+    credited = 0
+    for batch in _batches(get_pending_payments(), batch_size):
+        statuses = get_cryptobot_invoices(batch)
+        if statuses is None:
+            continue
+        for invoice_id, user_id, amount in credit_paid_payments(_paid(batch, statuses)):
+            logger.info(f"Auto payment processed for user {user_id}: {amount} алмазов")
+            if on_credited:
+                on_credited(user_id, amount)
+            credited += 1
+    return credited
+
+
+def sweep_expired_payments(on_credited=None, batch_size=CRYPTOBOT_BATCH_SIZE):
+    """Закрыть просроченные счета: CryptoBot - после последней сверки с API, Stars - сразу.
+
+    Счет, оплаченный в последний момент, зачисляется, а не закрывается. Пачка,
+    для которой API не ответил, остается pending до следующей проверки.
+    Возвращает {"checked", "expired", "credited", "stars_expired"}.
+    """
+    due = get_due_payments()
+    checked = expired = credited = 0
+    for batch in _batches(due, batch_size):
+        statuses = get_cryptobot_invoices(batch)
+        if statuses is None:
+            continue
+        checked += len(batch)
+        paid = _paid(batch, statuses)
+        for invoice_id, user_id, amount in credit_paid_payments(paid):
+            if on_credited:
+                on_credited(user_id, amount)
+            credited += 1
+        expired += expire_payments([invoice_id for invoice_id in batch if invoice_id not in paid])
+    
+    # Оплата Stars, пришедшая после срока, все равно зачисляется в process_successful_payment
+    stars_expired = expire_stars_payments()
+    
+    if due or stars_expired:
+        logger.info(f"Payment expiry sweep: checked {checked}, expired {expired}, "
+                    f"credited {credited}, stars expired {stars_expired}")
+    return {"checked": checked, "expired": expired, "credited": credited, "stars_expired": stars_expired}
@@ -0,0 +1,154 @@
+import time
+import threading
+
+class Route:
+    """Маршрут колбэка: обработчик, типы параметров, опции мидлварей и метрики"""
+
+    def __init__(self, pattern, handler, params, options):
+        self.pattern = pattern
+        self.handler = handler
+        self.params = params
+        self.options = options
+        self.calls = 0
+        self.errors = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def parse(self, rest):
+        """Разобрать хвост callback_data после префикса в типизированные параметры.
+
+        Хвост делится по "_" на столько частей, сколько объявлено параметров
+        (последний параметр забирает остаток целиком), каждая часть
+        приводится своим типом. Ошибка разбора - ValueError.
+        """
+        if not self.params:
+            if rest:
+                raise ValueError(f"unexpected params {rest!r} for {self.pattern}")
+            return ()
+        parts = rest.split("_", len(self.params) - 1)
+        if len(parts) != len(self.params) or not all(parts):
+            raise ValueError(f"expected {len(self.params)} params for {self.pattern}, got {rest!r}")
+        return tuple(convert(part) for convert, part in zip(self.params, parts))
+
+
+class CallbackRouter:
+    """Маршрутизатор колбэков.
+
+    Точные значения callback_data ищутся в dict, префиксные маршруты - в
+    trie по самому длинному совпадению, поэтому порядок регистрации не важен
+    (bet_sps_ всегда побеждает bet_). Мидлвари (guard) объявляются по имени
+    опции и выполняются для маршрутов, у которых эта опция включена.
+    """
+
+    def __init__(self, **defaults):
+        self.defaults = defaults
+        self._exact = {}
+        self._trie = {}
+        self._routes = []
+        self._guards = []
+        self._lock = threading.Lock()
+        self.fallback = None
+        self.on_bad_params = None
+        self.on_error = None
+
+    def route(self, *keys, prefix=None, params=(), **options):
+        """Зарегистрировать обработчик handler(call, uid, user_data, *params)"""
+        def decorator(handler):
+            pattern = f"{prefix}*" if prefix else "|".join(keys)
+            route = Route(pattern, handler, tuple(params), {**self.defaults, **options})
+            for key in keys:
+                if key in self._exact:
+                    raise ValueError(f"Callback {key} is already routed to {self._exact[key].pattern}")
+                self._exact[key] = route
+            if prefix:
+                node = self._trie
+                for char in prefix:
+                    node = node.setdefault(char, {})
+                if None in node:
+                    raise ValueError(f"Callback prefix {prefix} is already routed")
+                node[None] = route
+            self._routes.append(route)
+            return handler
+        return decorator
+
+    def guard(self, option):
+        """Зарегистрировать мидлварь guard(call, value, context) для опции маршрута.
+
+        guard возвращает False, чтобы остановить обработку; в context можно
+        положить данные для обработчика (например user_data).
+        """
+        def decorator(func):
+            self._guards.append((option, func))
+            return func
+        return decorator
+
+    def resolve(self, data):
+        """Найти маршрут: (route, хвост после префикса) или (None, None)"""
+        route = self._exact.get(data)
+        if route is not None:
+            return route, ""
+        node = self._trie
+        found, length = None, 0
+        for index, char in enumerate(data):
+            node = node.get(char)
+            if node is None:
+                break
+            if None in node:
+                found, length = node[None], index + 1
+        if found is None:
+            return None, None
+        return found, data[length:]
+
+    def dispatch(self, call):
+        route, rest = self.resolve(call.data or "")
+        if route is None:
+            if self.fallback:
+                self.fallback(call)
+            return
+
+        started = time.perf_counter()
+        failed = False
+        try:
+            context = {}
+            for option, guard in self._guards:
+                value = route.options.get(option)
+                if value and guard(call, value, context) is False:
+                    return
+            try:
+                params = route.parse(rest)
+            except ValueError as e:
+                failed = True
+                if self.on_bad_params:
+                    self.on_bad_params(call, e)
+                return
+            route.handler(call, call.from_user.id, context.get("user_data"), *params)
+        except Exception as e:
+            failed = True
+            if self.on_error is None:
+                raise
+            self.on_error(call, e)
+        finally:
+            self._record(route, time.perf_counter() - started, failed)
+
+    def _record(self, route, elapsed, failed):
+        with self._lock:
+            route.calls += 1
+            route.errors += failed
+            route.total_time += elapsed
+            route.max_time = max(route.max_time, elapsed)
+
+    def stats(self):
+        """Метрики по маршрутам, самые затратные первыми"""
+        with self._lock:
+            rows = [
+                {
+                    "route": route.pattern,
+                    "calls": route.calls,
+                    "errors": route.errors,
+                    "avg_ms": route.total_time / route.calls * 1000 if route.calls else 0.0,
+                    "max_ms": route.max_time * 1000,
+                    "total_ms": route.total_time * 1000,
+                }
+                for route in self._routes
+            ]
+        return sorted(rows, key=lambda row: row["total_ms"], reverse=True)
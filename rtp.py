@@ -0,0 +1,200 @@
+import argparse
+import itertools
+import time
+import numpy as np
+from config import ROULETTE_WIN_CHANCE, MIN_BET
+from games import Roulette, Dice, StonePaperScissors, SlotMachine, BlackJack
+from models import CASES, FREE_CASE, CASE_SAFE_CHANCE
+
+# Раунды считаются порциями, чтобы 10^8 раундов не занимали гигабайты памяти
+CHUNK_SIZE = 1_000_000
+HISTOGRAM_BINS = 10
+
+class TableGame:
+    """Игра с конечным набором исходов: [(вероятность, выплата)].
+
+    Исходы и выплаты строятся теми же функциями payout, что и в игре,
+    поэтому округления (int(bet * 1.1)) учитываются как в боте.
+    """
+
+    def __init__(self, stake, outcomes):
+        self.stake = stake
+        probabilities = np.array([p for p, _ in outcomes], dtype=np.float64)
+        self.payouts = np.array([payout for _, payout in outcomes], dtype=np.int64)
+        self.cdf = np.cumsum(probabilities) / probabilities.sum()
+        self.expected = float(probabilities @ self.payouts / probabilities.sum())
+
+    def sample(self, rng, n):
+        return self.payouts[np.searchsorted(self.cdf, rng.random(n), side="right")]
+
+
+class CaseGame:
+    """Сундук: CASE_SAFE_CHANCE - награда из безопасного диапазона, иначе из верхнего"""
+
+    def __init__(self, case):
+        self.case = case
+        self.stake = case.price
+        self.expected = (CASE_SAFE_CHANCE * (case.min_reward + case.safe_range) / 2
+                         + (1 - CASE_SAFE_CHANCE) * (case.safe_range + 1 + case.max_reward) / 2)
+
+    def sample(self, rng, n):
+        safe = rng.random(n) < CASE_SAFE_CHANCE
+        low = rng.integers(self.case.min_reward, self.case.safe_range + 1, n)
+        high = rng.integers(self.case.safe_range + 1, self.case.max_reward + 1, n)
+        return np.where(safe, low, high)
+
+
+class BlackJackGame:
+    """Векторная копия BlackJack.play: добор игрока, дилер до DEALER_STAND и подкрутки"""
+
+    # Дилер берет карты, пока сумма меньше DEALER_STAND; хуже всего - одни единицы
+    DEALER_MAX_CARDS = BlackJack.DEALER_STAND
+
+    def __init__(self, bet):
+        self.stake = bet
+        self.expected = None
+
+    def _cards(self, rng, shape):
+        return rng.integers(BlackJack.CARD_MIN, BlackJack.CARD_MAX + 1, shape, dtype=np.int16)
+
+    def sample(self, rng, n):
+        player = self._cards(rng, (n, 3))
+        player_sum = player[:, 0] + player[:, 1]
+        hit = (player_sum <= BlackJack.PLAYER_HIT_LIMIT) & (rng.random(n) < BlackJack.PLAYER_HIT_CHANCE)
+        player_sum = player_sum + np.where(hit, player[:, 2], 0)
+
+        dealer = np.cumsum(self._cards(rng, (n, self.DEALER_MAX_CARDS)), axis=1)
+        # Сумма дилера - первая накопленная сумма от двух карт, дошедшая до DEALER_STAND
+        stand = np.argmax(dealer[:, 1:] >= BlackJack.DEALER_STAND, axis=1) + 1
+        dealer_sum = dealer[np.arange(n), stand]
+
+        chance = rng.random(n)
+        player_bust = player_sum > 21
+        dealer_bust = ~player_bust & (dealer_sum > 21)
+        higher = ~player_bust & ~dealer_bust & (player_sum > dealer_sum)
+        tie = ~player_bust & ~dealer_bust & (player_sum == dealer_sum)
+        win = dealer_bust | (higher & (chance >= BlackJack.DEALER_STEAL_CHANCE))
+        push = tie & (chance >= BlackJack.TIE_LOSS_CHANCE)
+        return np.where(win, self.stake * 2, np.where(push, self.stake, 0)).astype(np.int64)
+
+
+def build_games(bet):
+    """Все игры с их ставкой: имя -> модель игры"""
+    slot_total = sum(SlotMachine.WEIGHTS.values())
+    games = {
+        "roulette": TableGame(bet, [
+            (ROULETTE_WIN_CHANCE, Roulette.payout(bet, True)[1]),
+            (1 - ROULETTE_WIN_CHANCE, Roulette.payout(bet, False)[1]),
+        ]),
+        "dice": TableGame(bet, [(1 / 6, Dice.payout(bet, roll)[1]) for roll in range(1, 7)]),
+        # Игрок выбирает жест равновероятно, бот - по весам StonePaperScissors.WEIGHTS
+        "sps": TableGame(bet, [
+            (weight / 3, StonePaperScissors.payout(bet, choice, bot_choice)[1])
+            for choice in StonePaperScissors.CHOICES
+            for bot_choice, weight in zip(StonePaperScissors.CHOICES, StonePaperScissors.WEIGHTS)
+        ]),
+        "slot": TableGame(bet, [
+            (np.prod([SlotMachine.WEIGHTS[symbol] for symbol in reels]) / slot_total ** 3,
+             SlotMachine.payout(bet, list(reels))[1])
+            for reels in itertools.product(SlotMachine.WEIGHTS, repeat=3)
+        ]),
+        # Нативный 🎰 из send_dice: 64 равновероятных значения
+        "slot_dice": TableGame(bet, [(1 / 64, SlotMachine.from_dice_value(bet, value)[1]) for value in range(1, 65)]),
+        "blackjack": BlackJackGame(bet),
+    }
+    for key, case in CASES.items():
+        games[f"case_{key}"] = CaseGame(case)
+    games["free_case"] = CaseGame(FREE_CASE)
+    return games
+
+def simulate(game, rounds, rng, chunk_size=CHUNK_SIZE):
+    """Сыграть rounds раундов; возвращает число раундов по каждой выплате (индекс = выплата)"""
+    counts = np.zeros(1, dtype=np.int64)
+    done = 0
+    while done < rounds:
+        n = min(chunk_size, rounds - done)
+        chunk = np.bincount(game.sample(rng, n))
+        if len(chunk) > len(counts):
+            counts = np.pad(counts, (0, len(chunk) - len(counts)))
+        counts[:len(chunk)] += chunk
+        done += n
+    return counts
+
+def summarize(counts, stake, bins=HISTOGRAM_BINS):
+    """RTP, дисперсия на единицу ставки, частота выплат и гистограмма по распределению выплат"""
+    rounds = int(counts.sum())
+    values = np.arange(len(counts), dtype=np.float64)
+    mean = float(values @ counts) / rounds
+    variance = float(values ** 2 @ counts) / rounds - mean ** 2
+    result = {
+        "rounds": rounds,
+        "stake": stake,
+        "mean_payout": mean,
+        "hit_rate": float(counts[1:].sum()) / rounds,
+        "win_rate": float(counts[stake + 1:].sum()) / rounds,
+        "rtp": None,
+        "variance": None,
+        "ci95": None,
+        "histogram": _histogram(counts, rounds, bins),
+    }
+    # У бесплатного сундука нет ставки: для него считается только средняя награда
+    if stake:
+        result["rtp"] = mean / stake
+        result["variance"] = variance / stake ** 2
+        result["ci95"] = 1.96 * (result["variance"] / rounds) ** 0.5
+    return result
+
+def _histogram(counts, rounds, bins):
+    """[(от, до, доля)]: каждая выплата отдельно, если их не больше bins, иначе равные интервалы"""
+    paid = np.flatnonzero(counts)
+    if len(paid) <= bins:
+        return [(int(value), int(value), counts[value] / rounds) for value in paid]
+    edges = np.unique(np.linspace(paid[0], paid[-1] + 1, bins + 1).astype(np.int64))
+    return [(int(low), int(high) - 1, counts[low:high].sum() / rounds) for low, high in zip(edges, edges[1:])]
+
+def run(rounds, bet=100, seed=None, names=None):
+    """Просчитать игры; возвращает [(имя, сводка, теоретическая выплата, секунды)]"""
+    bet = max(bet, MIN_BET)
+    rng = np.random.default_rng(seed)
+    results = []
+    for name, game in build_games(bet).items():
+        if names and name not in names:
+            continue
+        started = time.perf_counter()
+        summary = summarize(simulate(game, rounds, rng), game.stake)
+        results.append((name, summary, game.expected, time.perf_counter() - started))
+    return results
+
+def format_report(results, histograms=False):
+    """Текстовая таблица по результатам run()"""
+    lines = [f"{'игра':<11} {'RTP':>7} {'±95%':>6} {'теор.':>7} {'дисп.':>7} {'выпл.':>6} {'выигр.':>6}"]
+    for name, summary, expected, _ in results:
+        stake = summary["stake"]
+        if summary["rtp"] is None:
+            lines.append(f"{name:<11} средняя награда {summary['mean_payout']:.2f}"
+                         f"{f' (теор. {expected:.2f})' if expected is not None else ''}")
+        else:
+            theory = f"{expected / stake:>7.2%}" if expected is not None else f"{'-':>7}"
+            lines.append(
+                f"{name:<11} {summary['rtp']:>7.2%} {summary['ci95']:>6.2%} {theory} "
+                f"{summary['variance']:>7.2f} {summary['hit_rate']:>6.1%} {summary['win_rate']:>6.1%}"
+            )
+        if histograms:
+            for low, high, share in summary["histogram"]:
+                label = f"{low}" if low == high else f"{low}-{high}"
+                lines.append(f"    {label:>9}: {share:>7.3%} {'#' * round(share * 40)}")
+    return "\n".join(lines)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Монте-Карло отдачи игр и сундуков (RTP, дисперсия, частота выплат)")
+    parser.add_argument("--rounds", type=int, default=10_000_000, help="раундов на каждую игру")
+    parser.add_argument("--bet", type=int, default=100, help="ставка для игр (у сундуков - их цена)")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--game", action="append", dest="games", help="только эти игры (можно несколько раз)")
+    parser.add_argument("--histogram", action="store_true", help="показать распределение выплат")
+    args = parser.parse_args()
+    started = time.perf_counter()
+    results = run(args.rounds, args.bet, args.seed, args.games)
+    print(format_report(results, args.histogram))
+    print(f"\n{args.rounds:,} раундов на игру, ставка {max(args.bet, MIN_BET)}, {time.perf_counter() - started:.1f} с")
@@ -0,0 +1,8 @@
+import os
+import sys
+import tempfile
+
+# Модули бота лежат в корне репозитория; database.py открывает DB_PATH при импорте,
+# поэтому тесты работают со временной базой
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ["DB_PATH"] = os.path.join(tempfile.mkdtemp(prefix="darkcase-tests-"), "casino.db")
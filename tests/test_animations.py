@@ -0,0 +1,87 @@
+"""Планировщик анимаций: пропуск отставших кадров, финальный кадр и счетчики"""
+import threading
+import time
+from animations import AnimationScheduler
+
+
+class FakeBot:
+    """Правки и отправки пишутся в журнал; каждая правка занимает edit_delay секунд"""
+
+    def __init__(self, edit_delay=0.0):
+        self.edit_delay = edit_delay
+        self.lock = threading.Lock()
+        self.edits = []
+        self.sent = []
+
+    def edit_message_text(self, text, chat_id, message_id, reply_markup=None, parse_mode=None):
+        time.sleep(self.edit_delay)
+        with self.lock:
+            self.edits.append((chat_id, message_id, text))
+
+    def send_message(self, chat_id, text, reply_markup=None, parse_mode=None):
+        with self.lock:
+            self.sent.append((chat_id, text))
+
+    def texts(self, chat_id, message_id):
+        with self.lock:
+            return [text for c, m, text in self.edits if (c, m) == (chat_id, message_id)]
+
+
+def _wait(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "animation did not finish"
+        time.sleep(0.01)
+
+
+def _frames(count, delay):
+    return [(f"frame{i}", delay) for i in range(count)]
+
+
+def test_slow_edits_coalesce_frames():
+    bot = FakeBot(edit_delay=0.05)
+    scheduler = AnimationScheduler(bot, workers=2)
+    scheduler.play(1, 10, _frames(20, 0.01), "result", pause=0.02)
+    _wait(lambda: "result" in bot.texts(1, 10))
+    texts = bot.texts(1, 10)
+    assert texts[-1] == "result"
+    shown = [int(text[5:]) for text in texts[:-1]]
+    # Кадры идут по порядку, отставшие пропускаются, финал доставлен
+    assert shown == sorted(shown) and len(shown) < 20
+    stats = scheduler.stats()
+    assert stats["frames_sent"] == len(shown)
+    assert stats["frames_sent"] + stats["frames_skipped"] == 20
+    assert stats["active"] == 0
+
+
+def test_new_animation_replaces_old_one():
+    bot = FakeBot()
+    scheduler = AnimationScheduler(bot)
+    scheduler.play(1, 10, _frames(5, 0.05), "old result")
+    scheduler.play(1, 10, _frames(2, 0.01), "new result")
+    _wait(lambda: "new result" in bot.texts(1, 10))
+    time.sleep(0.3)
+    assert "old result" not in bot.texts(1, 10)
+
+
+def test_result_without_message_is_sent_after_pause():
+    bot = FakeBot()
+    scheduler = AnimationScheduler(bot)
+    started = time.monotonic()
+    scheduler.play(5, None, [], "dice result", pause=0.1)
+    _wait(lambda: bot.sent)
+    assert time.monotonic() - started >= 0.1
+    assert bot.sent == [(5, "dice result")]
+    assert bot.edits == []
+
+
+def test_counters_add_up_across_workers():
+    bot = FakeBot(edit_delay=0.002)
+    scheduler = AnimationScheduler(bot, workers=8)
+    messages = 40
+    for message_id in range(messages):
+        scheduler.play(message_id % 4, message_id, _frames(10, 0.003), f"result{message_id}")
+    _wait(lambda: sum(text.startswith("result") for _, _, text in list(bot.edits)) == messages, timeout=20)
+    stats = scheduler.stats()
+    assert stats["frames_sent"] + stats["frames_skipped"] == messages * 10
+    assert stats["frames_sent"] == len(bot.edits) - messages
@@ -0,0 +1,47 @@
+"""Расчет ставок: settle_bet и ставка, списанная до нативного броска"""
+import pytest
+import database
+
+
+@pytest.fixture
+def player():
+    uid = 7_200_001
+    database.create_user(uid, "player")
+    database.update_balance(uid, 100 - database.get_user(uid)[2], "test")
+    yield uid
+    with database.transaction():
+        database.cursor.execute("DELETE FROM transactions WHERE user_id=?", (uid,))
+        database.cursor.execute("DELETE FROM users WHERE user_id=?", (uid,))
+    database.user_cache.invalidate(uid)
+
+
+def _balance(uid):
+    return database.get_user(uid)[2]
+
+
+def test_reserved_bet_settles_like_a_regular_one(player):
+    assert database.settle_bet(player, "dice", 30, 60) == 130
+    assert database.reserve_stake(player, 30)
+    assert _balance(player) == 100
+    assert database.settle_bet(player, "dice", 30, 60, reserved=True) == 160
+    database.cursor.execute("SELECT type, amount FROM transactions WHERE user_id=? AND type LIKE 'dice_%'", (player,))
+    assert database.cursor.fetchall() == [("dice_win", 30), ("dice_win", 30)]
+
+
+def test_lost_reserved_bet_keeps_the_stake(player):
+    assert database.reserve_stake(player, 100)
+    # Списанная ставка не требует алмазов на балансе при расчете
+    assert database.settle_bet(player, "slot", 100, 0, reserved=True) == 0
+
+
+def test_reserve_needs_the_stake_on_balance(player):
+    assert not database.reserve_stake(player, 101)
+    assert _balance(player) == 100
+    assert database.reserve_stake(player, 100)
+    assert not database.reserve_stake(player, 1)
+
+
+def test_release_returns_the_stake(player):
+    assert database.reserve_stake(player, 40)
+    database.release_stake(player, 40)
+    assert _balance(player) == 100
@@ -0,0 +1,51 @@
+"""Заблокировавшие бота: /start снимает отметку без записи в БД, если ее нет"""
+import pytest
+import database
+
+UID = 7_500_001
+
+
+@pytest.fixture
+def broadcast():
+    database.create_user(UID, "blocker")
+    broadcast_id = database.create_broadcast(1, "hello", 1, 1)
+    yield broadcast_id
+    with database.transaction():
+        database.cursor.execute("DELETE FROM broadcasts WHERE id=?", (broadcast_id,))
+        database.cursor.execute("DELETE FROM bot_blocked WHERE user_id=?", (UID,))
+        database.cursor.execute("DELETE FROM users WHERE user_id=?", (UID,))
+    database.load_access_lists()
+
+
+@pytest.fixture
+def transactions(monkeypatch):
+    """Сколько раз открывалась транзакция"""
+    opened = []
+    transaction = database.transaction
+
+    def counting():
+        opened.append(1)
+        return transaction()
+    monkeypatch.setattr(database, "transaction", counting)
+    return opened
+
+
+def test_start_without_block_does_not_write(broadcast, transactions):
+    assert database.clear_bot_blocked(UID) is False
+    assert transactions == []
+
+
+def test_blocked_user_is_cleared_once(broadcast, transactions):
+    database.save_broadcast_progress(broadcast, UID, 0, 0, [UID])
+    assert UID not in database.get_broadcast_recipients(UID - 1, 1)
+    assert database.clear_bot_blocked(UID) is True
+    assert database.clear_bot_blocked(UID) is False
+    assert len(transactions) == 2  # запись прогресса и одно удаление
+    assert database.get_broadcast_recipients(UID - 1, 1) == [UID]
+
+
+def test_blocked_set_is_loaded_from_db(broadcast):
+    database.save_broadcast_progress(broadcast, UID, 0, 0, [UID])
+    database._bot_blocked_ids.clear()
+    database.load_access_lists()
+    assert database.clear_bot_blocked(UID) is True
@@ -0,0 +1,142 @@
+"""Соединения по потокам: 8 воркеров читают и пишут одновременно.
+
+Последний тест - замер: callbacks/s с соединением на поток и с одним общим
+соединением под блокировкой, как было до них (pytest -s покажет числа).
+"""
+import random
+import sqlite3
+import threading
+import time
+from types import SimpleNamespace
+import pytest
+import database
+
+WORKERS = 8
+CALLBACKS = 300
+USERS = [7_500_001 + i for i in range(20)]
+
+
+@pytest.fixture
+def users():
+    for uid in USERS:
+        database.create_user(uid, f"worker{uid}")
+    yield USERS
+    with database.transaction():
+        database.cursor.executemany("DELETE FROM users WHERE user_id=?", [(uid,) for uid in USERS])
+        database.cursor.executemany("DELETE FROM user_levels WHERE user_id=?", [(uid,) for uid in USERS])
+    database.user_cache.invalidate(*USERS)
+
+
+def _balances():
+    database.cursor.execute(f"SELECT SUM(balance) FROM users WHERE user_id IN ({','.join('?' * len(USERS))})", USERS)
+    return database.cursor.fetchone()[0]
+
+
+def _callback(rng):
+    """Типичный хендлер: прочитать пользователя из базы, затем иногда изменить баланс"""
+    uid = rng.choice(USERS)
+    assert database._select_user(uid)[0] == uid
+    if rng.random() < 0.3:
+        database.update_balance(uid, 1)
+        return 1
+    return 0
+
+
+def _run_workers(serialize=None):
+    """WORKERS потоков по CALLBACKS вызовов: (начислено, ошибки, секунд)"""
+    credited, errors = [], []
+
+    def worker(seed):
+        rng, total = random.Random(seed), 0
+        try:
+            for _ in range(CALLBACKS):
+                if serialize:
+                    with serialize:
+                        total += _callback(rng)
+                else:
+                    total += _callback(rng)
+        except Exception as e:
+            errors.append(e)
+        finally:
+            credited.append(total)
+            if not serialize:
+                database.close_connection()
+
+    threads = [threading.Thread(target=worker, args=(seed,)) for seed in range(WORKERS)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(60)
+    return sum(credited), errors, time.perf_counter() - started
+
+
+def test_each_thread_gets_its_own_connection():
+    connections = []
+
+    def worker():
+        connections.append((database.get_connection(), database.get_cursor()))
+        assert database.get_connection().execute("PRAGMA journal_mode").fetchone()[0] == "wal"
+        database.close_connection()
+
+    threads = [threading.Thread(target=worker) for _ in range(WORKERS)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert len({id(connection) for connection, _ in connections}) == WORKERS
+    assert len({id(cursor) for _, cursor in connections}) == WORKERS
+
+
+def test_reader_is_not_blocked_by_open_write(users):
+    uid = users[0]
+    balance = database._select_user(uid)[2]
+    writing, done = threading.Event(), threading.Event()
+
+    def writer():
+        with database.transaction():
+            database.cursor.execute("UPDATE users SET balance=balance+100 WHERE user_id=?", (uid,))
+            writing.set()
+            done.wait(5)
+        database.close_connection()
+
+    thread = threading.Thread(target=writer)
+    thread.start()
+    try:
+        assert writing.wait(5)
+        # WAL: читатель не ждет COMMIT и видит последнее зафиксированное состояние
+        started = time.perf_counter()
+        assert database._select_user(uid)[2] == balance
+        assert time.perf_counter() - started < 1
+    finally:
+        done.set()
+        thread.join(10)
+    assert database._select_user(uid)[2] == balance + 100
+    database.user_cache.invalidate(uid)
+
+
+def test_concurrent_workers_throughput(users):
+    before = _balances()
+    credited, errors, elapsed = _run_workers()
+    assert not errors, errors[:3]
+    assert _balances() == before + credited
+    per_thread = WORKERS * CALLBACKS / elapsed
+
+    # Как до соединений по потокам: одно соединение на всех, хендлеры идут по одному
+    shared = sqlite3.connect(database.DB_PATH, timeout=database.DB_BUSY_TIMEOUT,
+                             isolation_level=None, check_same_thread=False)
+    database._apply_storage_profile(shared)
+    original = database._local
+    database._local = SimpleNamespace(conn=shared, cursor=shared.cursor())
+    try:
+        before = _balances()
+        credited, errors, elapsed = _run_workers(serialize=threading.Lock())
+        assert not errors, errors[:3]
+        assert _balances() == before + credited
+    finally:
+        database._local = original
+        shared.close()
+    single = WORKERS * CALLBACKS / elapsed
+
+    print(f"\n{WORKERS} workers: {per_thread:.0f} callbacks/s per-thread connections, "
+          f"{single:.0f} callbacks/s shared connection")
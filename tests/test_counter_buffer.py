@@ -0,0 +1,92 @@
+"""Отложенные счетчики: чтение во время flush видит каждую дельту ровно один раз"""
+import threading
+import pytest
+import database
+
+
+@pytest.fixture
+def user(monkeypatch):
+    uid = 7_300_001
+    database.create_user(uid, "counter")
+    # Фоновый поток запущен (дельты копятся), но сам не сбрасывает их во время теста
+    monkeypatch.setattr(database.counter_buffer, "interval", 60)
+    database.counter_buffer.start()
+    yield uid
+    database.counter_buffer.stop()
+    with database.transaction():
+        database.cursor.execute("DELETE FROM users WHERE user_id=?", (uid,))
+    database.user_cache.invalidate(uid)
+
+
+def test_read_racing_flush_counts_delta_once(user, monkeypatch):
+    """Чтение начинается без ожидающих дельт, а заканчивается между COMMIT flush и очисткой буфера"""
+    wins = database.get_user(user)[8]
+    database.user_cache.invalidate(user)
+    reading, go = threading.Event(), threading.Event()
+    seen = []
+
+    select_user = database._select_user
+
+    def paused_select(uid):
+        reading.set()
+        go.wait(1)
+        return select_user(uid)
+    monkeypatch.setattr(database, "_select_user", paused_select)
+
+    invalidate = database.user_cache.invalidate
+
+    def invalidate_after_reader(*uids):
+        # flush уже закоммитил дельту, но еще не очистил буфер
+        go.set()
+        reader.join(1)
+        invalidate(*uids)
+    monkeypatch.setattr(database.user_cache, "invalidate", invalidate_after_reader)
+
+    reader = threading.Thread(target=lambda: seen.append(database.get_user(user)[8]))
+    reader.start()
+    assert reading.wait(5)
+    database.counter_buffer.add_user(user, wins=1)
+    flusher = threading.Thread(target=database.counter_buffer.flush)
+    flusher.start()
+    flusher.join(10)
+    reader.join(10)
+
+    assert seen and seen[0] in (wins, wins + 1)
+    monkeypatch.undo()
+    assert database.get_user(user)[8] == wins + 1
+
+
+def test_concurrent_flush_and_read(user):
+    wins = database.get_user(user)[8]
+    started = [0]  # дельт добавлено или добавляется
+    finished = [0]  # дельт добавлено
+    done = threading.Event()
+    errors = []
+
+    def writer():
+        for _ in range(5000):
+            started[0] += 1
+            database.counter_buffer.add_user(user, wins=1)
+            finished[0] += 1
+        done.set()
+
+    def flusher():
+        while not done.is_set():
+            database.counter_buffer.flush()
+
+    def reader():
+        while not done.is_set():
+            low = finished[0]
+            seen = database.get_user(user)[8] - wins
+            high = started[0]
+            if not low <= seen <= high:
+                errors.append((low, seen, high))
+
+    threads = [threading.Thread(target=target) for target in (writer, flusher, reader, reader)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(30)
+    assert not errors, errors[:5]
+    database.counter_buffer.flush()
+    assert database.get_user(user)[8] == wins + 5000
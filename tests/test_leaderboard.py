@@ -0,0 +1,118 @@
+"""Лидерборды: RankIndex против отсортированного списка и сверка с SQL-топами"""
+import bisect
+import random
+import pytest
+import database
+from leaderboard import RankIndex, Leaderboard
+
+UIDS = [7_400_000 + i for i in range(1, 13)]
+
+
+def _check_index(index, oracle, rng):
+    assert len(index) == len(oracle)
+    assert index.slice(0, len(oracle)) == oracle
+    for _ in range(5):
+        start = rng.randrange(len(oracle) + 2)
+        stop = start + rng.randrange(12)
+        assert index.slice(start, stop) == oracle[start:stop]
+    for probe in rng.sample(oracle, min(len(oracle), 5)) + [rng.randrange(-50, 1050) for _ in range(3)]:
+        assert index.index(probe) == bisect.bisect_left(oracle, probe)
+
+
+@pytest.mark.parametrize("load", [1, 2, 4, 16])
+@pytest.mark.parametrize("seed", range(5))
+def test_rank_index_matches_sorted_list(load, seed):
+    """Вставки, удаления и обновления с маленькими корзинами: корзины делятся и пустеют"""
+    rng = random.Random(seed)
+    index, oracle = RankIndex(load=load), []
+    if seed % 2:
+        # Часть прогонов начинается с load_sorted
+        oracle = sorted(rng.sample(range(1000), 40))
+        index.load_sorted(oracle)
+    for step in range(1500):
+        op = rng.random()
+        if op < 0.45 or not oracle:
+            item = rng.randrange(1000)
+            if item in oracle:
+                continue
+            index.add(item)
+            bisect.insort(oracle, item)
+        elif op < 0.75:
+            item = rng.choice(oracle)
+            index.remove(item)
+            oracle.remove(item)
+        else:
+            # Обновление значения - удаление и вставка, как в Leaderboard._replace
+            old, new = rng.choice(oracle), rng.randrange(1000)
+            if new in oracle:
+                continue
+            index.remove(old)
+            oracle.remove(old)
+            index.add(new)
+            bisect.insort(oracle, new)
+        if step % 50 == 0:
+            _check_index(index, oracle, rng)
+    _check_index(index, oracle, rng)
+    # Опустошение до нуля и повторное заполнение
+    for item in rng.sample(oracle, len(oracle)):
+        index.remove(item)
+    assert len(index) == 0 and index.slice(0, 10) == [] and index.index(5) == 0
+    for item in (3, 1, 2):
+        index.add(item)
+    assert index.slice(0, 3) == [1, 2, 3]
+
+
+def test_leaderboard_ranks_match_sorted_values():
+    """Leaderboard с равными значениями: места и топ совпадают с сортировкой (-значение, uid)"""
+    rng = random.Random(11)
+    board = Leaderboard("test")
+    board._index = RankIndex(load=3)
+    values = {}
+    for uid in range(200):
+        name = None if uid % 17 == 0 else f"user{uid}"
+        values[uid] = rng.randrange(20)
+        board.register(uid, name, (values[uid],))
+    for _ in range(2000):
+        uid = rng.randrange(200)
+        delta = rng.randrange(-5, 6)
+        board.add(uid, delta)
+        values[uid] += delta
+    ranked = sorted((uid for uid in values if uid % 17), key=lambda uid: (-values[uid], uid))
+    assert board.top(len(ranked) + 5) == [(f"user{uid}", values[uid]) for uid in ranked]
+    for position, uid in enumerate(ranked, 1):
+        assert board.rank(uid) == position
+    assert board.rank(0) is None
+    rank, rows = board.around(ranked[50], radius=2)
+    assert rank == 51
+    assert [row[0] for row in rows] == [49, 50, 51, 52, 53]
+
+
+@pytest.fixture
+def tied_users():
+    shuffled = UIDS[:]
+    random.Random(5).shuffle(shuffled)
+    for uid in shuffled:
+        database.create_user(uid, f"tied{uid}")
+        database.update_balance(uid, 10 ** 9, "test")
+    yield shuffled
+    with database.transaction():
+        for uid in UIDS:
+            for table in ("transactions", "user_levels", "weekly_quests", "user_activity", "users"):
+                database.cursor.execute(f"DELETE FROM {table} WHERE user_id=?", (uid,))
+    database.user_cache.invalidate(*UIDS)
+    database.rebuild_leaderboards()
+
+
+def test_ties_are_ordered_by_user_id(tied_users):
+    database.rebuild_leaderboards()
+    assert database.check_leaderboards() == []
+    assert [name for name, _ in database.leaderboards.top("balance", 10)] == [f"tied{uid}" for uid in UIDS[:10]]
+
+
+def test_incremental_updates_match_sql(tied_users):
+    database.rebuild_leaderboards()
+    # Часть игроков выбивается из ничьей, остальные остаются равными
+    database.update_balance(UIDS[7], 5, "test")
+    database.update_balance(UIDS[2], -5, "test")
+    database.settle_bet(UIDS[9], "dice", 10, 20)
+    assert database.check_leaderboards(limit=12) == []
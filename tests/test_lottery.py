@@ -0,0 +1,119 @@
+"""Розыгрыши: пропущенные даты, повторное проведение и даты окончания старых розыгрышей"""
+import threading
+import pytest
+import database
+
+# Даты в прошлом, которых нет в других тестах
+DRAW_DATES = ["2001-01-07", "2001-01-14", "2001-01-21"]
+NEXT_DRAW = "2001-01-28"
+
+
+def _balance(uid):
+    return database.get_user(uid)[2]
+
+
+def _history(lottery_id, draw_date):
+    database.cursor.execute("SELECT winner_id, prize FROM lottery_history WHERE lottery_id=? AND draw_date=?",
+                            (lottery_id, draw_date))
+    return database.cursor.fetchall()
+
+
+@pytest.fixture
+def players():
+    uids = [7_400_001, 7_400_002]
+    for uid in uids:
+        database.create_user(uid, f"player{uid}")
+    yield uids
+    with database.transaction():
+        for table in ("lottery_tickets", "lottery_history", "lottery_draws"):
+            database.cursor.execute(f"DELETE FROM {table} WHERE draw_date BETWEEN ? AND ?", (DRAW_DATES[0], NEXT_DRAW))
+        database.cursor.execute("DELETE FROM custom_lottery_tickets WHERE user_id IN (?, ?)", uids)
+        database.cursor.execute("DELETE FROM lottery_history WHERE winner_id IN (?, ?)", uids)
+        database.cursor.execute("DELETE FROM transactions WHERE user_id IN (?, ?)", uids)
+        database.cursor.execute("DELETE FROM users WHERE user_id IN (?, ?)", uids)
+    database.user_cache.invalidate(*uids)
+
+
+def test_missed_draws_are_caught_up_in_order(players):
+    first, second = players
+    for draw_date in DRAW_DATES + [NEXT_DRAW]:
+        database.buy_lottery_tickets(first, draw_date, 2)
+        database.buy_lottery_tickets(second, draw_date, 3)
+    # Бот не работал три недели: наступившие розыгрыши идут по порядку, будущий ждет
+    assert database.get_due_lottery_draws(DRAW_DATES[-1]) == DRAW_DATES
+    assert database.settle_lottery_draw(DRAW_DATES[0], 4, 100)[0] == second
+    assert database.get_due_lottery_draws(DRAW_DATES[-1]) == DRAW_DATES[1:]
+    for draw_date in DRAW_DATES[1:]:
+        assert database.settle_lottery_draw(draw_date, 1, 100)[0] == first
+    assert database.get_due_lottery_draws(DRAW_DATES[-1]) == []
+    assert database.get_due_lottery_draws(NEXT_DRAW) == [NEXT_DRAW]
+
+
+def test_draw_is_settled_once(players):
+    first, second = players
+    draw_date = DRAW_DATES[0]
+    database.buy_lottery_tickets(first, draw_date, 2)
+    database.buy_lottery_tickets(second, draw_date, 3)
+    before = _balance(second)
+    results = []
+    # Два процесса джобы проводят один розыгрыш одновременно
+    threads = [threading.Thread(target=lambda: results.append(database.settle_lottery_draw(draw_date, 5, 100)))
+               for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    assert sorted(results, key=bool) == [None, (second, f"player{second}", 5)]
+    assert database.settle_lottery_draw(draw_date, 1, 100) is None
+    assert _history(0, draw_date) == [(second, 100)]
+    assert _balance(second) == before + 100
+    assert database.get_due_lottery_draws(draw_date) == []
+
+
+def test_unissued_number_pays_nothing(players):
+    database.buy_lottery_tickets(players[0], DRAW_DATES[0], 2)
+    assert database.settle_lottery_draw(DRAW_DATES[0], 3, 100) is None
+    assert _history(0, DRAW_DATES[0]) == []
+
+
+def test_custom_lottery_is_settled_once(players):
+    first, second = players
+    lottery_id = database.create_custom_lottery("test", 500, 0, DRAW_DATES[0], first)
+    database.buy_custom_lottery_ticket(lottery_id, first, 1)
+    database.buy_custom_lottery_ticket(lottery_id, second, 4)
+    before = _balance(second)
+    assert lottery_id in [row[0] for row in database.get_due_custom_lotteries(DRAW_DATES[0])]
+    assert database.settle_custom_lottery(lottery_id, 3) == (second, f"player{second}", 3, 500)
+    assert database.settle_custom_lottery(lottery_id, 3) is None
+    assert lottery_id not in [row[0] for row in database.get_due_custom_lotteries(DRAW_DATES[0])]
+    assert _history(lottery_id, DRAW_DATES[0]) == [(second, 500)]
+    assert _balance(second) == before + 500
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2001-01-05", "2001-01-05"),
+    ("2001-1-5", "2001-01-05"),
+    ("5.1.2001", "2001-01-05"),
+    ("05.01.2001", "2001-01-05"),
+    (" 05/01/2001 ", "2001-01-05"),
+    ("2001-01-05 18:00", "2001-01-05"),
+    ("в воскресенье", None),
+])
+def test_normalize_end_date(value, expected):
+    assert database.normalize_end_date(value) == expected
+
+
+def test_migration_normalizes_legacy_end_dates():
+    ids = [database.create_custom_lottery("legacy", 10, 1, end_date, 0)
+           for end_date in ("31.12.2001", "2001-2-3", "2001-12-30", "скоро")]
+    try:
+        # Строкой "2001-2-3" > "2001-06-01": до миграции наступивший розыгрыш не проводится
+        assert [row[0] for row in database.get_due_custom_lotteries("2001-06-01") if row[0] in ids] == []
+        with database.transaction():
+            database._normalize_lottery_end_dates()
+        database.cursor.execute(f"SELECT end_date FROM active_lotteries WHERE id IN ({','.join('?' * len(ids))}) ORDER BY id", ids)
+        assert [row[0] for row in database.cursor.fetchall()] == ["2001-12-31", "2001-02-03", "2001-12-30", "скоро"]
+        assert [row[0] for row in database.get_due_custom_lotteries("2001-06-01") if row[0] in ids] == [ids[1]]
+    finally:
+        with database.transaction():
+            database.cursor.execute(f"DELETE FROM active_lotteries WHERE id IN ({','.join('?' * len(ids))})", ids)
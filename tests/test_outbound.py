@@ -0,0 +1,130 @@
+"""Очередь исходящих запросов: порядок внутри чата, приоритеты между чатами, 429"""
+import threading
+import pytest
+from outbound import (OutboundQueue, priority, PRIORITY_PAYMENT, PRIORITY_INTERACTIVE,
+                      PRIORITY_ANIMATION, PRIORITY_BULK)
+
+
+class TooManyRequests(Exception):
+    error_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Too Many Requests")
+        self.result_json = {"parameters": {"retry_after": retry_after}}
+
+
+class Recorder:
+    """Вызов для очереди: пишет метку в журнал"""
+
+    def __init__(self):
+        self.log = []
+        self.lock = threading.Lock()
+
+    def call(self, label):
+        with self.lock:
+            self.log.append(label)
+        return label
+
+
+@pytest.fixture
+def queue():
+    # Лимиты не мешают: тест проверяет только порядок
+    return OutboundQueue(global_rate=1000, private_rate=1000, group_rate=60000, burst=1000, workers=1)
+
+
+def _submit(queue, level, chat_id, func, *args):
+    with priority(level):
+        return queue.submit(chat_id, func, *args)
+
+
+def test_chat_requests_keep_fifo_order(queue):
+    recorder = Recorder()
+    # Пока тест держит блокировку очереди, диспетчер ничего не отправляет
+    with queue._cond:
+        futures = [
+            _submit(queue, PRIORITY_ANIMATION, 1, recorder.call, "frame1"),
+            _submit(queue, PRIORITY_ANIMATION, 1, recorder.call, "frame2"),
+            _submit(queue, PRIORITY_BULK, 1, recorder.call, "bulk"),
+            # Срочный запрос поднимает весь чат, но уходит после стоящих раньше
+            _submit(queue, PRIORITY_PAYMENT, 1, recorder.call, "payment"),
+            _submit(queue, PRIORITY_ANIMATION, 1, recorder.call, "frame3"),
+        ]
+    assert [future.result(5) for future in futures] == ["frame1", "frame2", "bulk", "payment", "frame3"]
+    assert recorder.log == ["frame1", "frame2", "bulk", "payment", "frame3"]
+
+
+def test_priority_picks_the_next_chat(queue):
+    recorder = Recorder()
+    with queue._cond:
+        futures = [
+            _submit(queue, PRIORITY_BULK, 1, recorder.call, "bulk"),
+            _submit(queue, PRIORITY_ANIMATION, 2, recorder.call, "animation"),
+            _submit(queue, PRIORITY_ANIMATION, 3, recorder.call, "animation-then-payment"),
+            _submit(queue, PRIORITY_PAYMENT, 3, recorder.call, "payment"),
+            _submit(queue, PRIORITY_INTERACTIVE, None, recorder.call, "no-chat"),
+        ]
+    for future in futures:
+        future.result(5)
+    # Платеж поднял чат 3 первым; его второй запрос ждет завершения первого
+    assert recorder.log[0] == "animation-then-payment"
+    assert [label for label in recorder.log if label != "payment"] == [
+        "animation-then-payment", "no-chat", "animation", "bulk"]
+    assert "payment" in recorder.log
+
+
+def test_one_heap_entry_per_chat(queue):
+    recorder = Recorder()
+    with queue._cond:
+        futures = [_submit(queue, PRIORITY_ANIMATION, 1 + i % 2, recorder.call, i) for i in range(20)]
+        futures.append(_submit(queue, PRIORITY_PAYMENT, 1, recorder.call, "payment"))
+        assert len(queue._heap) == 2
+        assert queue.stats()["queued"] == {"payment": 1, "interactive": 0, "animation": 20, "bulk": 0}
+    for future in futures:
+        future.result(5)
+    chat_1 = [label for label in recorder.log if label == "payment" or label % 2 == 0]
+    assert chat_1 == list(range(0, 20, 2)) + ["payment"]
+    stats = queue.stats()
+    assert stats["queued"] == {"payment": 0, "interactive": 0, "animation": 0, "bulk": 0}
+    assert stats["sent"] == 21
+    with queue._cond:
+        assert queue._heap == [] and queue._lanes == {}
+
+
+def test_429_retries_in_place(queue):
+    recorder = Recorder()
+    attempts = []
+
+    def flaky(label):
+        attempts.append(label)
+        if len(attempts) == 1:
+            raise TooManyRequests(0.05)
+        return recorder.call(label)
+
+    first = _submit(queue, PRIORITY_INTERACTIVE, 1, flaky, "first")
+    second = _submit(queue, PRIORITY_PAYMENT, 1, recorder.call, "second")
+    other = _submit(queue, PRIORITY_BULK, 2, recorder.call, "other chat")
+    assert first.result(5) == "first"
+    assert second.result(5) == "second"
+    assert other.result(5) == "other chat"
+    # Чат 2 не ждет паузы чата 1; повтор в чате 1 идет раньше следующего запроса
+    assert recorder.log.index("first") < recorder.log.index("second")
+    assert attempts == ["first", "first"]
+    stats = queue.stats()
+    assert (stats["rate_limited"], stats["retries"], stats["sent"]) == (1, 1, 3)
+    assert sum(stats["queued"].values()) == 0 and stats["inflight"] == 0
+    with queue._cond:
+        assert queue._heap == [] and queue._lanes == {}
+
+
+def test_429_gives_up_after_max_retries():
+    queue = OutboundQueue(global_rate=1000, private_rate=1000, burst=1000, workers=2, max_retries=2)
+
+    def always_limited():
+        raise TooManyRequests(0.01)
+
+    failed = queue.submit(1, always_limited)
+    with pytest.raises(TooManyRequests):
+        failed.result(5)
+    # Чат не остается занятым после отказа
+    assert queue.submit(1, lambda: "next").result(5) == "next"
+    assert queue.stats()["rate_limited"] == 2
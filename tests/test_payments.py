@@ -0,0 +1,248 @@
+"""Счета CryptoBot: вебхуки invoice_paid, опрос getInvoices и просрочка"""
+import json
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import pytest
+import database
+import utils
+from payments import paid_invoice_ids, credit_webhook_updates, poll_pending_payments, sweep_expired_payments
+from webhook import WebhookServer, WebhookEndpoint, replay, cryptobot_signature_verifier
+
+CRYPTOBOT_UPDATES = os.path.join(os.path.dirname(__file__), "fixtures", "cryptobot_updates.jsonl")
+CRYPTOBOT_TOKEN = "123:test"
+PAID_INVOICE = 424242
+
+
+def _recorded():
+    with open(CRYPTOBOT_UPDATES, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def _balance(uid):
+    return database.get_user(uid)[2]
+
+
+@pytest.fixture
+def payer():
+    uid = 7_100_001
+    database.create_user(uid, "payer")
+    database.create_payment(uid, 50, str(PAID_INVOICE))
+    yield uid
+    with database.transaction():
+        database.cursor.execute("DELETE FROM payments WHERE user_id=?", (uid,))
+        database.cursor.execute("DELETE FROM transactions WHERE user_id=?", (uid,))
+        database.cursor.execute("DELETE FROM users WHERE user_id=?", (uid,))
+    database.user_cache.invalidate(uid)
+
+
+class StubCryptoBot:
+    """Заглушка CryptoBot API: getInvoices по состояниям счетов, сбои по очереди"""
+
+    def __init__(self):
+        self.statuses = {}
+        self.failures = []  # коды ответов для следующих запросов
+        self.requests = []
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                url = urlparse(self.path)
+                ids = parse_qs(url.query).get("invoice_ids", [""])[0].split(",")
+                stub.requests.append(ids)
+                if url.path != "/getInvoices":
+                    self._reply(404, {"ok": False})
+                elif stub.failures:
+                    self._reply(stub.failures.pop(0), {"ok": False})
+                else:
+                    items = [{"invoice_id": int(i), "status": stub.statuses[i]} for i in ids if i in stub.statuses]
+                    self._reply(200, {"ok": True, "result": {"items": items}})
+
+            def _reply(self, status, body):
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", 0), Handler)
+        self.url = f"http://127.0.0.1:{self._httpd.server_port}"
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+
+    def shutdown(self):
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+
+@pytest.fixture
+def cryptobot(monkeypatch):
+    stub = StubCryptoBot()
+    monkeypatch.setattr(utils, "CRYPTOBOT_API_URL", stub.url)
+    monkeypatch.setattr(utils, "_cryptobot_session", None)
+    # Те же повторы, что в боте, но без пауз между ними
+    adapter = utils.get_cryptobot_session().get_adapter(stub.url)
+    adapter.max_retries = adapter.max_retries.new(backoff_factor=0)
+    yield stub
+    stub.shutdown()
+
+
+@pytest.fixture
+def pending():
+    """Пять живых счетов одного пользователя"""
+    uid = 7_100_002
+    invoices = [str(800_001 + i) for i in range(5)]
+    database.create_user(uid, "poller")
+    for invoice_id in invoices:
+        database.create_payment(uid, 10, invoice_id)
+    yield uid, invoices
+    with database.transaction():
+        database.cursor.execute("DELETE FROM payments WHERE user_id=?", (uid,))
+        database.cursor.execute("DELETE FROM transactions WHERE user_id=?", (uid,))
+        database.cursor.execute("DELETE FROM users WHERE user_id=?", (uid,))
+    database.user_cache.invalidate(uid)
+
+
+def test_get_invoices_retries_5xx(cryptobot):
+    cryptobot.statuses = {"1": "paid", "2": "active"}
+    cryptobot.failures = [502, 503]
+    assert utils.get_cryptobot_invoices([1, 2]) == {"1": "paid", "2": "active"}
+    assert len(cryptobot.requests) == 3
+
+
+def test_get_invoices_returns_none_on_error(cryptobot):
+    # Повторы кончились
+    cryptobot.failures = [500] * 4
+    assert utils.get_cryptobot_invoices([1]) is None
+    assert len(cryptobot.requests) == 4
+    # Ошибка клиента не повторяется
+    cryptobot.failures = [400]
+    assert utils.get_cryptobot_invoices([1]) is None
+    assert len(cryptobot.requests) == 5
+    assert utils.get_cryptobot_invoices([]) == {}
+
+
+def test_poll_batches_by_batch_size(cryptobot, pending):
+    uid, invoices = pending
+    cryptobot.statuses = {invoice_id: "paid" for invoice_id in invoices[:3]}
+    notified = []
+    assert poll_pending_payments(on_credited=lambda *args: notified.append(args), batch_size=2) == 3
+    assert sorted(sum(cryptobot.requests, [])) == invoices
+    assert [len(ids) for ids in cryptobot.requests] == [2, 2, 1]
+    assert notified == [(uid, 10)] * 3
+    assert set(database.get_pending_payments()) == set(invoices[3:])
+
+
+def test_poll_keeps_failed_batch_pending(cryptobot, pending):
+    uid, invoices = pending
+    cryptobot.statuses = {invoice_id: "paid" for invoice_id in invoices}
+    # Первая пачка получает 400: get_cryptobot_invoices возвращает None
+    cryptobot.failures = [400]
+    before = _balance(uid)
+    assert poll_pending_payments(batch_size=2) == 3
+    assert _balance(uid) == before + 30
+    assert len(database.get_pending_payments()) == 2
+    # Следующий опрос их подбирает
+    assert poll_pending_payments(batch_size=2) == 2
+    assert database.get_pending_payments() == []
+
+
+def _make_due(invoices):
+    with database.transaction():
+        database.cursor.executemany(
+            "UPDATE payments SET expires_at=? WHERE invoice_id=?",
+            [(int(time.time()) - 1, invoice_id) for invoice_id in invoices]
+        )
+
+
+def _status(invoice_id):
+    return database.get_payment_by_invoice(invoice_id)[4]
+
+
+def test_expire_payments_skips_paid(pending):
+    uid, invoices = pending
+    database.credit_paid_payments([invoices[0]])
+    assert database.expire_payments(invoices[:2]) == 1
+    assert [_status(i) for i in invoices[:2]] == ["paid", "expired"]
+    # Повторно просрочить уже закрытый счет нельзя
+    assert database.expire_payments(invoices[:2]) == 0
+    assert database.expire_payments([]) == 0
+
+
+def test_payment_after_expiry_is_credited_once(pending):
+    uid, invoices = pending
+    database.expire_payments([invoices[0]])
+    before = _balance(uid)
+    assert database.credit_paid_payments([invoices[0]]) == [(invoices[0], uid, 10)]
+    assert database.credit_paid_payments([invoices[0]]) == []
+    assert _status(invoices[0]) == "paid"
+    assert _balance(uid) == before + 10
+
+
+def test_sweep_credits_late_payments_and_expires_the_rest(cryptobot, pending):
+    uid, invoices = pending
+    _make_due(invoices)
+    cryptobot.statuses = {invoices[0]: "paid", invoices[1]: "active"}
+    notified = []
+    stats = sweep_expired_payments(on_credited=lambda *args: notified.append(args), batch_size=2)
+    assert (stats["checked"], stats["credited"], stats["expired"]) == (5, 1, 4)
+    assert notified == [(uid, 10)]
+    assert [_status(i) for i in invoices] == ["paid"] + ["expired"] * 4
+    assert database.get_due_payments() == []
+
+
+def test_sweep_skips_batch_when_api_fails(cryptobot, pending):
+    uid, invoices = pending
+    _make_due(invoices)
+    # Первая пачка без ответа API (statuses is None) не закрывается
+    cryptobot.failures = [400]
+    stats = sweep_expired_payments(batch_size=3)
+    assert (stats["checked"], stats["expired"]) == (2, 2)
+    assert len(database.get_due_payments()) == 3
+    stats = sweep_expired_payments(batch_size=3)
+    assert (stats["checked"], stats["expired"]) == (3, 3)
+    assert all(_status(i) == "expired" for i in invoices)
+
+
+def test_paid_invoice_ids_skips_malformed_updates():
+    updates = _recorded() + ["not an update", {"update_type": "invoice_paid", "payload": {"invoice_id": "x", "status": "paid"}}]
+    assert paid_invoice_ids(updates) == [PAID_INVOICE]
+
+
+class CreditingHandler:
+    """Обработчик эндпоинта /cryptobot, как в bot.py: зачисление и уведомления"""
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.handled = 0
+        self.notified = []
+        self.done = threading.Event()
+
+    def __call__(self, updates):
+        credit_webhook_updates(updates, on_credited=lambda user_id, amount: self.notified.append((user_id, amount)))
+        self.handled += len(updates)
+        if self.handled >= self.expected:
+            self.done.set()
+
+
+def test_signed_invoice_paid_delivered_twice_credits_once(payer):
+    handler = CreditingHandler(2 * len(_recorded()))
+    server = WebhookServer(host="127.0.0.1", port=0)
+    server.add_endpoint(WebhookEndpoint("/cryptobot", handler, verify=cryptobot_signature_verifier(CRYPTOBOT_TOKEN)))
+    port = server.start()
+    try:
+        before = _balance(payer)
+        # CryptoBot повторяет доставку, если не дождался ответа
+        for _ in range(2):
+            replay(f"http://127.0.0.1:{port}/cryptobot", CRYPTOBOT_UPDATES, cryptobot_token=CRYPTOBOT_TOKEN)
+        assert handler.done.wait(5)
+    finally:
+        server.shutdown()
+    assert _balance(payer) == before + 50
+    assert handler.notified == [(payer, 50)]
+    assert database.get_payment_by_invoice(str(PAID_INVOICE))[4] == "paid"
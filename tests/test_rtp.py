@@ -0,0 +1,59 @@
+"""Короткий прогон rtp.run: отчет строится по всем играм и сходится с теорией"""
+import pytest
+
+pytest.importorskip("numpy")
+pytest.importorskip("telebot")
+
+import rtp
+from config import MIN_BET
+
+ROUNDS = 50_000
+
+
+@pytest.fixture(scope="module")
+def results():
+    return rtp.run(ROUNDS, bet=100, seed=7)
+
+
+def test_run_covers_every_game(results):
+    names = [name for name, _, _, _ in results]
+    assert names == list(rtp.build_games(100))
+    for name, summary, _, seconds in results:
+        assert summary["rounds"] == ROUNDS, name
+        assert seconds >= 0
+
+
+def test_rtp_matches_theory(results):
+    for name, summary, expected, _ in results:
+        if expected is None:
+            continue
+        if summary["rtp"] is None:
+            # Бесплатный сундук: сравнивается средняя награда
+            assert summary["mean_payout"] == pytest.approx(expected, rel=0.05), name
+            continue
+        theory = expected / summary["stake"]
+        # Запас в два 95%-интервала (~4 сигмы), чтобы тест не зависел от сида
+        assert abs(summary["rtp"] - theory) <= 2 * summary["ci95"] + 1e-9, name
+
+
+def test_histogram_shares_sum_to_one(results):
+    for name, summary, _, _ in results:
+        assert sum(share for _, _, share in summary["histogram"]) == pytest.approx(1.0), name
+
+
+def test_bet_is_raised_to_min_bet():
+    (name, summary, _, _), = rtp.run(1000, bet=1, seed=1, names=["dice"])
+    assert name == "dice"
+    assert summary["stake"] == MIN_BET
+
+
+def test_same_seed_same_report():
+    first = rtp.run(2000, bet=50, seed=3, names=["roulette", "blackjack"])
+    second = rtp.run(2000, bet=50, seed=3, names=["roulette", "blackjack"])
+    assert [s for _, s, _, _ in first] == [s for _, s, _, _ in second]
+
+
+def test_format_report_lists_games(results):
+    report = rtp.format_report(results, histograms=True)
+    for name, _, _, _ in results:
+        assert name in report
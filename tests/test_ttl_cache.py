@@ -0,0 +1,35 @@
+"""TTLCache: ограничение размера с вытеснением LRU и срок жизни записей"""
+import time
+from utils import TTLCache
+
+
+def test_evicts_least_recently_read():
+    cache = TTLCache(max_size=3)
+    for key in "abc":
+        cache.set(key, key.upper(), ttl=60)
+    assert cache.get("a") == "A"
+    cache.set("d", "D", ttl=60)
+    assert len(cache) == 3
+    assert cache.get("b") is None
+    assert [cache.get(key) for key in "acd"] == ["A", "C", "D"]
+
+
+def test_expired_entries_are_dropped():
+    cache = TTLCache(max_size=10)
+    cache.set("short", 1, ttl=0.05)
+    cache.set("long", 2, ttl=60)
+    time.sleep(0.06)
+    assert cache.get("short", "missing") == "missing"
+    assert cache.get("long") == 2
+    assert len(cache) == 1
+
+
+def test_set_refreshes_value_and_ttl():
+    cache = TTLCache(max_size=2)
+    cache.set("a", 1, ttl=0.05)
+    cache.set("a", 2, ttl=60)
+    time.sleep(0.06)
+    assert cache.get("a") == 2
+    cache.pop("a")
+    cache.pop("missing")
+    assert cache.get("a") is None
@@ -0,0 +1,79 @@
+"""Режим вебхука: записанные обновления отправляются на WebhookServer через replay()"""
+import json
+import os
+import threading
+import urllib.error
+import pytest
+from webhook import (
+    WebhookServer, WebhookEndpoint, replay, telegram_secret_verifier, cryptobot_signature_verifier,
+)
+
+UPDATES = os.path.join(os.path.dirname(__file__), "fixtures", "webhook_updates.jsonl")
+CRYPTOBOT_UPDATES = os.path.join(os.path.dirname(__file__), "fixtures", "cryptobot_updates.jsonl")
+SECRET = "test-secret"
+CRYPTOBOT_TOKEN = "123:test"
+
+
+def _recorded(path=UPDATES):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+class Collector:
+    def __init__(self, expected):
+        self.updates = []
+        self.expected = expected
+        self.done = threading.Event()
+
+    def __call__(self, updates):
+        self.updates.extend(updates)
+        if len(self.updates) >= self.expected:
+            self.done.set()
+
+
+@pytest.fixture
+def server():
+    server = WebhookServer(host="127.0.0.1", port=0)
+    telegram = Collector(len(_recorded()))
+    cryptobot = Collector(len(_recorded(CRYPTOBOT_UPDATES)))
+    server.add_endpoint(WebhookEndpoint("/webhook", telegram, verify=telegram_secret_verifier(SECRET)))
+    server.add_endpoint(WebhookEndpoint("/cryptobot", cryptobot, verify=cryptobot_signature_verifier(CRYPTOBOT_TOKEN)))
+    port = server.start()
+    yield f"http://127.0.0.1:{port}", telegram, cryptobot, server
+    server.shutdown()
+
+
+def test_replay_with_secret_is_dispatched(server):
+    url, telegram, _, webhook_server = server
+    assert replay(f"{url}/webhook", UPDATES, secret_token=SECRET) == len(_recorded())
+    assert telegram.done.wait(5)
+    assert telegram.updates == _recorded()
+    assert webhook_server.stats()["/webhook"]["received"] == len(_recorded())
+
+
+def test_replay_without_secret_is_rejected(server):
+    url, telegram, _, webhook_server = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        replay(f"{url}/webhook", UPDATES)
+    assert error.value.code == 403
+    with pytest.raises(urllib.error.HTTPError) as error:
+        replay(f"{url}/webhook", UPDATES, secret_token="wrong")
+    assert error.value.code == 403
+    assert not telegram.done.wait(0.2)
+    assert telegram.updates == []
+    assert webhook_server.stats()["/webhook"]["rejected"] == 2
+
+
+def test_cryptobot_signature(server):
+    url, _, cryptobot, _ = server
+    with pytest.raises(urllib.error.HTTPError) as error:
+        replay(f"{url}/cryptobot", CRYPTOBOT_UPDATES, cryptobot_token="other:token")
+    assert error.value.code == 403
+    assert replay(f"{url}/cryptobot", CRYPTOBOT_UPDATES, cryptobot_token=CRYPTOBOT_TOKEN) == len(_recorded(CRYPTOBOT_UPDATES))
+    assert cryptobot.done.wait(5)
+    assert cryptobot.updates == _recorded(CRYPTOBOT_UPDATES)
+
+
+def test_empty_secret_fails_closed():
+    assert telegram_secret_verifier("")({}, b"{}") is False
+    assert cryptobot_signature_verifier("")({}, b"{}") is False
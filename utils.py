@@ -2,11 +2,16 @@ import time
 import logging
 import random
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import json
 import os
+import threading
+from collections import OrderedDict
 from functools import wraps
 from datetime import datetime, timedelta
-from config import CRYPTOBOT_TOKEN, CRYPTOBOT_API_URL, ALMAZ_PRICE_USD, ALMAZ_PACKAGES, RATE_LIMIT_SECONDS
+from config import (CRYPTOBOT_TOKEN, CRYPTOBOT_API_URL, ALMAZ_PRICE_USD, ALMAZ_PACKAGES, RATE_LIMIT_SECONDS,
+                    PAYMENT_INVOICE_TTL)
 
 # Добавляем глобальную переменную для бота
 bot_instance = None
@@ -26,6 +31,110 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+class TTLCache:
+    """LRU-кэш со сроком жизни записей: не больше max_size ключей, давно не читанные вытесняются"""
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        self._items = OrderedDict()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, key, default=None):
+        now = time.time()
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            if item[1] <= now:
+                del self._items[key]
+                return default
+            self._items.move_to_end(key)
+            return item[0]
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._items[key] = (value, time.time() + ttl)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+
+    def pop(self, key):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+class BotInfo:
+    """Данные бота из get_me(): запрашиваются один раз и обновляются в фоне"""
+
+    def __init__(self):
+        self._me = None
+        self._lock = threading.Lock()
+        self._thread = None
+
+    def refresh(self, bot=None):
+        bot = bot or bot_instance
+        if bot is None:
+            return None
+        try:
+            me = bot.get_me()
+        except Exception as e:
+            logger.error(f"Failed to load bot info: {e}")
+            return None
+        with self._lock:
+            self._me = me
+        return me
+
+    def start(self, bot, refresh_interval=3600):
+        """Загрузить данные сейчас и обновлять раз в refresh_interval секунд"""
+        self.refresh(bot)
+        if self._thread is not None:
+            return
+
+        def loop():
+            while True:
+                time.sleep(refresh_interval)
+                self.refresh(bot)
+        self._thread = threading.Thread(target=loop, name="bot-info", daemon=True)
+        self._thread.start()
+
+    def _get(self, field, default=None):
+        me = self._me
+        if me is None:
+            # Не загрузились при старте - пробуем еще раз при первом обращении
+            me = self.refresh()
+        return getattr(me, field, default) if me is not None else default
+
+    @property
+    def username(self):
+        return self._get("username", "your_bot_username")
+
+    @property
+    def id(self):
+        return self._get("id")
+
+    @property
+    def can_join_groups(self):
+        return self._get("can_join_groups", False)
+
+    @property
+    def can_read_all_group_messages(self):
+        return self._get("can_read_all_group_messages", False)
+
+    @property
+    def supports_inline_queries(self):
+        return self._get("supports_inline_queries", False)
+
+    def referral_link(self, uid):
+        return f"https://t.me/{self.username}?start={uid}"
+
+bot_info = BotInfo()
+
 # Рейт-лимит для защиты от спама
 rate_limits = {}
 last_message_time = {}
@@ -135,14 +244,6 @@ def format_profile(user_data, level_info=None, is_admin=False):
     
     achievements = get_achievements_text(user_data)
     
-    # Получаем username бота для ссылки
-    bot_username = "your_bot_username"
-    if bot_instance:
-        try:
-            bot_username = bot_instance.get_me().username
-        except:
-            pass
-    
     level_text = ""
     if level_info:
         level, exp, total_exp, achievements_count = level_info
@@ -173,7 +274,7 @@ def format_profile(user_data, level_info=None, is_admin=False):
 {achievements}
 
 <b>🔗 Реф. ссылка:</b>
-<code>https://t.me/{bot_username}?start={user_data[0]}</code>
+<code>{bot_info.referral_link(user_data[0])}</code>
 
 💎 Приглашайте друзей и получайте:
 • +10💎 за каждого друга
@@ -374,6 +475,19 @@ def format_lottery_history(history_data):
     
     return text
 
+def format_top_position(position, format_value, shown=10):
+    """Место пользователя в топе и его соседи по рейтингу"""
+    rank, rows = position
+    if rank is None:
+        return ""
+    text = f"\n📍 <b>Ваше место: {rank}</b>\n"
+    if rank <= shown:
+        return text
+    for place, username, *values in rows:
+        marker = "👉 " if place == rank else ""
+        text += f"{marker}{place}. @{username or 'Неизвестно'} - {format_value(*values)}\n"
+    return text
+
 def format_activity_info(activity_data, streak_days):
     if not activity_data:
         return "❌ Нет данных об активности"
@@ -437,77 +551,51 @@ def check_event():
     
     return events
 
-def animate_case_opening(bot, chat_id, message_id, case_emoji="🎁"):
-    """Анимация открытия сундука"""
-    import time
-    
-    try:
-        # Анимация встряхивания
-        for _ in range(3):
-            for emoji in ["🎁", "📦", "🎊", "🎉"]:
-                try:
-                    safe_edit_message_text(bot, f"{emoji} Открываем сундук...", chat_id, message_id)
-                    time.sleep(0.2)
-                except:
-                    pass
-        
-        # Анимация блеска
-        for _ in range(2):
-            try:
-                safe_edit_message_text(bot, f"✨ {case_emoji} ✨", chat_id, message_id)
-                time.sleep(0.3)
-                safe_edit_message_text(bot, f"{case_emoji} ✨", chat_id, message_id)
-                time.sleep(0.3)
-                safe_edit_message_text(bot, f"✨ {case_emoji}", chat_id, message_id)
-                time.sleep(0.3)
-            except:
-                pass
-    except Exception as e:
-        logger.error(f"Error in case animation: {e}")
-
-def animate_slot_spin(bot, chat_id, message_id):
-    """Анимация вращения слотов"""
-    import time
+def case_opening_frames(case_emoji="🎁"):
+    """Кадры анимации открытия сундука: [(текст, задержка)]"""
+    # Анимация встряхивания
+    frames = [(f"{emoji} Открываем сундук...", 0.2) for _ in range(3) for emoji in ["🎁", "📦", "🎊", "🎉"]]
+    # Анимация блеска
+    for _ in range(2):
+        frames += [(f"✨ {case_emoji} ✨", 0.3), (f"{case_emoji} ✨", 0.3), (f"✨ {case_emoji}", 0.3)]
+    return frames
+
+def slot_spin_frames():
+    """Кадры анимации вращения слотов: [(текст, задержка)]"""
     symbols = ["🍒", "🍋", "⭐", "7️⃣", "🔔", "💎"]
-    
-    try:
-        # Быстрая прокрутка
-        for i in range(8):
-            try:
-                if i < 3:
-                    delay = 0.1
-                elif i < 6:
-                    delay = 0.2
-                else:
-                    delay = 0.3
-                
-                # Генерируем случайные символы для анимации
-                spin_symbols = [random.choice(symbols) for _ in range(3)]
-                animation_text = f"🎰 {' '.join(spin_symbols)}"
-                
-                if i < 6:
-                    safe_edit_message_text(bot, f"🎰 Вращаем... {animation_text}", chat_id, message_id)
-                else:
-                    safe_edit_message_text(bot, f"🎰 Замедляемся... {animation_text}", chat_id, message_id)
-                
-                time.sleep(delay)
-            except:
-                pass
-        
-        # Финальная пауза
-        time.sleep(0.5)
-        
-    except Exception as e:
-        logger.error(f"Error in slot animation: {e}")
+    frames = []
+    # Быстрая прокрутка с замедлением
+    for i in range(8):
+        delay = 0.1 if i < 3 else 0.2 if i < 6 else 0.3
+        spin_symbols = " ".join(random.choice(symbols) for _ in range(3))
+        if i < 6:
+            frames.append((f"🎰 Вращаем... 🎰 {spin_symbols}", delay))
+        else:
+            frames.append((f"🎰 Замедляемся... 🎰 {spin_symbols}", delay))
+    return frames
 
 # CryptoBot API функции
+_cryptobot_session = None
+_cryptobot_session_lock = threading.Lock()
+
+def get_cryptobot_session():
+    """Общая HTTP-сессия CryptoBot: keep-alive соединения и повторы GET с паузой"""
+    global _cryptobot_session
+    with _cryptobot_session_lock:
+        if _cryptobot_session is None:
+            session = requests.Session()
+            # POST (createInvoice) не повторяем, чтобы не создать два счета
+            retry = Retry(total=3, backoff_factor=0.5, status_forcelist=(429, 500, 502, 503, 504),
+                          allowed_methods=frozenset({"GET"}))
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=10, max_retries=retry)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            session.headers["Crypto-Pay-API-Token"] = CRYPTOBOT_TOKEN
+            _cryptobot_session = session
+        return _cryptobot_session
+
 def create_cryptobot_invoice(amount_usd, description="Пополнение алмазов"):
     """Создать счет в CryptoBot"""
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN,
-        "Content-Type": "application/json"
-    }
-    
     data = {
         "amount": str(amount_usd),
         "asset": "USDT",  # Можно изменить на TON, SOL и т.д.
@@ -515,11 +603,13 @@ def create_cryptobot_invoice(amount_usd, description="Пополнение ал
         "hidden_message": "Спасибо за покупку!",
         "paid_btn_name": "viewItem",
         "paid_btn_url": "https://t.me/darkcase_bot",
-        "payload": json.dumps({"type": "almaz_purchase"})
+        "payload": json.dumps({"type": "almaz_purchase"}),
+        # CryptoBot сам закрывает счет к тому же сроку, когда мы перестаем его опрашивать
+        "expires_in": PAYMENT_INVOICE_TTL
     }
     
     try:
-        response = requests.post(f"{CRYPTOBOT_API_URL}/createInvoice", headers=headers, json=data, timeout=10)
+        response = get_cryptobot_session().post(f"{CRYPTOBOT_API_URL}/createInvoice", json=data, timeout=10)
         if response.status_code == 200:
             result = response.json()
             if result.get("ok"):
@@ -538,19 +628,25 @@ def create_cryptobot_invoice(amount_usd, description="Пополнение ал
 
 def check_cryptobot_invoice(invoice_id):
     """Проверить статус счета в CryptoBot"""
-    headers = {
-        "Crypto-Pay-API-Token": CRYPTOBOT_TOKEN
+    statuses = get_cryptobot_invoices([invoice_id]) or {}
+    return statuses.get(str(invoice_id))
+
+def get_cryptobot_invoices(invoice_ids):
+    """Статусы счетов одним запросом getInvoices: {invoice_id: status} или None при ошибке"""
+    if not invoice_ids:
+        return {}
+    params = {
+        "invoice_ids": ",".join(str(invoice_id) for invoice_id in invoice_ids),
+        "count": len(invoice_ids),
     }
     
     try:
-        response = requests.get(f"{CRYPTOBOT_API_URL}/getInvoices?invoice_ids={invoice_id}", 
-                               headers=headers, timeout=10)
+        response = get_cryptobot_session().get(f"{CRYPTOBOT_API_URL}/getInvoices", params=params, timeout=10)
         if response.status_code == 200:
             result = response.json()
             if result.get("ok"):
                 invoices = result.get("result", {}).get("items", [])
-                if invoices:
-                    return invoices[0].get("status")
+                return {str(invoice.get("invoice_id")): invoice.get("status") for invoice in invoices}
     except requests.exceptions.Timeout:
         logger.error("CryptoBot check timeout")
     except requests.exceptions.ConnectionError:
@@ -0,0 +1,186 @@
+import argparse
+import hashlib
+import hmac
+import json
+import queue
+import threading
+import urllib.request
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from utils import logger
+
+TELEGRAM_SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+CRYPTOBOT_SIGNATURE_HEADER = "Crypto-Pay-Api-Signature"
+MAX_BODY_SIZE = 1024 * 1024
+
+def telegram_secret_verifier(secret_token):
+    """Проверка секретного токена, заданного в setWebhook; без токена запросы отклоняются"""
+    def verify(headers, body):
+        if not secret_token:
+            return False
+        return hmac.compare_digest(headers.get(TELEGRAM_SECRET_HEADER, ""), secret_token)
+    return verify
+
+def cryptobot_signature(token, body):
+    """Подпись CryptoBot: HMAC-SHA256 тела с ключом sha256(токена)"""
+    secret = hashlib.sha256(token.encode("utf-8")).digest()
+    return hmac.new(secret, body, hashlib.sha256).hexdigest()
+
+def cryptobot_signature_verifier(token):
+    def verify(headers, body):
+        if not token:
+            return False
+        return hmac.compare_digest(headers.get(CRYPTOBOT_SIGNATURE_HEADER, ""), cryptobot_signature(token, body))
+    return verify
+
+
+class WebhookHandler(BaseHTTPRequestHandler):
+    def do_POST(self):
+        endpoint = self.server.endpoints.get(self.path.split("?", 1)[0])
+        if endpoint is None:
+            self._reply(404)
+            return
+        length = int(self.headers.get("Content-Length") or 0)
+        if length <= 0 or length > MAX_BODY_SIZE:
+            self._reply(413 if length else 400)
+            return
+        body = self.rfile.read(length)
+        if endpoint.verify is not None and not endpoint.verify(self.headers, body):
+            endpoint.rejected += 1
+            self._reply(403)
+            return
+        try:
+            update = json.loads(body)
+        except ValueError:
+            self._reply(400)
+            return
+        # Отвечаем сразу; при переполнении очереди отправитель повторит доставку
+        self._reply(200 if endpoint.enqueue(update) else 503)
+
+    def do_GET(self):
+        # Проверка живости для балансировщика
+        self._reply(200 if self.path == "/health" else 404)
+
+    def _reply(self, status):
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        logger.debug(f"Webhook {self.address_string()}: {format % args}")
+
+
+class WebhookEndpoint:
+    """Адрес вебхука: проверка запроса, очередь и поток обработки.
+
+    HTTP-поток проверяет подпись, кладет обновление в очередь и сразу
+    отвечает 200. Отдельный поток забирает обновления пачками и передает
+    их в handle_updates.
+    """
+
+    def __init__(self, path, handle_updates, verify=None, max_queue=10000, batch_size=100):
+        self.path = path
+        self.handle_updates = handle_updates
+        self.verify = verify
+        self.batch_size = batch_size
+        self._queue = queue.Queue(max_queue)
+        self.received = 0
+        self.rejected = 0
+        self.dropped = 0
+
+    def enqueue(self, update):
+        try:
+            self._queue.put_nowait(update)
+        except queue.Full:
+            self.dropped += 1
+            return False
+        self.received += 1
+        return True
+
+    def start(self):
+        threading.Thread(target=self._dispatch, name=f"webhook{self.path.replace('/', '-')}", daemon=True).start()
+
+    def _dispatch(self):
+        while True:
+            batch = [self._queue.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self.handle_updates(batch)
+            except Exception as e:
+                logger.error(f"Error processing webhook updates on {self.path}: {e}")
+
+    def stats(self):
+        return {
+            "queued": self._queue.qsize(),
+            "received": self.received,
+            "rejected": self.rejected,
+            "dropped": self.dropped,
+        }
+
+
+class WebhookServer:
+    """HTTP-сервер для вебхуков (Telegram, CryptoBot) на одном порту"""
+
+    def __init__(self, host="0.0.0.0", port=8080):
+        self.host = host
+        self.port = port
+        self.endpoints = {}
+        self._httpd = None
+
+    def add_endpoint(self, endpoint):
+        self.endpoints[endpoint.path] = endpoint
+        return endpoint
+
+    def start(self):
+        """Поднять сервер и потоки обработки в фоне; возвращает фактический порт"""
+        self._httpd = ThreadingHTTPServer((self.host, self.port), WebhookHandler)
+        self._httpd.daemon_threads = True
+        self._httpd.endpoints = self.endpoints
+        for endpoint in self.endpoints.values():
+            endpoint.start()
+        threading.Thread(target=self._httpd.serve_forever, name="webhook-server", daemon=True).start()
+        logger.info(f"Webhook server listening on {self.host}:{self._httpd.server_port} "
+                    f"({', '.join(self.endpoints)})")
+        return self._httpd.server_port
+
+    def shutdown(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+    def stats(self):
+        return {path: endpoint.stats() for path, endpoint in self.endpoints.items()}
+
+
+def replay(url, path, secret_token="", cryptobot_token=""):
+    """Отправить на вебхук записанные обновления (JSON по одному на строку)"""
+    sent = 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            body = line.strip().encode("utf-8")
+            request = urllib.request.Request(url, data=body, method="POST")
+            request.add_header("Content-Type", "application/json")
+            if secret_token:
+                request.add_header(TELEGRAM_SECRET_HEADER, secret_token)
+            if cryptobot_token:
+                request.add_header(CRYPTOBOT_SIGNATURE_HEADER, cryptobot_signature(cryptobot_token, body))
+            with urllib.request.urlopen(request) as response:
+                response.read()
+            sent += 1
+    return sent
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Отправить записанные обновления на локальный вебхук")
+    parser.add_argument("url", help="например http://127.0.0.1:8080/webhook")
+    parser.add_argument("updates", help="файл с обновлениями, JSON по одному на строку")
+    parser.add_argument("--secret", default="", help="секретный токен вебхука Telegram")
+    parser.add_argument("--cryptobot-token", default="", help="подписать запросы токеном CryptoBot")
+    args = parser.parse_args()
+    count = replay(args.url, args.updates, args.secret, args.cryptobot_token)
+    print(f"Sent {count} updates")